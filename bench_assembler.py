@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+Assembler benchmark - measures front-end and full assembly throughput
+on a generated program, and the peak memory used while assembling it.
+Also times the bundled sample programs scaled up by repeating them.
+
+Usage: python bench_assembler.py [--lines N] [--scale N]
+"""
+
+import argparse
+import os
+import re
+import time
+import tracemalloc
+
+from risc_assembler import RiscAssembler
+
+# Loop body repeated to build the synthetic program; every 16th line opens a label
+BODY = [
+    "    add  x10, x10, x11      # accumulate",
+    "    sub  x12, x12, x13",
+    "    lw   x5, 8(x2)",
+    "    sw   x5, 12(x2)",
+    "    addi x1, x1, -1",
+    "    slli x6, x5, 2",
+    "    xor  x7, x6, x5",
+    "    lui  x8, 4096",
+    "    bne  x1, x0, {label}",
+    "",
+    "    # comment-only line",
+    "    andi x9, x7, 255",
+    "    or   x14, x9, x8",
+    "    jal  x0, {label}",
+    "    sltu x15, x14, x9",
+]
+
+def generate_program(num_lines):
+    """Generate an unrolled program with roughly num_lines source lines"""
+    lines = []
+    block = 0
+    while len(lines) < num_lines:
+        label = f"block_{block}"
+        lines.append(f"{label}:")
+        for line in BODY:
+            lines.append(line.format(label=label))
+        block += 1
+    return '\n'.join(lines[:num_lines]) + '\n'
+
+SAMPLE_PROGRAMS = ['fibonacci.s', 'full_instruction_test.s', 'ooo_benchmark.s']
+
+def scale_program(source, copies):
+    """Repeat a program copies times, renaming its labels in each copy"""
+    assembler = RiscAssembler()
+    assembler.first_pass(assembler.parse_source(source))
+    if not assembler.symbol_table:
+        return source * copies
+    label_re = re.compile(r'\b(' + '|'.join(map(re.escape, assembler.symbol_table)) + r')\b')
+    return ''.join(label_re.sub(lambda m, i=i: f"{m.group(1)}_{i}", source)
+                   for i in range(copies))
+
+def measure(func, repeat):
+    """Return the best wall-clock time of func over repeat runs"""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+def peak_memory(func):
+    """Return the peak traced allocation of func in bytes"""
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the RISC assembler")
+    parser.add_argument('--lines', type=int, default=1_000_000,
+                        help="number of source lines to generate (default: 1000000)")
+    parser.add_argument('--scale', type=int, default=10_000,
+                        help="repeat count for the sample programs, 0 to skip (default: 10000)")
+    parser.add_argument('--repeat', type=int, default=3,
+                        help="timing runs per measurement, best is reported (default: 3)")
+    args = parser.parse_args()
+
+    source = generate_program(args.lines)
+    print(f"Generated program: {args.lines} lines, {len(source) / 1e6:.1f} MB")
+
+    def tokenize_only():
+        RiscAssembler().parse_source(source)
+
+    def assemble_all():
+        RiscAssembler().assemble(source)
+
+    for name, func in (("tokenize", tokenize_only), ("assemble", assemble_all)):
+        elapsed = measure(func, args.repeat)
+        peak = peak_memory(func)
+        print(f"{name:10s} {elapsed:8.3f} s  {args.lines / elapsed:12,.0f} lines/s  "
+              f"peak {peak / 2**20:8.1f} MiB")
+
+    if args.scale <= 0:
+        return
+
+    print(f"\nSample programs scaled {args.scale}x:")
+    here = os.path.dirname(os.path.abspath(__file__))
+    for filename in SAMPLE_PROGRAMS:
+        with open(os.path.join(here, filename)) as f:
+            source = scale_program(f.read(), args.scale)
+        program = RiscAssembler().parse_source(source)
+
+        pairs = measure(lambda: RiscAssembler().assemble(source), args.repeat)
+        encode = measure(lambda: RiscAssembler().assemble_many(program), args.repeat)
+        count = len(RiscAssembler().assemble_many(program))
+        print(f"{filename:24s} {count:9d} instrs  assemble() {pairs:7.3f} s  "
+              f"assemble_many() {encode:7.3f} s  {count / encode:12,.0f} instrs/s")
+
+if __name__ == "__main__":
+    main()
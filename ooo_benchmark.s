@@ -4,6 +4,8 @@
 # - five independent accumulator chains in the loop body
 # - one loop counter branch
 # - final checksum stored to memory[0]
+# - loop cycles and instructions, read from the performance counters,
+#   stored to memory[1] and memory[2]
 # - x20 is set to 1 on completion
 
     addi x1,  x0, 2000   # loop count
@@ -19,7 +21,10 @@
     addi x18, x0, 9
     addi x19, x0, 10
 
-    addi x0,  x0, 0      # nop: align loop target to an 8-byte fetch boundary
+    rdcycle   x5         # start of the measured region
+    rdinstret x6
+
+    .align 3             # pad with a nop so the loop target sits on an 8-byte fetch boundary
 loop:
     add  x10, x10, x11
     add  x12, x12, x13
@@ -29,6 +34,13 @@ loop:
     addi x1,  x1, -1
     bne  x1,  x0, loop
 
+    rdcycle   x7         # end of the measured region
+    rdinstret x8
+    sub  x28, x7, x5
+    sub  x29, x8, x6
+    sw   x28, 4(x0)
+    sw   x29, 8(x0)
+
     add  x24, x10, x12
     add  x25, x14, x16
     add  x26, x18, x24
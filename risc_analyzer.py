@@ -0,0 +1,570 @@
+#!/usr/bin/env python3
+"""
+RISC Analyzer - Static hazard and CPI analysis of assembled programs
+
+Splits a program into basic blocks, builds its control-flow graph and natural
+loops, and applies the pipeline rules of rtl/cpu.v without running anything:
+an instruction whose raw rs1/rs2 field names the register loaded by the
+instruction just ahead of it stalls one cycle (hazard_detection.v), and every
+taken branch or jump flushes three slots. Blocks and loops are reported with
+their source labels and line numbers, as text or JSON, and loop CPIs can be
+checked against limits or a saved report.
+
+Usage: python risc_analyzer.py <program.s|program.hex|program.bin> [--json] [--max-cpi LOOP=CPI] [--baseline report.json]
+"""
+
+import argparse
+import heapq
+import json
+import os
+import sys
+
+from risc_assembler import RiscAssembler, load_use_stall, lost_branch, stale_jalr
+from risc_simulator import MASK32, OP_BRANCH, OP_JAL, OP_JALR, decode_b_imm, decode_j_imm, load_program
+
+# Cycles lost when a branch or jump is taken (IF/ID, ID/EX and EX/MEM are flushed)
+FLUSH_PENALTY = 3
+# Bubble inserted by hazard_detection.v behind a load
+LOAD_USE_PENALTY = 1
+
+# How a basic block ends
+EXIT_FALLTHROUGH = 'fallthrough'
+EXIT_BRANCH = 'branch'
+EXIT_JUMP = 'jump'
+EXIT_INDIRECT = 'indirect'
+EXIT_HALT = 'halt'
+EXIT_END = 'end'
+
+# CFG edge kinds
+EDGE_TAKEN = 'taken'
+EDGE_FALLTHROUGH = 'fallthrough'
+
+def control_transfer(word, address):
+    """(exit kind, target address) of a branch or jump at address, or None for other instructions"""
+    opcode = word & 0x7F
+    if opcode == OP_BRANCH:
+        target = (address + decode_b_imm(word)) & MASK32
+        funct3 = (word >> 12) & 0x7
+        if funct3 in (0b010, 0b011):
+            # branch_taken in cpu.v never fires for these encodings
+            return None
+        if target == address and (word >> 15) & 0x1F == (word >> 20) & 0x1F and funct3 in (0b000, 0b101, 0b111):
+            return (EXIT_HALT, target)
+        return (EXIT_BRANCH, target)
+    if opcode == OP_JAL:
+        target = (address + decode_j_imm(word)) & MASK32
+        return (EXIT_HALT if target == address else EXIT_JUMP, target)
+    if opcode == OP_JALR:
+        return (EXIT_INDIRECT, None)
+    return None
+
+class BasicBlock:
+    """Straight-line run of instructions with a single entry and exit"""
+
+    __slots__ = ('index', 'start', 'end', 'exit', 'successors', 'predecessors',
+                 'load_use', 'labels', 'lineno')
+
+    def __init__(self, index, start, end):
+        self.index = index
+        self.start = start
+        self.end = end
+        self.exit = EXIT_FALLTHROUGH
+        self.successors = []  # (block, edge kind, entry stall)
+        self.predecessors = []
+        self.load_use = 0
+        self.labels = []
+        self.lineno = None
+
+    @property
+    def instructions(self):
+        return (self.end - self.start) // 4
+
+    @property
+    def cycles(self):
+        """Cycles per execution when leaving through the fall-through path (any jump is taken)"""
+        cycles = self.instructions + self.load_use * LOAD_USE_PENALTY
+        if self.exit in (EXIT_JUMP, EXIT_INDIRECT, EXIT_HALT):
+            cycles += FLUSH_PENALTY
+        return cycles
+
+    @property
+    def name(self):
+        return self.labels[0] if self.labels else f"0x{self.start:08x}"
+
+    def edge_cycles(self, kind, entry_stall):
+        """Cycles spent executing this block and leaving it along an edge"""
+        cycles = self.instructions + (self.load_use + entry_stall) * LOAD_USE_PENALTY
+        if kind == EDGE_TAKEN:
+            cycles += FLUSH_PENALTY
+        return cycles
+
+class Iteration:
+    """One path through a loop from its header back to itself"""
+
+    __slots__ = ('path', 'instructions', 'load_use', 'flushes')
+
+    def __init__(self, steps):
+        self.path = [block for block, _, _ in steps]
+        self.instructions = sum(block.instructions for block, _, _ in steps)
+        self.load_use = sum(block.load_use + stall for block, _, stall in steps)
+        self.flushes = sum(kind == EDGE_TAKEN for _, kind, _ in steps)
+
+    @property
+    def cycles(self):
+        return (self.instructions + self.load_use * LOAD_USE_PENALTY +
+                self.flushes * FLUSH_PENALTY)
+
+    @property
+    def cpi(self):
+        return self.cycles / self.instructions if self.instructions else 0.0
+
+    def to_dict(self):
+        return {'path': [block.index for block in self.path], 'instructions': self.instructions,
+                'load_use_stalls': self.load_use, 'flushes': self.flushes,
+                'cycles': self.cycles, 'cpi': round(self.cpi, 4)}
+
+class Loop:
+    """Natural loop: a header, the blocks that reach its back edges, and its cheapest and costliest iterations
+
+    cycles are those of the costliest iteration and cpi the higher CPI of
+    the two, so a slower path through any part of the body shows in them.
+    """
+
+    def __init__(self, header, blocks):
+        self.header = header
+        self.blocks = blocks
+        self.parent = None
+        self.depth = 1
+        self.best = None
+        self.worst = None
+
+    @property
+    def name(self):
+        return self.header.name
+
+    @property
+    def cycles(self):
+        return self.worst.cycles if self.worst else 0
+
+    @property
+    def cpi(self):
+        return max((iteration.cpi for iteration in (self.best, self.worst) if iteration), default=0.0)
+
+class ProgramAnalysis:
+    """Basic blocks, loops and hazards of a program, with its source mapping"""
+
+    def __init__(self, words, symbol_table=None, records=None, name=None):
+        self.words = words
+        self.symbol_table = symbol_table or {}
+        self.records = records
+        self.name = name
+        self.hazards = []
+        # (block, successor) edges to a block dominating their source
+        self.back_edges = set()
+        self.blocks = self._build_blocks()
+        self._find_hazards()
+        self.loops = self._find_loops()
+
+    def lineno(self, address):
+        index = address >> 2
+        if self.records is not None and index < len(self.records):
+            return self.records[index].lineno
+        return None
+
+    def text(self, address):
+        """Source text of the instruction at address"""
+        index = address >> 2
+        if self.records is not None and index < len(self.records):
+            record = self.records[index]
+            return f"{record.mnemonic} {', '.join(record.operands)}".rstrip()
+        return f"0x{self.words[index]:08x}"
+
+    def _build_blocks(self):
+        words = self.words
+        end = 4 * len(words)
+        leaders = {0}
+        for index, word in enumerate(words):
+            address = 4 * index
+            transfer = control_transfer(word, address)
+            if transfer is not None:
+                leaders.add(address + 4)
+                if transfer[1] is not None and transfer[1] < end and not transfer[1] & 3:
+                    leaders.add(transfer[1])
+        starts = sorted(leader for leader in leaders if leader < end)
+
+        blocks = [BasicBlock(i, start, (starts[i + 1] if i + 1 < len(starts) else end))
+                  for i, start in enumerate(starts)]
+        by_start = {block.start: block for block in blocks}
+
+        labels = {}
+        for label, address in sorted(self.symbol_table.items(), key=lambda item: item[1]):
+            labels.setdefault(address, []).append(label)
+
+        for block in blocks:
+            block.labels = labels.get(block.start, [])
+            block.lineno = self.lineno(block.start)
+            for address in range(block.start, block.end - 4, 4):
+                if load_use_stall(words[address >> 2], words[(address >> 2) + 1]):
+                    block.load_use += 1
+
+            last = block.end - 4
+            transfer = control_transfer(words[last >> 2], last)
+            following = by_start.get(block.end)
+            if transfer is None:
+                if following is None:
+                    block.exit = EXIT_END
+                else:
+                    stall = 1 if load_use_stall(words[last >> 2], words[block.end >> 2]) else 0
+                    block.successors.append((following, EDGE_FALLTHROUGH, stall))
+                continue
+            block.exit, target = transfer
+            if block.exit in (EXIT_BRANCH, EXIT_JUMP) and target in by_start:
+                block.successors.append((by_start[target], EDGE_TAKEN, 0))
+            if block.exit == EXIT_BRANCH and following is not None:
+                block.successors.append((following, EDGE_FALLTHROUGH, 0))
+
+        for block in blocks:
+            for successor, _, _ in block.successors:
+                successor.predecessors.append(block)
+        return blocks
+
+    def _hazard(self, kind, address, cycles, message):
+        self.hazards.append({'kind': kind, 'address': address, 'line': self.lineno(address),
+                             'cycles': cycles, 'message': message})
+
+    def _find_hazards(self):
+        words = self.words
+        count = len(words)
+        for index, word in enumerate(words):
+            address = 4 * index
+            if index + 1 < count and load_use_stall(word, words[index + 1]):
+                self._hazard('load-use', address + 4, LOAD_USE_PENALTY,
+                             f"{self.text(address + 4)} waits for {self.text(address)}")
+
+            if lost_branch(words, index):
+                # The stall holds PC and IF/ID in the cycle the jump resolves
+                transfer = control_transfer(word, address)
+                when = "if taken, " if transfer is not None and transfer[0] == EXIT_BRANCH else ""
+                self._hazard('lost-branch', address, 0,
+                             f"{when}{self.text(address)} is dropped: it resolves while the load-use "
+                             f"stall behind it holds the fetch, so execution falls through")
+
+            if stale_jalr(words, index):
+                self._hazard('stale-jalr', address, 0,
+                             f"{self.text(address)} reads x{(word >> 15) & 0x1F} before the write ahead "
+                             f"of it reaches the register file (the jalr base is not forwarded)")
+
+    def _dominators(self, reachable):
+        """Immediate dominators of the reachable blocks, as a dict"""
+        order = []
+        seen = set()
+        stack = [(self.blocks[0], iter(self.blocks[0].successors))]
+        seen.add(self.blocks[0])
+        while stack:
+            block, successors = stack[-1]
+            for successor, _, _ in successors:
+                if successor not in seen:
+                    seen.add(successor)
+                    stack.append((successor, iter(successor.successors)))
+                    break
+            else:
+                order.append(block)
+                stack.pop()
+        order.reverse()
+        position = {block: i for i, block in enumerate(order)}
+
+        idom = {order[0]: order[0]}
+        changed = True
+        while changed:
+            changed = False
+            for block in order[1:]:
+                new = None
+                for predecessor in block.predecessors:
+                    if predecessor not in idom:
+                        continue
+                    if new is None:
+                        new = predecessor
+                        continue
+                    a, b = predecessor, new
+                    while a is not b:
+                        while position[a] > position[b]:
+                            a = idom[a]
+                        while position[b] > position[a]:
+                            b = idom[b]
+                    new = a
+                if idom.get(block) is not new:
+                    idom[block] = new
+                    changed = True
+        reachable.update(order)
+        return idom
+
+    def _find_loops(self):
+        if not self.blocks:
+            return []
+        reachable = set()
+        idom = self._dominators(reachable)
+
+        def dominates(a, b):
+            while True:
+                if b is a:
+                    return True
+                parent = idom[b]
+                if parent is b:
+                    return False
+                b = parent
+
+        bodies = {}
+        for block in self.blocks:
+            if block not in reachable or block.exit == EXIT_HALT:
+                continue
+            for successor, _, _ in block.successors:
+                if dominates(successor, block):
+                    self.back_edges.add((block, successor))
+                    body = bodies.setdefault(successor, {successor})
+                    worklist = [block]
+                    while worklist:
+                        node = worklist.pop()
+                        if node not in body:
+                            body.add(node)
+                            worklist.extend(node.predecessors)
+
+        loops = [Loop(header, body) for header, body in sorted(bodies.items(), key=lambda item: item[0].start)]
+        for loop in loops:
+            enclosing = [other for other in loops if other is not loop and loop.header in other.blocks
+                         and loop.blocks < other.blocks]
+            if enclosing:
+                loop.parent = min(enclosing, key=lambda other: len(other.blocks))
+        for loop in loops:
+            parent = loop.parent
+            while parent is not None:
+                loop.depth += 1
+                parent = parent.parent
+            loop.best = self._cheapest_iteration(loop)
+            loop.worst = self._costliest_iteration(loop)
+        return loops
+
+    def _cheapest_iteration(self, loop):
+        """The loop's cheapest Iteration, or None if no path leads back to the header"""
+        header = loop.header
+        best = {header: 0}
+        previous = {}
+        finish = None
+        queue = [(0, header.start, header)]
+        while queue:
+            cost, _, block = heapq.heappop(queue)
+            if cost > best.get(block, cost):
+                continue
+            for successor, kind, stall in block.successors:
+                if successor not in loop.blocks:
+                    continue
+                total = cost + block.edge_cycles(kind, stall)
+                if successor is header:
+                    if finish is None or total < finish[0]:
+                        finish = (total, block, kind, stall)
+                elif total < best.get(successor, total + 1):
+                    best[successor] = total
+                    previous[successor] = (block, kind, stall)
+                    heapq.heappush(queue, (total, successor.start, successor))
+        if finish is None:
+            return None
+
+        _, block, kind, stall = finish
+        steps = [(block, kind, stall)]
+        while block is not header:
+            block, kind, stall = previous[block]
+            steps.append((block, kind, stall))
+        steps.reverse()
+        return Iteration(steps)
+
+    def _costliest_iteration(self, loop):
+        """The loop's costliest Iteration, or None if no path leads back to the header
+
+        Back edges of inner loops are not followed, so the body is acyclic and
+        the costliest path passes once through each inner loop on it.
+        """
+        header = loop.header
+
+        def forward(block, successor):
+            return (successor in loop.blocks and successor is not header and
+                    (block, successor) not in self.back_edges)
+
+        # Depth-first postorder: every block comes after the blocks it leads to
+        order = []
+        seen = {header}
+        stack = [(header, iter(header.successors))]
+        while stack:
+            block, successors = stack[-1]
+            for successor, _, _ in successors:
+                if forward(block, successor) and successor not in seen:
+                    seen.add(successor)
+                    stack.append((successor, iter(successor.successors)))
+                    break
+            else:
+                stack.pop()
+                order.append(block)
+
+        # Costliest cycles from each block back to the header, and the edge it leaves by
+        costliest = {}
+        for block in order:
+            for successor, kind, stall in block.successors:
+                if successor is header:
+                    total = block.edge_cycles(kind, stall)
+                elif forward(block, successor) and successor in costliest:
+                    total = block.edge_cycles(kind, stall) + costliest[successor][0]
+                else:
+                    continue
+                if block not in costliest or total > costliest[block][0]:
+                    costliest[block] = (total, successor, kind, stall)
+        if header not in costliest:
+            return None
+
+        steps = []
+        block = header
+        while True:
+            _, successor, kind, stall = costliest[block]
+            steps.append((block, kind, stall))
+            if successor is header:
+                return Iteration(steps)
+            block = successor
+
+    def to_dict(self):
+        """Analysis as JSON-serializable data"""
+        def location(address):
+            return {'address': address, 'line': self.lineno(address)}
+        return {
+            'program': self.name,
+            'instructions': len(self.words),
+            'blocks': [dict(location(block.start), index=block.index, end=block.end,
+                            labels=block.labels, instructions=block.instructions,
+                            load_use_stalls=block.load_use, exit=block.exit, cycles=block.cycles,
+                            successors=[{'block': successor.index, 'edge': kind,
+                                         'cycles': (FLUSH_PENALTY if kind == EDGE_TAKEN else 0) +
+                                                   stall * LOAD_USE_PENALTY}
+                                        for successor, kind, stall in block.successors])
+                       for block in self.blocks],
+            'loops': [dict(location(loop.header.start), name=loop.name, depth=loop.depth,
+                           parent=loop.parent.name if loop.parent else None,
+                           blocks=sorted(block.index for block in loop.blocks),
+                           cycles=loop.cycles, cpi=round(loop.cpi, 4),
+                           best=loop.best.to_dict() if loop.best else None,
+                           worst=loop.worst.to_dict() if loop.worst else None)
+                      for loop in self.loops],
+            'hazards': self.hazards,
+        }
+
+    def format_text(self):
+        """Human-readable report"""
+        def where(address):
+            line = self.lineno(address)
+            return f"line {line:<4}" if line is not None else f"0x{address:08x}"
+
+        loops = f"{len(self.loops)} loop" + ("" if len(self.loops) == 1 else "s")
+        lines = [f"Program: {self.name or '<image>'} ({len(self.words)} instructions, "
+                 f"{len(self.blocks)} basic blocks, {loops})", "", "Basic blocks:"]
+        for block in self.blocks:
+            exits = ", ".join(f"B{successor.index}" + (" (taken)" if kind == EDGE_TAKEN else "") +
+                              (" (+1 load-use)" if stall else "")
+                              for successor, kind, stall in block.successors) or block.exit
+            taken = f" (+{FLUSH_PENALTY} if taken)" if block.exit == EXIT_BRANCH else ""
+            lines.append(f"  B{block.index:<3} {where(block.start)} {block.name:<20} "
+                         f"{block.instructions:4d} instr {block.load_use:3d} stalls "
+                         f"{block.cycles:5d} cycles{taken:<15} -> {exits}")
+
+        if self.loops:
+            lines += ["", "Loops:"]
+            for loop in self.loops:
+                blocks = " ".join(f"B{block.index}" for block in sorted(loop.blocks, key=lambda b: b.start))
+                lines.append(f"  {loop.name} ({where(loop.header.start).strip()}, depth {loop.depth}): {blocks}")
+                iterations = [('cheapest', loop.best), ('costliest', loop.worst)]
+                if loop.best and loop.worst and loop.best.path == loop.worst.path:
+                    iterations = [('per', loop.worst)]
+                for which, iteration in iterations:
+                    if iteration is None:
+                        continue
+                    path = " -> ".join(f"B{block.index}" for block in iteration.path)
+                    lines.append(f"    {which} iteration ({path}): {iteration.instructions} instructions, "
+                                 f"{iteration.load_use} load-use stalls, {iteration.flushes} taken flushes "
+                                 f"-> {iteration.cycles} cycles, CPI {iteration.cpi:.3f}")
+
+        if self.hazards:
+            lines += ["", "Hazards:"]
+            for hazard in self.hazards:
+                cost = f" ({hazard['cycles']} cycle)" if hazard['cycles'] else ""
+                lines.append(f"  {where(hazard['address'])} {hazard['kind']}: {hazard['message']}{cost}")
+        return "\n".join(lines)
+
+def analyze_source(assembly_code, name=None):
+    """Assemble source text and analyze it"""
+    assembler = RiscAssembler()
+    records = assembler.parse_source(assembly_code)
+    words = assembler.assemble_many(records)
+    return ProgramAnalysis(words, assembler.text_symbols(), assembler.source_map(records), name)
+
+def analyze_file(path):
+    """Analyze an assembly source or a program image"""
+    if os.path.splitext(path)[1].lower() in ('.hex', '.bin'):
+        return ProgramAnalysis(load_program(path)[0], name=os.path.basename(path))
+    with open(path) as f:
+        return analyze_source(f.read(), os.path.basename(path))
+
+def check_limits(analysis, limits, baseline=None):
+    """Compare loop CPIs with LOOP=CPI limits and a saved JSON report; returns failure messages
+
+    Loops are judged by their costliest iteration. A report saved before
+    costliest iterations were recorded holds cheapest-iteration cycles, and
+    is compared with the cheapest iteration.
+    """
+    loops = {loop.name: loop for loop in analysis.loops}
+    failures = []
+    for limit in limits:
+        name, _, value = limit.partition('=')
+        loop = loops.get(name.strip())
+        if loop is None:
+            failures.append(f"no loop named {name.strip()}")
+        elif loop.cpi > float(value):
+            failures.append(f"loop {loop.name} CPI {loop.cpi:.3f} exceeds {float(value):.3f}")
+    if baseline is not None:
+        for old in baseline.get('loops', []):
+            loop = loops.get(old['name'])
+            if loop is None:
+                continue
+            which, iteration = ('costliest', loop.worst) if 'worst' in old else ('cheapest', loop.best)
+            if iteration is not None and iteration.cycles > old['cycles']:
+                failures.append(f"loop {loop.name} takes {iteration.cycles} cycles per {which} iteration, "
+                                f"was {old['cycles']}")
+    return failures
+
+def main():
+    parser = argparse.ArgumentParser(description="Static hazard and CPI analysis of a RISC program")
+    parser.add_argument('program', help="assembly source (.s), $readmemh image (.hex) or raw image (.bin)")
+    parser.add_argument('--json', action='store_true', help="print the report as JSON")
+    parser.add_argument('--max-cpi', action='append', default=[], metavar='LOOP=CPI',
+                        help="fail if the CPI of the named loop's cheapest or costliest iteration "
+                             "exceeds CPI; repeatable")
+    parser.add_argument('--baseline', help="fail if any loop's costliest iteration takes more cycles "
+                                           "than in this JSON report")
+    args = parser.parse_args()
+
+    try:
+        analysis = analyze_file(args.program)
+        baseline = None
+        if args.baseline:
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+        failures = check_limits(analysis, args.max_cpi, baseline)
+    except (OSError, ValueError) as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+
+    if args.json:
+        print(json.dumps(analysis.to_dict(), indent=2))
+    else:
+        print(analysis.format_text())
+
+    for failure in failures:
+        print(f"FAIL: {failure}", file=sys.stderr)
+    if failures:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
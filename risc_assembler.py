@@ -4,14 +4,604 @@ RISC Assembler - Converts RISC assembly code to binary machine code
 Based on the 32-bit RISC CPU instruction set
 
 Supports standard assembler directives:
-- .text: Indicates the start of code section
+- .text / .data: switch between the instruction and data sections
+- .word v, ...: emit 32-bit words (numbers or label addresses)
+- .space n: reserve n bytes, rounded up to whole words
+- .align n: pad to a 2**n-byte boundary
+- .globl name, ...: export labels to other files (used by risc_linker.py)
+
+and the pseudo-instructions nop, mv, li, la, j, call and ret. li and la of a
+label take the shortest lui/addi sequence for the label's address.
+
+The two sections are assembled separately, matching the CPU's separate
+instruction and data memories: data labels are data-memory byte addresses
+counted from 0, and the data image is left in RiscAssembler.data.
 """
 
+import abc
+import argparse
+import gc
+import hashlib
+import itertools
+import json
+import marshal
+import os
 import re
 import sys
+from array import array
+from collections import OrderedDict, deque
+
+# Patterns are compiled once and shared by the tokenizer and the encoders
+LABEL_RE = re.compile(r'^([a-zA-Z0-9_]+):')
+SYMBOL_RE = re.compile(r'^[a-zA-Z0-9_]+$')
+MEMORY_OPERAND_RE = re.compile(r'(-?\d+)\(([a-zA-Z0-9]+)\)')
+
+DIRECTIVES = frozenset(['.text', '.data', '.word', '.space', '.align', '.globl', '.global'])
+
+# Pseudo-instructions expanded by RiscAssembler.expand_pseudo, and their operand counts
+PSEUDO_OPERANDS = {'nop': 0, 'mv': 2, 'li': 2, 'la': 2, 'j': 1, 'call': 1, 'ret': 0}
+PSEUDO_INSTRUCTIONS = frozenset(PSEUDO_OPERANDS)
+
+# Mnemonics the layout pass treats specially, and those that need the full layout
+LAYOUT_MNEMONICS = DIRECTIVES | PSEUDO_INSTRUCTIONS
+EXPANDED_MNEMONICS = PSEUDO_INSTRUCTIONS | {'.data'}
+
+# addi x0, x0, 0: the padding emitted by .align and .space in .text
+NOP = 0x00000013
+
+# Basic blocks are scheduled in windows of at most this many instructions
+SCHEDULE_WINDOW = 64
+
+# Bump whenever a change to the assembler alters the image produced for some input
+CACHE_FORMAT_VERSION = 2
+
+# Unrolled programs repeat the same line text many times, so tokenized fields are
+# memoized by raw line; the memo is reset when it reaches this many entries
+TOKEN_MEMO_LIMIT = 1 << 16
+
+class SourceLine:
+    """One tokenized source line: optional label, mnemonic, operand tokens and line number"""
+    __slots__ = ('label', 'mnemonic', 'operands', 'lineno')
+
+    def __init__(self, label, mnemonic, operands, lineno):
+        self.label = label
+        self.mnemonic = mnemonic
+        self.operands = operands
+        self.lineno = lineno
+
+    def __repr__(self):
+        return (f"SourceLine(label={self.label!r}, mnemonic={self.mnemonic!r}, "
+                f"operands={self.operands!r}, lineno={self.lineno})")
+
+def split_line(line):
+    """Split a raw source line into (label, mnemonic, operands), or None if it holds nothing"""
+    comment = line.find('#')
+    if comment >= 0:
+        line = line[:comment]
+    line = line.strip()
+    if not line:
+        return None
+
+    label = None
+    if ':' in line:
+        label_match = LABEL_RE.match(line)
+        if label_match:
+            label = label_match.group(1)
+            line = line[label_match.end():].strip()
+            if not line:  # Label on its own line
+                return (label, None, ())
+
+    # Split into mnemonic and comma-separated operands
+    parts = line.split(None, 1)
+    if len(parts) > 1:
+        # Interning keeps repeated register names and labels shared across records
+        operands = tuple([sys.intern(op.strip()) for op in parts[1].split(',')])
+    else:
+        operands = ()
+    return (label, sys.intern(parts[0].lower()), operands)
+
+def tokenize_line(line, lineno=0):
+    """Tokenize a single source line into a SourceLine, or None if it holds nothing"""
+    fields = split_line(line)
+    if fields is None:
+        return None
+    return SourceLine(fields[0], fields[1], fields[2], lineno)
+
+def iter_lines(text, chunk_size=1 << 20):
+    """Iterate over the lines of text, splitting about chunk_size characters at a time"""
+    return itertools.chain.from_iterable(_line_chunks(text, chunk_size))
+
+def _line_chunks(text, chunk_size):
+    """Yield lists of lines covering text, cut at newline boundaries"""
+    start = 0
+    while start < len(text):
+        end = text.find('\n', start + chunk_size)
+        if end < 0:
+            yield text[start:].split('\n')
+            return
+        yield text[start:end].split('\n')
+        start = end + 1
+
+def iter_records(lines):
+    """Lazily tokenize an iterable of source lines, yielding SourceLine records"""
+    memo = {}
+    missing = memo  # Sentinel: never a tokenized value
+    for lineno, line in enumerate(lines, 1):
+        fields = memo.get(line, missing)
+        if fields is missing:
+            fields = split_line(line)
+            if len(memo) >= TOKEN_MEMO_LIMIT:
+                memo.clear()
+            memo[line] = fields
+        if fields is not None:
+            yield SourceLine(fields[0], fields[1], fields[2], lineno)
+
+def parse_literal(text):
+    """Value of a decimal, 0x hex or 0b binary literal; ValueError if text is not one"""
+    if text.startswith('0x'):
+        return int(text, 16)
+    if text.startswith('0b'):
+        return int(text, 2)
+    return int(text)
+
+def load_sequence(rd, value, words=1):
+    """(mnemonic, operands) pairs of the shortest lui/addi sequence setting rd to value
+
+    One addi covers 12-bit signed values and one lui values with the low 12 bits
+    clear; anything else takes lui then addi. words=2 forces the two-instruction
+    form, used when relaxation already reserved two words.
+    """
+    value &= 0xFFFFFFFF
+    signed = value - ((value & 0x80000000) << 1)
+    if words < 2 and -2048 <= signed <= 2047:
+        return [('addi', (rd, 'x0', str(signed)))]
+    upper = (value + 0x800) & 0xFFFFF000
+    lower = ((value - upper + 0x800) & 0xFFF) - 0x800
+    if words < 2 and lower == 0:
+        return [('lui', (rd, str(upper)))]
+    return [('lui', (rd, str(upper))), ('addi', (rd, rd, str(lower)))]
+
+def tokenize(lines):
+    """Tokenize an iterable of source lines into a list of SourceLine records"""
+    # Records hold no reference cycles; pausing the collector avoids repeated
+    # full-heap scans while millions of them are allocated
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        return list(iter_records(lines))
+    finally:
+        if gc_enabled:
+            gc.enable()
+
+class UndefinedSymbolError(ValueError):
+    """Raised when an operand names a label that has not been defined"""
+
+    def __init__(self, symbol):
+        super().__init__(f"Undefined symbol: {symbol}")
+        self.symbol = symbol
+
+class RegisterMap(dict):
+    """Flat register-name lookup; unusual spellings fall back to a normalized lookup"""
+
+    def __missing__(self, reg_str):
+        normalized = reg_str.strip().lower()
+        if normalized != reg_str and normalized in self:
+            return self[normalized]
+        raise ValueError(f"Unknown register: {normalized}")
+
+class InstructionEncoder(abc.ABC):
+    """Encoder for one mnemonic, precompiled from its opcode table entry
+
+    The opcode, funct3, funct7 and csr fields are pre-shifted into a template
+    word, so encoding only has to OR in the register and immediate fields.
+    """
+    __slots__ = ('template', 'registers', 'assembler')
+
+    # Whether the encoding depends on the instruction's own address
+    pc_relative = False
+
+    def __init__(self, opcode_info, assembler):
+        self.template = (opcode_info['opcode'] |
+                         (opcode_info.get('funct3', 0) << 12) |
+                         (opcode_info.get('funct7', 0) << 25) |
+                         (opcode_info.get('csr', 0) << 20))
+        self.registers = assembler.registers
+        self.assembler = assembler
+
+    @abc.abstractmethod
+    def encode(self, operands, address):
+        """Encode a tuple of operand tokens into a 32-bit instruction word"""
+
+class RTypeEncoder(InstructionEncoder):
+    """R-type: funct7 | rs2 | rs1 | funct3 | rd | opcode"""
+    __slots__ = ()
+
+    def encode(self, operands, address):
+        if len(operands) != 3:
+            raise ValueError(f"R-type instruction requires 3 operands, got {len(operands)}")
+        regs = self.registers
+        return (self.template | (regs[operands[2]] << 20) |
+                (regs[operands[1]] << 15) | (regs[operands[0]] << 7))
+
+class ITypeEncoder(InstructionEncoder):
+    """I-type register-immediate: imm[11:0] | rs1 | funct3 | rd | opcode"""
+    __slots__ = ()
+
+    def encode(self, operands, address):
+        if len(operands) != 3:
+            raise ValueError(f"I-type instruction requires 3 operands, got {len(operands)}")
+        regs = self.registers
+        imm = self.assembler.parse_immediate(operands[2])
+        if imm < -2048 or imm > 2047:
+            raise ValueError(f"Immediate value {imm} is out of range for I-type instruction")
+        return (self.template | ((imm & 0xFFF) << 20) |
+                (regs[operands[1]] << 15) | (regs[operands[0]] << 7))
+
+class ShiftImmEncoder(InstructionEncoder):
+    """Shift immediate (slli/srli/srai): funct7 | shamt | rs1 | funct3 | rd | opcode"""
+    __slots__ = ()
+
+    def encode(self, operands, address):
+        if len(operands) != 3:
+            raise ValueError(f"I-type instruction requires 3 operands, got {len(operands)}")
+        regs = self.registers
+        imm = self.assembler.parse_immediate(operands[2])
+        if imm < -2048 or imm > 2047:
+            raise ValueError(f"Immediate value {imm} is out of range for I-type instruction")
+        return (self.template | ((imm & 0x1F) << 20) |
+                (regs[operands[1]] << 15) | (regs[operands[0]] << 7))
+
+class LoadEncoder(InstructionEncoder):
+    """Load (lw rd, offset(rs1)), encoded as I-type"""
+    __slots__ = ()
+
+    def encode(self, operands, address):
+        if len(operands) != 2:
+            raise ValueError(f"Load instruction requires 2 operands, got {len(operands)}")
+        rd = self.registers[operands[0]]
+        offset, rs1 = self.assembler.parse_memory_operand(operands[1])
+        if offset < -2048 or offset > 2047:
+            raise ValueError(f"Immediate value {offset} is out of range for I-type instruction")
+        return self.template | ((offset & 0xFFF) << 20) | (rs1 << 15) | (rd << 7)
+
+class JalrEncoder(InstructionEncoder):
+    """JALR (jalr rd, rs1, offset), encoded as I-type"""
+    __slots__ = ()
+
+    def encode(self, operands, address):
+        if len(operands) != 3:
+            raise ValueError(f"JALR instruction requires 3 operands, got {len(operands)}")
+        regs = self.registers
+        rd = regs[operands[0]]
+        rs1 = regs[operands[1]]
+        offset = self.assembler.parse_immediate(operands[2])
+        if offset < -2048 or offset > 2047:
+            raise ValueError(f"Immediate value {offset} is out of range for I-type instruction")
+        return self.template | ((offset & 0xFFF) << 20) | (rs1 << 15) | (rd << 7)
+
+class STypeEncoder(InstructionEncoder):
+    """S-type (store): imm[11:5] | rs2 | rs1 | funct3 | imm[4:0] | opcode"""
+    __slots__ = ()
+
+    def encode(self, operands, address):
+        if len(operands) != 2:
+            raise ValueError(f"S-type instruction requires 2 operands, got {len(operands)}")
+        rs2 = self.registers[operands[0]]
+        offset, rs1 = self.assembler.parse_memory_operand(operands[1])
+        if offset < -2048 or offset > 2047:
+            raise ValueError(f"Immediate value {offset} is out of range for S-type instruction")
+        return (self.template | ((offset & 0xFE0) << 20) | (rs2 << 20) |
+                (rs1 << 15) | ((offset & 0x1F) << 7))
+
+class BTypeEncoder(InstructionEncoder):
+    """B-type (branch): imm[12|10:5] | rs2 | rs1 | funct3 | imm[4:1|11] | opcode"""
+    __slots__ = ()
+    pc_relative = True
+
+    def encode(self, operands, address):
+        if len(operands) != 3:
+            raise ValueError(f"B-type instruction requires 3 operands, got {len(operands)}")
+        regs = self.registers
+        rs1 = regs[operands[0]]
+        rs2 = regs[operands[1]]
+
+        # Handle target label or immediate
+        target = operands[2]
+        symbol_address = self.assembler.symbol_table.get(target)
+        if symbol_address is not None:
+            offset = symbol_address - address
+        else:
+            offset = self.assembler.parse_immediate(target)
+
+        if offset % 2 != 0:
+            raise ValueError(f"Branch offset {offset} must be a multiple of 2")
+        if offset < -4096 or offset > 4095:
+            raise ValueError(f"Branch offset {offset} is out of range")
+
+        return (self.template | ((offset & 0x1000) << 19) | ((offset & 0x7E0) << 20) |
+                (rs2 << 20) | (rs1 << 15) | ((offset & 0x1E) << 7) | ((offset & 0x800) >> 4))
+
+class UTypeEncoder(InstructionEncoder):
+    """U-type (lui, auipc): imm[31:12] | rd | opcode"""
+    __slots__ = ()
+
+    def encode(self, operands, address):
+        if len(operands) != 2:
+            raise ValueError(f"U-type instruction requires 2 operands, got {len(operands)}")
+        rd = self.registers[operands[0]]
+        imm = self.assembler.parse_immediate(operands[1])
+        return self.template | (imm & 0xFFFFF000) | (rd << 7)
+
+class JTypeEncoder(InstructionEncoder):
+    """J-type (jal): imm[20|10:1|11|19:12] | rd | opcode"""
+    __slots__ = ()
+    pc_relative = True
+
+    def encode(self, operands, address):
+        if len(operands) != 2:
+            raise ValueError(f"J-type instruction requires 2 operands, got {len(operands)}")
+        rd = self.registers[operands[0]]
+
+        # Handle target label or immediate
+        target = operands[1]
+        symbol_address = self.assembler.symbol_table.get(target)
+        if symbol_address is not None:
+            offset = symbol_address - address
+        else:
+            offset = self.assembler.parse_immediate(target)
+
+        if offset % 2 != 0:
+            raise ValueError(f"Jump offset {offset} must be a multiple of 2")
+        if offset < -1048576 or offset > 1048575:
+            raise ValueError(f"Jump offset {offset} is out of range")
+
+        return (self.template | ((offset & 0x100000) << 11) | ((offset & 0x7FE) << 20) |
+                ((offset & 0x800) << 9) | (offset & 0xFF000) | (rd << 7))
+
+class CounterEncoder(InstructionEncoder):
+    """Counter read (rdcycle rd), encoded as CSRRS rd, csr, x0: csr | 00000 | 010 | rd | opcode"""
+    __slots__ = ()
+
+    def encode(self, operands, address):
+        if len(operands) != 1:
+            raise ValueError(f"Counter read requires 1 operand, got {len(operands)}")
+        return self.template | (self.registers[operands[0]] << 7)
+
+def encoder_class(opcode_info):
+    """Select the encoder class for an opcode table entry"""
+    kind = opcode_info['type']
+    if kind == 'I':
+        if opcode_info['opcode'] == 0b0000011:
+            return LoadEncoder
+        if opcode_info['opcode'] == 0b1100111:
+            return JalrEncoder
+        if opcode_info['opcode'] == 0b0010011 and opcode_info['funct3'] in (0b001, 0b101):
+            return ShiftImmEncoder
+        return ITypeEncoder
+    encoder = ENCODER_CLASSES.get(kind)
+    if encoder is None:
+        raise ValueError(f"Unknown instruction type: {kind}")
+    return encoder
+
+ENCODER_CLASSES = {
+    'R': RTypeEncoder,
+    'S': STypeEncoder,
+    'B': BTypeEncoder,
+    'U': UTypeEncoder,
+    'J': JTypeEncoder,
+    'CSR': CounterEncoder,
+}
+
+# Opcodes the scheduler tells apart (same as in control_unit.v)
+OP_R_TYPE = 0b0110011
+OP_I_TYPE = 0b0010011
+OP_LOAD = 0b0000011
+OP_STORE = 0b0100011
+OP_BRANCH = 0b1100011
+OP_JAL = 0b1101111
+OP_JALR = 0b1100111
+OP_LUI = 0b0110111
+OP_AUIPC = 0b0010111
+OP_SYSTEM = 0b1110011
+
+def load_use_stall(producer, consumer):
+    """Whether hazard_detection.v stalls consumer when it directly follows producer
+
+    The hazard unit compares the load's rd with the raw rs1/rs2 fields of the next
+    instruction, whether or not that instruction actually reads them.
+    """
+    rd = (producer >> 7) & 0x1F
+    return ((producer & 0x7F) == OP_LOAD and rd != 0 and
+            (rd == (consumer >> 15) & 0x1F or rd == (consumer >> 20) & 0x1F))
+
+def operand_registers(word):
+    """(registers read, register written or 0, kind) of an instruction word
+
+    kind is 'load', 'store', 'alu', 'transfer' for branches and jumps, or 'fixed'
+    for words that must keep their place (auipc, counter reads and unknown opcodes).
+    """
+    opcode = word & 0x7F
+    rd = (word >> 7) & 0x1F
+    rs1 = (word >> 15) & 0x1F
+    rs2 = (word >> 20) & 0x1F
+    if opcode == OP_R_TYPE:
+        return ((rs1, rs2), rd, 'alu')
+    if opcode == OP_I_TYPE:
+        return ((rs1,), rd, 'alu')
+    if opcode == OP_LUI:
+        return ((), rd, 'alu')
+    if opcode == OP_LOAD:
+        return ((rs1,), rd, 'load')
+    if opcode == OP_STORE:
+        return ((rs1, rs2), 0, 'store')
+    if opcode == OP_BRANCH:
+        return ((rs1, rs2), 0, 'transfer')
+    if opcode == OP_JAL:
+        return ((), rd, 'transfer')
+    if opcode == OP_JALR:
+        return ((rs1,), rd, 'transfer')
+    if opcode == OP_AUIPC or opcode == OP_SYSTEM:
+        return ((), rd, 'fixed')
+    return ((), 0, 'fixed')
+
+def transfer_target(word, address):
+    """Target address of a branch or jal at address, or None for other instructions"""
+    opcode = word & 0x7F
+    if opcode == OP_BRANCH:
+        offset = (((word >> 19) & 0x1000) | ((word << 4) & 0x800) |
+                  ((word >> 20) & 0x7E0) | ((word >> 7) & 0x1E))
+        return (address + offset - ((offset & 0x1000) << 1)) & 0xFFFFFFFF
+    if opcode == OP_JAL:
+        offset = (((word >> 11) & 0x100000) | (word & 0xFF000) |
+                  ((word >> 9) & 0x800) | ((word >> 20) & 0x7FE))
+        return (address + offset - ((offset & 0x100000) << 1)) & 0xFFFFFFFF
+    return None
+
+def count_stalls(sequence, previous=None, following=None):
+    """Load-use stalls along a sequence of words and the words just before and after it"""
+    chain = ([previous] if previous is not None else []) + list(sequence) + \
+            ([following] if following is not None else [])
+    return sum(load_use_stall(chain[i], chain[i + 1]) for i in range(len(chain) - 1))
+
+def lost_branch(words, index):
+    """Whether the branch or jump at words[index] resolves during a load-use stall
+
+    cpu.v holds PC and IF/ID while stalling, so such a branch is dropped and
+    execution falls through.
+    """
+    return (operand_registers(words[index])[2] == 'transfer' and index + 2 < len(words) and
+            load_use_stall(words[index + 1], words[index + 2]))
+
+def stale_jalr(words, index):
+    """Whether the jalr at words[index] reads its base register before it is written back
+
+    cpu.v computes the jalr target from the unforwarded ID/EX register value.
+    """
+    word = words[index]
+    base = (word >> 15) & 0x1F
+    if (word & 0x7F) != OP_JALR or not base:
+        return False
+    previous = words[index - 1] if index >= 1 else 0
+    older = words[index - 2] if index >= 2 else 0
+    if operand_registers(previous)[1] == base:
+        return True
+    # A stall on either pair delays the jalr until the older result is written
+    return (operand_registers(older)[1] == base and not load_use_stall(previous, word) and
+            not load_use_stall(older, previous))
+
+def rtl_hazard_sites(words):
+    """Indices of branches that are lost and jalrs that read a stale base"""
+    return {index for index in range(len(words))
+            if lost_branch(words, index) or stale_jalr(words, index)}
+
+def schedule_region(words, previous=None, following=None):
+    """Reorder a straight-line run of words to hide load-use stalls
+
+    Builds the dependency DAG of the run (register RAW/WAR/WAW, and loads and
+    stores kept in order around stores), then list-schedules it: at each step
+    the ready instruction that does not stall behind the last one is picked,
+    preferring the longest remaining path (load results count double) and an
+    instruction that does not consume the previous result. Returns the order
+    as indices into words.
+    """
+    count = len(words)
+    info = [operand_registers(word) for word in words]
+    successors = [[] for _ in range(count)]
+    waiting = [0] * count
+    for j in range(count):
+        reads_j, write_j, kind_j = info[j]
+        for i in range(j):
+            reads_i, write_i, kind_i = info[i]
+            raw = write_i != 0 and write_i in reads_j
+            if (raw or (write_j != 0 and (write_j in reads_i or write_j == write_i)) or
+                    ('store' in (kind_i, kind_j) and kind_i in ('load', 'store') and
+                     kind_j in ('load', 'store'))):
+                successors[i].append((j, 2 if raw and kind_i == 'load' else 1))
+                waiting[j] += 1
+
+    height = [1] * count
+    for i in reversed(range(count)):
+        for j, latency in successors[i]:
+            height[i] = max(height[i], height[j] + latency)
+
+    order = []
+    ready = [j for j in range(count) if not waiting[j]]
+    last = previous
+    while ready:
+        last_write = operand_registers(last)[1] if last is not None else 0
+        best = min(ready, key=lambda j: (last is not None and load_use_stall(last, words[j]),
+                                         -height[j],
+                                         last_write != 0 and last_write in info[j][0],
+                                         j))
+        ready.remove(best)
+        order.append(best)
+        last = words[best]
+        for j, _ in successors[best]:
+            waiting[j] -= 1
+            if not waiting[j]:
+                ready.append(j)
+    return order
+
+def schedule_program(words, leaders=(), fixed=()):
+    """Schedule every basic block of a program to hide load-use stalls
+
+    leaders are word indices that start a block besides branch targets and the
+    words after branches (label addresses, so indirect jump targets are kept);
+    fixed are word indices that must not move. A block is only rewritten when
+    its stall count drops, and rewrites that would introduce a lost branch or a
+    stale jalr base are undone. Returns the new words, the original index of
+    each new word, and a list of (first index, end index, stalls before, stalls
+    after) for every rewritten block.
+    """
+    count = len(words)
+    leaders = set(leaders)
+    fixed = set(fixed)
+    for index, word in enumerate(words):
+        if operand_registers(word)[2] == 'transfer':
+            leaders.add(index + 1)
+            target = transfer_target(word, 4 * index)
+            if target is not None and not target & 3:
+                leaders.add(target >> 2)
+
+    placement = list(range(count))
+    regions = []
+    start = 0
+    for index in range(count + 1):
+        boundary = (index == count or index in leaders or index in fixed or
+                    operand_registers(words[index])[2] in ('transfer', 'fixed') or
+                    index - start >= SCHEDULE_WINDOW)
+        if not boundary:
+            continue
+        if index - start >= 2:
+            region = [words[i] for i in range(start, index)]
+            previous = words[placement[start - 1]] if start > 0 else None
+            following = words[index] if index < count else None
+            before = count_stalls(region, previous, following)
+            order = schedule_region(region, previous, following)
+            after = count_stalls([region[i] for i in order], previous, following)
+            if after < before:
+                placement[start:index] = [start + i for i in order]
+                regions.append((start, index, before, after))
+        start = index + 1 if index < count and (index in fixed or
+                                                 operand_registers(words[index])[2] in ('transfer', 'fixed')) else index
+
+    # Undo rewrites next to any corner case the original program did not have
+    original = rtl_hazard_sites(words)
+    while True:
+        scheduled = array('I', [words[i] for i in placement])
+        introduced = rtl_hazard_sites(scheduled) - original
+        undo = [region for region in regions
+                if any(region[0] - 2 <= site < region[1] + 2 for site in introduced)]
+        if not undo:
+            break
+        for region in undo:
+            placement[region[0]:region[1]] = range(region[0], region[1])
+            regions.remove(region)
+
+    return scheduled, placement, regions
 
 class RiscAssembler:
-    def __init__(self):
+    def __init__(self, optimize=False):
         # Define instruction formats and opcodes
         self.opcodes = {
             # R-type instructions
@@ -56,10 +646,16 @@ class RiscAssembler:
             
             # J-type instructions
             'jal': {'type': 'J', 'opcode': 0b1101111},
+
+            # Performance counter reads (CSRRS rd, csr, x0)
+            'rdcycle':   {'type': 'CSR', 'opcode': 0b1110011, 'funct3': 0b010, 'csr': 0xC00},
+            'rdinstret': {'type': 'CSR', 'opcode': 0b1110011, 'funct3': 0b010, 'csr': 0xC02},
+            'rdstall':   {'type': 'CSR', 'opcode': 0b1110011, 'funct3': 0b010, 'csr': 0xC03},
+            'rdflush':   {'type': 'CSR', 'opcode': 0b1110011, 'funct3': 0b010, 'csr': 0xC04},
         }
         
         # Register mapping (RISC-V style)
-        self.registers = {
+        self.registers = RegisterMap({
             'x0': 0, 'zero': 0,
             'x1': 1, 'ra': 1,
             'x2': 2, 'sp': 2,
@@ -92,40 +688,68 @@ class RiscAssembler:
             'x29': 29, 't4': 29,
             'x30': 30, 't5': 30,
             'x31': 31, 't6': 31
-        }
+        })
         
         # Initialize symbol table for labels
         self.symbol_table = {}
         self.current_address = 0
+        self.literals = {}
+
+        # .data contents: the records laid out by first_pass, the labels defined
+        # there (data addresses, in symbol_table too) and the assembled image
+        self.data_records = []
+        self.data_labels = set()
+        self.data = array('I')
+
+        # Precompile each mnemonic into its encoder
+        self.encoders = self.compile_encoders()
+
+        # -O: reorder each basic block to hide load-use stalls
+        self.optimize = optimize
+        self.placement = None
+        self.schedule_changes = []
+
+    def compile_encoders(self):
+        """Build the mnemonic -> encoder table from self.opcodes"""
+        return {mnemonic: encoder_class(info)(info, self)
+                for mnemonic, info in self.opcodes.items()}
         
     def parse_register(self, reg_str):
         """Convert register name to register number"""
-        reg_str = reg_str.strip().lower()
-        if reg_str in self.registers:
-            return self.registers[reg_str]
-        else:
-            raise ValueError(f"Unknown register: {reg_str}")
+        return self.registers[reg_str]
     
     def parse_immediate(self, imm_str):
         """Parse immediate value from string"""
-        imm_str = imm_str.strip()
-        
         # Check if it's a symbol reference
-        if imm_str in self.symbol_table:
-            return self.symbol_table[imm_str]
+        value = self.symbol_table.get(imm_str)
+        if value is not None:
+            return value
+
+        # Numeric literals repeat heavily, so parsed values are memoized
+        value = self.literals.get(imm_str)
+        if value is not None:
+            return value
+
+        stripped = imm_str.strip()
+        if stripped != imm_str:
+            return self.parse_immediate(stripped)
         
         # Handle different number formats
-        if imm_str.startswith('0x'):
-            return int(imm_str, 16)
-        elif imm_str.startswith('0b'):
-            return int(imm_str, 2)
-        else:
-            return int(imm_str)
+        try:
+            value = parse_literal(imm_str)
+        except ValueError:
+            if SYMBOL_RE.match(imm_str):
+                raise UndefinedSymbolError(imm_str) from None
+            raise
+
+        if len(self.literals) >= TOKEN_MEMO_LIMIT:
+            self.literals.clear()
+        self.literals[imm_str] = value
+        return value
     
     def parse_memory_operand(self, mem_str):
         """Parse memory operand like '8(x5)' into offset and register"""
-        pattern = r'(-?\d+)\(([a-zA-Z0-9]+)\)'
-        match = re.match(pattern, mem_str.strip())
+        match = MEMORY_OPERAND_RE.match(mem_str.strip())
         if match:
             offset = int(match.group(1))
             reg = self.parse_register(match.group(2))
@@ -135,303 +759,658 @@ class RiscAssembler:
     
     def is_directive(self, line):
         """Check if the line is an assembler directive"""
-        directives = ['.text']
         line_parts = line.split()
-        if line_parts and line_parts[0] in directives:
+        if line_parts and line_parts[0] in DIRECTIVES:
             return True
         return False
+
+    def parse_source(self, assembly_code):
+        """Tokenize assembly source once into the record list walked by both passes"""
+        return tokenize(iter_lines(assembly_code))
         
-    def first_pass(self, lines):
-        """First pass to collect all labels and their addresses"""
+    def first_pass(self, program):
+        """First pass to collect all labels and their addresses
+
+        Returns the records of the .text section with pseudo-instructions expanded,
+        which is program itself when it has neither pseudo-instructions nor .data.
+        """
         address = 0
-        for line in lines:
-            # Remove comments and strip whitespace
-            line = re.sub(r'#.*$', '', line).strip()
-            if not line:
+        symbol_table = self.symbol_table
+        self.data_records = []
+        self.data_labels = set()
+        for record in program:
+            if record.label is not None:
+                symbol_table[record.label] = address
+
+            # Label-only lines take no space; directives take the words they emit
+            mnemonic = record.mnemonic
+            if mnemonic is None:
                 continue
-                
-            # Skip assembler directives
-            if self.is_directive(line):
+            if mnemonic in LAYOUT_MNEMONICS:
+                if mnemonic in EXPANDED_MNEMONICS:
+                    # As in tokenize: the new records hold no cycles, so skip collections
+                    gc_enabled = gc.isenabled()
+                    gc.disable()
+                    try:
+                        return self._layout(program)
+                    finally:
+                        if gc_enabled:
+                            gc.enable()
+                address += 4 * self.directive_size(record, address)
                 continue
-                
-            # Check if line contains a label
-            label_match = re.match(r'^([a-zA-Z0-9_]+):', line)
-            if label_match:
-                label = label_match.group(1)
-                self.symbol_table[label] = address
-                
-                # If line only contains a label, continue to next line
-                remaining = line[label_match.end():].strip()
-                if not remaining:
-                    continue
                     
             # Every instruction is 4 bytes (32 bits)
             address += 4
-    
-    def assemble_r_type(self, opcode_info, operands):
-        """Assemble R-type instruction"""
-        if len(operands) != 3:
-            raise ValueError(f"R-type instruction requires 3 operands, got {len(operands)}")
-            
-        rd = self.parse_register(operands[0])
-        rs1 = self.parse_register(operands[1])
-        rs2 = self.parse_register(operands[2])
-        
-        opcode = opcode_info['opcode']
-        funct3 = opcode_info['funct3']
-        funct7 = opcode_info['funct7']
-        
-        # Assemble the instruction: funct7 | rs2 | rs1 | funct3 | rd | opcode
-        instruction = (funct7 << 25) | (rs2 << 20) | (rs1 << 15) | (funct3 << 12) | (rd << 7) | opcode
-        return instruction
-    
-    def assemble_i_type(self, opcode_info, operands):
-        """Assemble I-type instruction"""
-        opcode = opcode_info['opcode']
-        funct3 = opcode_info['funct3']
-        
-        # Handle load instructions separately
-        if opcode_info['opcode'] == 0b0000011:  # LW
-            if len(operands) != 2:
-                raise ValueError(f"Load instruction requires 2 operands, got {len(operands)}")
-                
-            rd = self.parse_register(operands[0])
-            offset, rs1 = self.parse_memory_operand(operands[1])
-            
-            # Ensure the immediate is within range and sign-extend
-            if offset < -2048 or offset > 2047:
-                raise ValueError(f"Immediate value {offset} is out of range for I-type instruction")
-                
-            imm = offset & 0xFFF  # 12-bit immediate
-        
-        # Handle JALR
-        elif opcode_info['opcode'] == 0b1100111:  # JALR
-            if len(operands) != 3:
-                raise ValueError(f"JALR instruction requires 3 operands, got {len(operands)}")
-                
-            rd = self.parse_register(operands[0])
-            rs1 = self.parse_register(operands[1])
-            offset = self.parse_immediate(operands[2])
-            
-            if offset < -2048 or offset > 2047:
-                raise ValueError(f"Immediate value {offset} is out of range for I-type instruction")
-                
-            imm = offset & 0xFFF  # 12-bit immediate
-            
-        # Regular I-type (addi, andi, etc.)
-        else:
-            if len(operands) != 3:
-                raise ValueError(f"I-type instruction requires 3 operands, got {len(operands)}")
-                
-            rd = self.parse_register(operands[0])
-            rs1 = self.parse_register(operands[1])
-            imm = self.parse_immediate(operands[2])
-            
-            # Ensure the immediate is within range and sign-extend
-            if imm < -2048 or imm > 2047:
-                raise ValueError(f"Immediate value {imm} is out of range for I-type instruction")
-                
-            imm = imm & 0xFFF  # 12-bit immediate
-            
-        # Handle shift immediate instructions which include a funct7
-        if opcode_info['opcode'] == 0b0010011 and funct3 in [0b001, 0b101]:
-            # For slli, srli, srai
-            funct7 = opcode_info.get('funct7', 0)
-            # Shift amount is encoded in the lower 5 bits of the immediate
-            shamt = imm & 0x1F
-            # Immediate is funct7 (7 bits) concatenated with shamt (5 bits)
-            imm = (funct7 << 5) | shamt
-        
-        # Assemble the instruction: imm[11:0] | rs1 | funct3 | rd | opcode
-        instruction = (imm << 20) | (rs1 << 15) | (funct3 << 12) | (rd << 7) | opcode
-        return instruction
-    
-    def assemble_s_type(self, opcode_info, operands):
-        """Assemble S-type instruction (store)"""
-        if len(operands) != 2:
-            raise ValueError(f"S-type instruction requires 2 operands, got {len(operands)}")
-            
-        rs2 = self.parse_register(operands[0])
-        offset, rs1 = self.parse_memory_operand(operands[1])
-        
-        opcode = opcode_info['opcode']
-        funct3 = opcode_info['funct3']
-        
-        # Ensure the immediate is within range
-        if offset < -2048 or offset > 2047:
-            raise ValueError(f"Immediate value {offset} is out of range for S-type instruction")
-            
-        # Split immediate into two parts for S-type encoding
-        imm_11_5 = (offset >> 5) & 0x7F  # Upper 7 bits
-        imm_4_0 = offset & 0x1F          # Lower 5 bits
-        
-        # Assemble the instruction: imm[11:5] | rs2 | rs1 | funct3 | imm[4:0] | opcode
-        instruction = (imm_11_5 << 25) | (rs2 << 20) | (rs1 << 15) | (funct3 << 12) | (imm_4_0 << 7) | opcode
-        return instruction
-    
-    def assemble_b_type(self, opcode_info, operands, current_address):
-        """Assemble B-type instruction (branch)"""
-        if len(operands) != 3:
-            raise ValueError(f"B-type instruction requires 3 operands, got {len(operands)}")
-            
-        rs1 = self.parse_register(operands[0])
-        rs2 = self.parse_register(operands[1])
-        
-        # Handle target label or immediate
-        target = operands[2].strip()
-        if target in self.symbol_table:
-            # Calculate offset relative to current instruction
-            offset = self.symbol_table[target] - current_address
-        else:
-            offset = self.parse_immediate(target)
-        
-        # Ensure offset is a multiple of 2 (half-word aligned)
-        if offset % 2 != 0:
-            raise ValueError(f"Branch offset {offset} must be a multiple of 2")
-            
-        # Ensure the offset is within range
-        if offset < -4096 or offset > 4095:
-            raise ValueError(f"Branch offset {offset} is out of range")
-            
-        # Extract the bits of the immediate in the order they appear in the instruction
-        imm_12 = (offset >> 12) & 0x1     # bit 12
-        imm_11 = (offset >> 11) & 0x1     # bit 11
-        imm_10_5 = (offset >> 5) & 0x3F   # bits 10:5
-        imm_4_1 = (offset >> 1) & 0xF     # bits 4:1
-        
-        opcode = opcode_info['opcode']
-        funct3 = opcode_info['funct3']
-        
-        # Assemble the instruction: imm[12] | imm[10:5] | rs2 | rs1 | funct3 | imm[4:1] | imm[11] | opcode
-        instruction = (imm_12 << 31) | (imm_10_5 << 25) | (rs2 << 20) | (rs1 << 15) | \
-                      (funct3 << 12) | (imm_4_1 << 8) | (imm_11 << 7) | opcode
-        return instruction
-    
-    def assemble_u_type(self, opcode_info, operands):
-        """Assemble U-type instruction (LUI, AUIPC)"""
-        if len(operands) != 2:
-            raise ValueError(f"U-type instruction requires 2 operands, got {len(operands)}")
-            
-        rd = self.parse_register(operands[0])
-        imm = self.parse_immediate(operands[1])
-        
-        # U-type handles 20 bits of immediate, which are placed in the upper 20 bits of the 32-bit value
-        imm_31_12 = (imm >> 12) & 0xFFFFF
-        
-        opcode = opcode_info['opcode']
-        
-        # Assemble the instruction: imm[31:12] | rd | opcode
-        instruction = (imm_31_12 << 12) | (rd << 7) | opcode
-        return instruction
-    
-    def assemble_j_type(self, opcode_info, operands, current_address):
-        """Assemble J-type instruction (JAL)"""
-        if len(operands) != 2:
-            raise ValueError(f"J-type instruction requires 2 operands, got {len(operands)}")
-            
-        rd = self.parse_register(operands[0])
-        
-        # Handle target label or immediate
-        target = operands[1].strip()
-        if target in self.symbol_table:
-            # Calculate offset relative to current instruction
-            offset = self.symbol_table[target] - current_address
+        return program
+
+    def _layout(self, program):
+        """Split program into sections, expand pseudo-instructions and relax li/la
+
+        li/la of a label start as one instruction and grow to two when the label's
+        address needs it; the layout is repeated until no sequence grows. Only
+        labels, .align and li/la of labels are revisited: everything else has a
+        fixed size, counted once.
+        """
+        text = []
+        data = self.data_records
+        symbol_table = self.symbol_table
+        fixed = 0       # fixed-size .text words so far
+        variable = []   # (fixed words before, record, index into text) of .align and li/la of labels
+        labels = []     # (label, fixed words before, variable items before)
+        section = text
+        append = text.append
+        for record in program:
+            mnemonic = record.mnemonic
+            if section is text and mnemonic not in LAYOUT_MNEMONICS:
+                # Plain instructions and label-only lines
+                if record.label is not None:
+                    labels.append((record.label, fixed, len(variable)))
+                if mnemonic is not None:
+                    fixed += 1
+                append(record)
+                continue
+            if mnemonic == '.text' or mnemonic == '.data':
+                if record.operands:
+                    raise ValueError(f"Line {record.lineno}: {mnemonic} takes no operands")
+                if record.label is not None:
+                    section.append(SourceLine(record.label, None, (), record.lineno))
+                    if section is text:
+                        labels.append((record.label, fixed, len(variable)))
+                section = data if mnemonic == '.data' else text
+                continue
+            if section is data:
+                if mnemonic is not None and mnemonic not in DIRECTIVES:
+                    raise ValueError(f"Line {record.lineno}: Instruction in .data section: {mnemonic}")
+                data.append(record)
+                continue
+            if record.label is not None:
+                labels.append((record.label, fixed, len(variable)))
+            if mnemonic in PSEUDO_INSTRUCTIONS:
+                expansion = self.expand_pseudo(record)
+                if expansion is None:
+                    variable.append((fixed, record, len(text)))
+                    text.append(record)
+                    continue
+                text.extend(expansion)
+                fixed += len(expansion)
+                continue
+            if mnemonic == '.align':
+                self.directive_size(record, 0)
+                variable.append((fixed, record, len(text)))
+            else:
+                fixed += self.directive_size(record, 0)
+            append(record)
+
+        address = 0
+        for record in data:
+            if record.label is not None:
+                symbol_table[record.label] = address
+                self.data_labels.add(record.label)
+            if record.mnemonic is not None:
+                address += 4 * self.directive_size(record, address)
+
+        sizes = [1] * len(variable)
+        while True:
+            # Words added by the variable items before each one
+            extra = 0
+            before = []
+            for k, (words, record, _) in enumerate(variable):
+                before.append(extra)
+                if record.mnemonic == '.align':
+                    sizes[k] = self.directive_size(record, 4 * (words + extra))
+                extra += sizes[k]
+            before.append(extra)
+            for label, words, count in labels:
+                symbol_table[label] = 4 * (words + before[count])
+
+            grown = False
+            for k, (_, record, _) in enumerate(variable):
+                if record.mnemonic != '.align' and sizes[k] < 2:
+                    if len(load_sequence('x0', self._load_value(record))) > 1:
+                        sizes[k] = 2
+                        grown = True
+            if not grown:
+                break
+
+        # Replace each li/la of a label by its final sequence
+        expanded = []
+        start = 0
+        for k, (_, record, index) in enumerate(variable):
+            if record.mnemonic == '.align':
+                continue
+            expanded.extend(text[start:index])
+            expanded.extend(self._load_records(record, self._load_value(record), sizes[k]))
+            start = index + 1
+        if not start:
+            return text
+        expanded.extend(text[start:])
+        return expanded
+
+    def text_symbols(self):
+        """Labels of the .text section and their addresses"""
+        data_labels = self.data_labels
+        return {label: address for label, address in self.symbol_table.items()
+                if label not in data_labels}
+
+    def expand_pseudo(self, record):
+        """Base instruction records for a pseudo-instruction
+
+        Returns None for li/la of a label, whose length depends on the layout.
+        """
+        mnemonic = record.mnemonic
+        operands = record.operands
+        expected = PSEUDO_OPERANDS[mnemonic]
+        if len(operands) != expected:
+            raise ValueError(f"Line {record.lineno}: {mnemonic} requires {expected} "
+                             f"operand{'s' if expected != 1 else ''}, got {len(operands)}")
+        if mnemonic == 'li' or mnemonic == 'la':
+            try:
+                value = parse_literal(operands[1])
+            except ValueError:
+                if not SYMBOL_RE.match(operands[1]):
+                    raise ValueError(f"Line {record.lineno}: Invalid {mnemonic} value: {operands[1]}") from None
+                return None
+            if not -0x80000000 <= value <= 0xFFFFFFFF:
+                raise ValueError(f"Line {record.lineno}: Immediate value {value} is out of range for {mnemonic}")
+            return self._load_records(record, value)
+        if mnemonic == 'nop':
+            base = ('addi', ('x0', 'x0', '0'))
+        elif mnemonic == 'mv':
+            base = ('addi', (operands[0], operands[1], '0'))
+        elif mnemonic == 'j':
+            base = ('jal', ('x0', operands[0]))
+        elif mnemonic == 'call':
+            base = ('jal', ('ra', operands[0]))
         else:
-            offset = self.parse_immediate(target)
-        
-        # Ensure offset is a multiple of 2 (half-word aligned)
-        if offset % 2 != 0:
-            raise ValueError(f"Jump offset {offset} must be a multiple of 2")
-            
-        # Ensure the offset is within range
-        if offset < -1048576 or offset > 1048575:
-            raise ValueError(f"Jump offset {offset} is out of range")
-            
-        # Extract the bits of the immediate in the order they appear in the instruction
-        imm_20 = (offset >> 20) & 0x1      # bit 20
-        imm_10_1 = (offset >> 1) & 0x3FF   # bits 10:1
-        imm_11 = (offset >> 11) & 0x1      # bit 11
-        imm_19_12 = (offset >> 12) & 0xFF  # bits 19:12
-        
-        opcode = opcode_info['opcode']
-        
-        # Assemble the instruction: imm[20] | imm[10:1] | imm[11] | imm[19:12] | rd | opcode
-        instruction = (imm_20 << 31) | (imm_10_1 << 21) | (imm_11 << 20) | \
-                      (imm_19_12 << 12) | (rd << 7) | opcode
-        return instruction
-    
+            base = ('jalr', ('x0', 'ra', '0'))
+        return [SourceLine(record.label, base[0], base[1], record.lineno)]
+
+    def _load_value(self, record):
+        """Current address of the label named by an li/la record"""
+        try:
+            return self.parse_immediate(record.operands[1])
+        except ValueError as e:
+            raise ValueError(f"Line {record.lineno}: {e}") from None
+
+    def _load_records(self, record, value, words=1):
+        """Records of the lui/addi sequence for an li/la record loading value"""
+        return [SourceLine(record.label if i == 0 else None, mnemonic, operands, record.lineno)
+                for i, (mnemonic, operands) in enumerate(load_sequence(record.operands[0], value, words))]
+
+    def directive_size(self, record, address):
+        """Number of words a directive at address takes"""
+        mnemonic = record.mnemonic
+        if mnemonic == '.word':
+            if not record.operands:
+                raise ValueError(f"Line {record.lineno}: .word expects at least 1 operand")
+            return len(record.operands)
+        if mnemonic == '.align':
+            return (-address % self.alignment(record)) // 4
+        if mnemonic == '.space':
+            if len(record.operands) != 1:
+                raise ValueError(f"Line {record.lineno}: .space expects 1 operand")
+            try:
+                size = parse_literal(record.operands[0])
+            except ValueError:
+                size = -1
+            if not 0 <= size <= 1 << 26:
+                raise ValueError(f"Line {record.lineno}: Invalid .space size: {record.operands[0]}")
+            return (size + 3) // 4
+        return 0
+
+    def alignment(self, record):
+        """Byte boundary an .align record pads to: the next multiple of 2**n bytes"""
+        if len(record.operands) != 1:
+            raise ValueError(f"Line {record.lineno}: .align expects 1 operand")
+        try:
+            power = int(record.operands[0], 0)
+        except ValueError:
+            power = -1
+        if not 0 <= power <= 16:
+            raise ValueError(f"Line {record.lineno}: Invalid alignment: {record.operands[0]}")
+        return max(4, 1 << power)
+
+    def directive_words(self, record, address, fill=NOP):
+        """Words emitted by a directive at address; padding is fill"""
+        if record.mnemonic == '.word':
+            words = []
+            self.directive_size(record, address)
+            for operand in record.operands:
+                try:
+                    value = self.parse_immediate(operand)
+                except ValueError as e:
+                    raise ValueError(f"Line {record.lineno}: {e}") from None
+                if not -0x80000000 <= value <= 0xFFFFFFFF:
+                    raise ValueError(f"Line {record.lineno}: Value {value} is out of range for .word")
+                words.append(value & 0xFFFFFFFF)
+            return words
+        return [fill] * self.directive_size(record, address)
+
+    def assemble_data(self):
+        """Assemble the .data records laid out by first_pass into self.data"""
+        data = array('I')
+        for record in self.data_records:
+            if record.mnemonic is not None:
+                data.extend(self.directive_words(record, 4 * len(data), fill=0))
+        self.data = data
+        return data
+
+    def source_map(self, program):
+        """Records of the words of program (source text or records), indexed by word address
+
+        Padding words map to the directive that emitted them, and the words of a
+        pseudo-instruction to the base instructions it expanded to. After
+        assemble_many with optimize set, the map follows the scheduled order.
+        """
+        if isinstance(program, str):
+            program = self.parse_source(program)
+        records = []
+        for record in self.first_pass(program):
+            if record.mnemonic is None:
+                continue
+            if record.mnemonic in DIRECTIVES:
+                records.extend([record] * self.directive_size(record, 4 * len(records)))
+            else:
+                records.append(record)
+        if self.placement is not None and len(self.placement) == len(records):
+            records = [records[index] for index in self.placement]
+        return records
+
     def assemble_instruction(self, line, address):
         """Assemble a single instruction line"""
-        # Remove comments and strip whitespace
-        line = re.sub(r'#.*$', '', line).strip()
-        if not line:
+        record = tokenize_line(line)
+        if record is None or record.mnemonic is None:
             return None
-            
-        # Check for and remove label at the beginning of the line
-        label_match = re.match(r'^([a-zA-Z0-9_]+):', line)
-        if label_match:
-            # Remove the label from the line
-            line = line[label_match.end():].strip()
-            if not line:  # If line only contains a label
-                return None
-        
-        # Split instruction into opcode and operands
-        parts = line.split()
-        opcode_str = parts[0].lower()
-        operands_str = " ".join(parts[1:])
-        
-        # Parse operands (comma-separated)
-        operands = [op.strip() for op in operands_str.split(',')]
-        
-        # Get opcode information
-        if opcode_str not in self.opcodes:
-            raise ValueError(f"Unknown opcode: {opcode_str}")
-            
-        opcode_info = self.opcodes[opcode_str]
-        
-        # Assemble based on instruction type
-        if opcode_info['type'] == 'R':
-            return self.assemble_r_type(opcode_info, operands)
-        elif opcode_info['type'] == 'I':
-            return self.assemble_i_type(opcode_info, operands)
-        elif opcode_info['type'] == 'S':
-            return self.assemble_s_type(opcode_info, operands)
-        elif opcode_info['type'] == 'B':
-            return self.assemble_b_type(opcode_info, operands, address)
-        elif opcode_info['type'] == 'U':
-            return self.assemble_u_type(opcode_info, operands)
-        elif opcode_info['type'] == 'J':
-            return self.assemble_j_type(opcode_info, operands, address)
+        return self.assemble_record(record, address)
+
+    def assemble_record(self, record, address):
+        """Assemble a tokenized instruction record"""
+        encoder = self.encoders.get(record.mnemonic)
+        if encoder is None:
+            raise ValueError(f"Unknown opcode: {record.mnemonic}")
+        return encoder.encode(record.operands, address)
+
+    def fingerprint(self):
+        """Hash of everything besides the source that determines the assembled image"""
+        digest = hashlib.sha256(f"risc-assembler/{CACHE_FORMAT_VERSION}"
+                                f"{'/O' if self.optimize else ''}\n".encode())
+        for mnemonic, info in sorted(self.opcodes.items()):
+            digest.update(f"{mnemonic}:{sorted(info.items())}\n".encode())
+        digest.update(repr(sorted(self.registers.items())).encode())
+        return digest.hexdigest()
+
+    def assemble_many(self, program, memo=None):
+        """Assemble a whole program (source text or tokenized records) into an array of words
+
+        Word i of the result is the instruction at address 4*i; the .data image is
+        left in self.data. When an EncodingMemo
+        is given, lines whose text and referenced label addresses were seen before
+        reuse their memoized encoding instead of being encoded again.
+        """
+        if isinstance(program, str):
+            program = self.parse_source(program)
+
+        # First pass to collect all labels and expand pseudo-instructions
+        program = self.first_pass(program)
+        self.assemble_data()
+
+        # Second pass to encode instructions
+        if memo is not None:
+            words = self._encode_memoized(program, memo)
         else:
-            raise ValueError(f"Unknown instruction type: {opcode_info['type']}")
+            words = self._encode(program)
+        if self.optimize:
+            words = self._schedule(words, program)
+        return words
+
+    def _encode(self, program):
+        """Second pass encoding every instruction"""
+        encoders = self.encoders
+        words = array('I')
+        append = words.append
+        address = 0
+
+        for record in program:
+            mnemonic = record.mnemonic
+            if mnemonic is None:
+                continue
+            if mnemonic in DIRECTIVES:
+                padding = self.directive_words(record, address)
+                words.extend(padding)
+                address += 4 * len(padding)
+                continue
+
+            try:
+                encoder = encoders.get(mnemonic)
+                if encoder is None:
+                    raise ValueError(f"Unknown opcode: {mnemonic}")
+                append(encoder.encode(record.operands, address))
+            except ValueError as e:
+                raise ValueError(f"Line {record.lineno}: {e}") from None
+            address += 4
+
+        return words
     
-    def assemble(self, assembly_code):
-        """Assemble RISC assembly code to machine code"""
-        lines = assembly_code.split('\n')
-        
-        # First pass to collect all labels
-        self.first_pass(lines)
-        
-        # Second pass to assemble instructions
-        machine_code = []
+    def _encode_memoized(self, program, memo):
+        """Second pass that consults memo before encoding each instruction"""
+        encoders = self.encoders
+        symbol_table = self.symbol_table
+        symbols = symbol_table.keys()
+        words = array('I')
+        append = words.append
         address = 0
-        
-        for line in lines:
-            # Remove comments and strip whitespace
-            line = re.sub(r'#.*$', '', line).strip()
-            if not line:
+
+        for record in program:
+            mnemonic = record.mnemonic
+            if mnemonic is None:
                 continue
-                
-            # Skip assembler directives
-            if self.is_directive(line):
+            if mnemonic in DIRECTIVES:
+                padding = self.directive_words(record, address)
+                words.extend(padding)
+                address += 4 * len(padding)
                 continue
-                
-            instruction = self.assemble_instruction(line, address)
-            if instruction is not None:
-                machine_code.append((address, instruction))
-                address += 4
-        
-        return machine_code
+
+            encoder = encoders.get(mnemonic)
+            if encoder is None:
+                raise ValueError(f"Line {record.lineno}: Unknown opcode: {mnemonic}")
+
+            # The key holds whatever the encoding depends on: the line text and, for
+            # label operands, the label address (relative to this one if PC-relative)
+            operands = record.operands
+            if symbols.isdisjoint(operands):
+                key = (mnemonic, operands)
+            elif encoder.pc_relative:
+                key = (mnemonic, operands,
+                       tuple([symbol_table[op] - address for op in operands if op in symbol_table]))
+            else:
+                key = (mnemonic, operands,
+                       tuple([symbol_table[op] for op in operands if op in symbol_table]))
+
+            word = memo.get(key)
+            if word is None:
+                try:
+                    word = encoder.encode(operands, address)
+                except ValueError as e:
+                    raise ValueError(f"Line {record.lineno}: {e}") from None
+                memo.put(key, word)
+            append(word)
+            address += 4
+
+        return words
+
+    def _schedule(self, words, program):
+        """Run the scheduling pass over an assembled image"""
+        self.placement = None
+        # source_map lays the program out again; keep the .data layout of the real pass
+        data_records, data_labels = self.data_records, self.data_labels
+        records = self.source_map(program)
+        self.data_records, self.data_labels = data_records, data_labels
+        fixed = [index for index, record in enumerate(records) if record.mnemonic in DIRECTIVES]
+        leaders = [address >> 2 for address in self.text_symbols().values()]
+        words, placement, self.schedule_changes = schedule_program(words, leaders, fixed)
+        self.placement = placement
+        return words
+
+    def assemble_stream(self, lines):
+        """Assemble an iterable of source lines in one pass, yielding (address, word) pairs
+
+        Words are yielded as soon as they are final. An instruction naming a label that
+        has not been seen yet is held as a fixup and backpatched when the label is
+        defined, so only the words from the oldest unresolved fixup onwards are buffered.
+        Labels named by li, la and .word must be defined above them, and .data is
+        not supported.
+        """
+        symbol_table = self.symbol_table
+        encoders = self.encoders
+        pending = deque()  # [address, word] slots awaiting output, word None until patched
+        fixups = {}        # label -> [(slot, record), ...]
+        address = 0
+
+        for record in self._stream_records(iter_records(lines)):
+            if record.label is not None:
+                symbol_table[record.label] = address
+                waiting = fixups.pop(record.label, None)
+                if waiting:
+                    for slot, fixup in waiting:
+                        self._encode_slot(slot, fixup, fixups)
+                    while pending and pending[0][1] is not None:
+                        yield tuple(pending.popleft())
+
+            mnemonic = record.mnemonic
+            if mnemonic is None:
+                continue
+            if mnemonic in DIRECTIVES:
+                for word in self.directive_words(record, address):
+                    if pending:
+                        pending.append([address, word])
+                    else:
+                        yield (address, word)
+                    address += 4
+                continue
+
+            encoder = encoders.get(mnemonic)
+            if encoder is None:
+                raise ValueError(f"Line {record.lineno}: Unknown opcode: {mnemonic}")
+
+            if not pending:
+                # Nothing buffered: resolvable words go straight out
+                try:
+                    word = encoder.encode(record.operands, address)
+                except UndefinedSymbolError:
+                    word = None
+                except ValueError as e:
+                    raise ValueError(f"Line {record.lineno}: {e}") from None
+                if word is not None:
+                    yield (address, word)
+                    address += 4
+                    continue
+
+            slot = [address, None]
+            pending.append(slot)
+            self._encode_slot(slot, record, fixups)
+            address += 4
+
+        if fixups:
+            symbol, waiting = min(fixups.items(), key=lambda item: item[1][0][1].lineno)
+            raise ValueError(f"Line {waiting[0][1].lineno}: Undefined symbol: {symbol}")
+        while pending:
+            yield tuple(pending.popleft())
+
+    def _stream_records(self, records):
+        """Expand pseudo-instructions in a record stream for assemble_stream
+
+        li/la of a label take the shortest sequence for its address, which is
+        only known once the label is defined, so a later label is an error.
+        """
+        symbol_table = self.symbol_table
+        for record in records:
+            mnemonic = record.mnemonic
+            if mnemonic not in EXPANDED_MNEMONICS:
+                yield record
+                continue
+            if mnemonic == '.data':
+                raise ValueError(f"Line {record.lineno}: .data is not supported when streaming")
+            expansion = self.expand_pseudo(record)
+            if expansion is None:
+                if record.label is not None:
+                    # Define the label first: it may be the one being loaded
+                    yield SourceLine(record.label, None, (), record.lineno)
+                    record = SourceLine(None, mnemonic, record.operands, record.lineno)
+                if record.operands[1] not in symbol_table:
+                    raise ValueError(f"Line {record.lineno}: {mnemonic} of a label defined further "
+                                     f"on is not supported when streaming: {record.operands[1]}")
+                expansion = self._load_records(record, symbol_table[record.operands[1]])
+            yield from expansion
+
+    def _encode_slot(self, slot, record, fixups):
+        """Encode record into a pending stream slot, or register it as a fixup"""
+        try:
+            slot[1] = self.encoders[record.mnemonic].encode(record.operands, slot[0])
+        except UndefinedSymbolError as e:
+            fixups.setdefault(e.symbol, []).append((slot, record))
+        except ValueError as e:
+            raise ValueError(f"Line {record.lineno}: {e}") from None
+
+    def assemble(self, assembly_code):
+        """Assemble RISC assembly code to a list of (address, instruction) pairs"""
+        words = self.assemble_many(assembly_code)
+        return list(zip(range(0, 4 * len(words), 4), words))
+
+class EncodingMemo:
+    """LRU memo of per-line encodings, keyed by line text and label dependencies"""
+
+    def __init__(self, capacity=1 << 16):
+        self.capacity = capacity
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """Return the memoized word for key, or None"""
+        word = self.entries.get(key)
+        if word is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.entries.move_to_end(key)
+        return word
+
+    def put(self, key, word):
+        """Memoize word for key, evicting the least recently used entry if full"""
+        self.entries[key] = word
+        if len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+
+class AssemblyCache:
+    """Content-addressed on-disk cache of assembled images
+
+    Images (instruction and data words) are stored under a hash of the source
+    text and the assembler's fingerprint (opcode table and format version), so
+    an unchanged input is returned without assembling it. Changed inputs are assembled through an
+    EncodingMemo that is persisted alongside the images, so only lines whose
+    text or referenced label addresses changed are encoded again. The memo
+    belongs to one assembler fingerprint: it is discarded when assembling
+    with an assembler whose fingerprint differs.
+    """
+
+    MEMO_FILE = 'line_memo.marshal'
+
+    def __init__(self, directory, memo_capacity=1 << 16):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.memo = EncodingMemo(memo_capacity)
+        self.image_hits = 0
+        self.image_misses = 0
+        self._memo_loaded = False
+        self._memo_fingerprint = None
+
+    def key(self, assembler, assembly_code):
+        """Cache key for assembling assembly_code with assembler"""
+        digest = hashlib.sha256(assembler.fingerprint().encode())
+        digest.update(assembly_code.encode())
+        return digest.hexdigest()
+
+    def assemble(self, assembler, assembly_code):
+        """Return the image for assembly_code, assembling it only on a cache miss"""
+        key = self.key(assembler, assembly_code)
+        path = os.path.join(self.directory, key + '.img')
+
+        cached = self._load_image(path)
+        if cached is not None:
+            words, data, symbols, data_labels = cached
+            assembler.symbol_table.update(symbols)
+            assembler.data = data
+            assembler.data_labels = set(data_labels)
+            self.image_hits += 1
+            return words
+
+        self.image_misses += 1
+        self._load_memo(assembler.fingerprint())
+        words = assembler.assemble_many(assembly_code, memo=self.memo)
+        self._store_image(path, words, assembler)
+        return words
+
+    def save(self):
+        """Persist the line memo so later runs can reuse its encodings"""
+        if not self._memo_loaded:
+            return
+        entries = list(self.memo.entries.items())
+        self._write_atomic(os.path.join(self.directory, self.MEMO_FILE),
+                           marshal.dumps((sys.version_info[:2], self._memo_fingerprint, entries)))
+
+    def stats(self):
+        """Hit/miss counters for the image cache and the line memo"""
+        return {
+            'image_hits': self.image_hits,
+            'image_misses': self.image_misses,
+            'line_hits': self.memo.hits,
+            'line_misses': self.memo.misses,
+        }
+
+    def _load_image(self, path):
+        try:
+            with open(path, 'rb') as f:
+                header = json.loads(f.readline())
+                words = array('I')
+                words.frombytes(f.read())
+        except (OSError, ValueError):
+            return None
+        if sys.byteorder != 'little':
+            words.byteswap()
+        if len(words) != header['words'] + header['data_words']:
+            return None
+        data = words[header['words']:]
+        del words[header['words']:]
+        return words, data, header['symbols'], header['data_labels']
+
+    def _store_image(self, path, words, assembler):
+        data = assembler.data
+        header = json.dumps({'words': len(words), 'data_words': len(data),
+                             'symbols': assembler.symbol_table,
+                             'data_labels': sorted(assembler.data_labels)}).encode()
+        self._write_atomic(path, header + b'\n' + image_bytes(words) + image_bytes(data))
+
+    def _load_memo(self, fingerprint):
+        if self._memo_loaded and fingerprint == self._memo_fingerprint:
+            return
+        # Encodings memoized for another opcode table or format are not reused
+        self.memo.entries.clear()
+        self._memo_loaded = True
+        self._memo_fingerprint = fingerprint
+        try:
+            with open(os.path.join(self.directory, self.MEMO_FILE), 'rb') as f:
+                version, memo_fingerprint, entries = marshal.load(f)
+        except (OSError, EOFError, ValueError, TypeError):
+            return
+        # marshal output is only portable between identical Python versions
+        if tuple(version) == sys.version_info[:2] and memo_fingerprint == fingerprint:
+            self.memo.entries.update(entries)
+
+    def _write_atomic(self, path, data):
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
 
 def format_hex(num):
     """Format a number as a 32-bit hex string"""
@@ -441,50 +1420,227 @@ def format_binary(num):
     """Format a number as a 32-bit binary string"""
     return f"0b{num:032b}"
 
+def format_listing_line(address, instruction):
+    """Format one 'address: hex binary' listing line"""
+    return f"{format_hex(address)}: {format_hex(instruction)} {format_binary(instruction)}"
+
+def image_bytes(words, byteorder='little'):
+    """Return an array of 32-bit words as one bytes buffer in the given byte order"""
+    if sys.byteorder != byteorder:
+        words = array('I', words)
+        words.byteswap()
+    return words.tobytes()
+
+def format_hex_image(words):
+    """Format words for $readmemh: one 8-digit hex word per line, built in a single pass"""
+    if not words:
+        return ''
+    # Big-endian bytes grouped four at a time give each word's hex digits in order
+    return image_bytes(words, 'big').hex('\n', 4) + '\n'
+
+def format_listing(words, base_address=0):
+    """Format words as 'address: hex binary' listing lines"""
+    return ''.join([f"0x{address:08x}: 0x{word:08x} 0b{word:032b}\n"
+                    for address, word in zip(range(base_address, base_address + 4 * len(words), 4), words)])
+
+def format_initializers(words, base_index=0, memory='instr_mem'):
+    """Format words as Verilog initializer statements for memory"""
+    return ''.join([f"{memory}[{i}] = 32'h{word:08x};\n"
+                    for i, word in enumerate(words, base_index)])
+
+# Output formats: name -> (open mode, formatter taking (words, first address))
+OUTPUT_FORMATS = {
+    'listing': ('w', format_listing),
+    'hex': ('w', lambda words, address: format_hex_image(words)),
+    'bin': ('wb', lambda words, address: image_bytes(words)),
+}
+
+# Words buffered per write when streaming
+STREAM_CHUNK_WORDS = 1 << 14
+
+def open_input(path):
+    """Open an input path for reading, with '-' meaning stdin"""
+    return sys.stdin if path == '-' else open(path, 'r')
+
+def open_output(path, mode):
+    """Open an output path for writing, defaulting to stdout"""
+    if path:
+        return open(path, mode)
+    stdout = sys.stdout.buffer if 'b' in mode else sys.stdout
+    # Leave stdout open when the caller's with-block exits
+    return open(stdout.fileno(), mode, closefd=False)
+
+def write_stream(assembler, lines, out, formatter):
+    """Stream-assemble lines, writing formatted output in fixed-size chunks"""
+    chunk = array('I')
+    chunk_address = 0
+    for address, instruction in assembler.assemble_stream(lines):
+        if not chunk:
+            chunk_address = address
+        chunk.append(instruction)
+        if len(chunk) >= STREAM_CHUNK_WORDS:
+            out.write(formatter(chunk, chunk_address))
+            chunk = array('I')
+    if chunk:
+        out.write(formatter(chunk, chunk_address))
+
+def write_image(words, data, output_file, output_format='text', data_out=None):
+    """Write an assembled image in output_format, and the .data image to data_out if given"""
+    if data_out:
+        mode, formatter = OUTPUT_FORMATS.get(output_format, OUTPUT_FORMATS['hex'])
+        with open_output(data_out, mode) as out:
+            out.write(formatter(data, 0))
+
+    if output_format != 'text':
+        # Each image is formatted in bulk and written with a single call
+        mode, formatter = OUTPUT_FORMATS[output_format]
+        with open_output(output_file, mode) as out:
+            out.write(formatter(words, 0))
+        return
+
+    # Listing followed by a memory initialization format for simulation
+    with open_output(output_file, 'w') as out:
+        out.write(format_listing(words) +
+                  "\n\n// Memory initialization format\n" +
+                  format_initializers(words))
+        if data:
+            out.write("\n// Data memory initialization\n" +
+                      format_initializers(data, memory='data_mem'))
+
 def main():
-    if len(sys.argv) < 2:
-        print("Usage: python risc_assembler.py <input_file> [output_file]")
-        sys.exit(1)
+    parser = argparse.ArgumentParser(description="Assemble RISC assembly code into machine code")
+    parser.add_argument('input_file', help="assembly source file, or - to read stdin")
+    parser.add_argument('output_file', nargs='?', help="output file (default: stdout)")
+    parser.add_argument('-f', '--format', choices=['text'] + list(OUTPUT_FORMATS),
+                        help="output format: text (listing plus instr_mem initializers, the "
+                             "default), listing ('address: hex binary' lines), hex ($readmemh "
+                             "image) or bin (raw little-endian words)")
+    parser.add_argument('--data-out', metavar='FILE',
+                        help="write the .data image to FILE, in the output format (hex for "
+                             "text); text output also lists it as data_mem initializers")
+    parser.add_argument('--stream', action='store_true',
+                        help="assemble in a single pass, writing each word as soon as it is "
+                             "final (memory stays bounded regardless of program size)")
+    parser.add_argument('--cache-dir',
+                        help="reuse images assembled from identical source, and per-line "
+                             "encodings from earlier runs, stored in this directory")
+    parser.add_argument('--cache-stats', action='store_true',
+                        help="print cache hit/miss counts to stderr")
+    parser.add_argument('-O', '--optimize', action='store_true',
+                        help="reorder instructions within basic blocks to hide load-use "
+                             "stalls, reporting the rewritten blocks to stderr")
+    parser.add_argument('--verify', action='store_true',
+                        help="with -O, run the program with and without scheduling on the "
+                             "functional simulator and the pipeline model and compare them")
+    args = parser.parse_args()
     
-    input_file = sys.argv[1]
-    output_file = sys.argv[2] if len(sys.argv) > 2 else None
+    input_file = args.input_file
+    output_file = args.output_file
+    output_format = args.format or ('listing' if args.stream else 'text')
+    if args.stream and output_format == 'text':
+        parser.error("--stream supports the listing, hex and bin formats")
+    if args.stream and args.cache_dir:
+        parser.error("--cache-dir cannot be combined with --stream")
+    if args.stream and args.optimize:
+        parser.error("-O cannot be combined with --stream")
+    if args.stream and args.data_out:
+        parser.error("--data-out cannot be combined with --stream")
+    if args.verify and not args.optimize:
+        parser.error("--verify requires -O")
     
     try:
-        with open(input_file, 'r') as f:
+        assembler = RiscAssembler(optimize=args.optimize)
+
+        if args.stream:
+            mode, formatter = OUTPUT_FORMATS[output_format]
+            with open_input(input_file) as f, open_output(output_file, mode) as out:
+                write_stream(assembler, f, out, formatter)
+            return
+
+        with open_input(input_file) as f:
             assembly_code = f.read()
         
-        assembler = RiscAssembler()
-        machine_code = assembler.assemble(assembly_code)
-        
-        # Prepare output
-        output_lines = []
-        for address, instruction in machine_code:
-            hex_instr = format_hex(instruction)
-            bin_instr = format_binary(instruction)
-            output_lines.append(f"{format_hex(address)}: {hex_instr} {bin_instr}")
-        
-        # Write output
-        if output_file:
-            with open(output_file, 'w') as f:
-                for line in output_lines:
-                    f.write(line + '\n')
-                    
-                # Also write a memory initialization format for simulation
-                f.write("\n\n// Memory initialization format\n")
-                for i, (_, instruction) in enumerate(machine_code):
-                    f.write(f"instr_mem[{i}] = 32'h{instruction:08x};\n")
+        if args.cache_dir:
+            cache = AssemblyCache(args.cache_dir)
+            words = cache.assemble(assembler, assembly_code)
+            cache.save()
+            if args.cache_stats:
+                stats = cache.stats()
+                print(f"cache: image hits {stats['image_hits']}, misses {stats['image_misses']}; "
+                      f"line memo hits {stats['line_hits']}, misses {stats['line_misses']}",
+                      file=sys.stderr)
         else:
-            for line in output_lines:
-                print(line)
-                
-            # Also print memory initialization format
-            print("\n\n// Memory initialization format")
-            for i, (_, instruction) in enumerate(machine_code):
-                print(f"instr_mem[{i}] = 32'h{instruction:08x};")
+            words = assembler.assemble_many(assembly_code)
+
+        # A cached image was not scheduled in this run, so there is nothing to report
+        if args.optimize and assembler.placement is not None:
+            print(format_schedule_report(assembler, assembly_code), file=sys.stderr)
+        if args.verify:
+            for line in verify_schedule(assembly_code):
+                print(line, file=sys.stderr)
+
+        write_image(words, assembler.data, output_file, output_format, args.data_out)
     
     except Exception as e:
         print(f"Error: {e}")
         sys.exit(1)
 
+def format_schedule_report(assembler, program):
+    """Describe the blocks the scheduling pass rewrote"""
+    changes = assembler.schedule_changes
+    saved = sum(before - after for _, _, before, after in changes)
+    lines = [f"schedule: {len(changes)} block{'s' if len(changes) != 1 else ''} reordered, "
+             f"{saved} load-use stall{'s' if saved != 1 else ''} removed "
+             f"({saved} cycle{'s' if saved != 1 else ''} per pass)"]
+    records = assembler.source_map(program)
+    for start, end, before, after in changes:
+        linenos = [records[index].lineno for index in range(start, end)]
+        lines.append(f"  lines {min(linenos)}-{max(linenos)}: {before} -> {after} stalls")
+    return "\n".join(lines)
+
+def verify_schedule(program, max_steps=10_000_000):
+    """Run program assembled with and without scheduling and compare the outcome
+
+    Both images run on the functional simulator and the pipeline model; final
+    registers, memory and retired instruction counts must match. Returns
+    report lines with the measured pipeline cycles, and raises ValueError on a
+    mismatch.
+    """
+    # Imported here: the simulators import this module
+    from risc_simulator import RiscSimulator, DEFAULT_MEM_WORDS
+    from risc_pipeline import PipelineModel, Testbench, UNTIL_HALT
+
+    assembler = RiscAssembler()
+    images = [assembler.assemble_many(program), RiscAssembler(optimize=True).assemble_many(program)]
+    data = assembler.data or None
+
+    simulators = [RiscSimulator(words, data=data) for words in images]
+    reasons = [simulator.run(max_steps) for simulator in simulators]
+    plain, scheduled = simulators
+    if None in reasons:
+        raise ValueError(f"Program did not halt within {max_steps} instructions")
+    if plain.regs != scheduled.regs:
+        raise ValueError("Scheduled program leaves different register values")
+    if plain.memory != scheduled.memory:
+        raise ValueError("Scheduled program leaves different memory contents")
+    if plain.instret != scheduled.instret:
+        raise ValueError("Scheduled program retires a different number of instructions")
+    lines = [f"verify: functional simulation matches ({plain.instret} instructions)"]
+
+    index_bits = DEFAULT_MEM_WORDS.bit_length() - 1
+    models = [PipelineModel(Testbench.for_program(words, data, dmem_words=DEFAULT_MEM_WORDS,
+                                                  dmem_index_bits=index_bits))
+              for words in images]
+    reasons = [model.run(until=UNTIL_HALT, max_cycles=4 * max_steps) for model in models]
+    plain, scheduled = models
+    if None in reasons:
+        lines.append("verify: pipeline model skipped (program does not end in a halt loop)")
+        return lines
+    if plain.regs != scheduled.regs or plain.memory != scheduled.memory:
+        raise ValueError("Scheduled program leaves a different pipeline state")
+    lines.append(f"verify: pipeline model matches, {plain.cycles} -> {scheduled.cycles} cycles "
+                 f"({plain.cycles - scheduled.cycles} saved, CPI {plain.cpi:.3f} -> {scheduled.cpi:.3f})")
+    return lines
+
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    main()
\ No newline at end of file
@@ -0,0 +1,567 @@
+#!/usr/bin/env python3
+"""
+RISC Cache Simulator - Trace-driven split I-cache / D-cache study
+
+Runs a program on the functional simulator, recording the instruction fetch
+stream (as runs of sequential fetches) and the lw/sw data addresses, and
+replays both through configurable caches: size, associativity, line size,
+LRU/FIFO/random replacement, write-back or write-through, with or without
+write allocation.
+
+LRU caches with write allocation are simulated with NumPy array operations:
+the LRU stack distance of every access is computed once per (line size, set
+count) by a bottom-up merge count, and hits, misses and dirty evictions for
+any associativity follow from it, so sweeps cost little more than a single
+configuration. FIFO, random and no-write-allocate caches do not have that
+property and are replayed access by access, after consecutive fetches from
+the same line (always hits) have been collapsed.
+
+The cycle estimate starts from cpu.v with single-cycle memories (pipeline
+fill, load-use stalls, three flushed slots per taken branch or jump, as in
+risc_pipeline.py) and adds a stall of the miss penalty for every line fill
+and a line transfer for every dirty writeback. Stores that do not allocate
+go to a write buffer and do not stall. The estimate follows the functional
+simulator's execution, so it is refused for a program where cpu.v loses a
+branch behind a load-use stall or reads a stale jalr base (see
+risc_analyzer.py), unless --allow-rtl-hazards is given.
+
+Usage: python risc_cachesim.py <program.s|program.hex|program.bin|trace.npz> [options]
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+
+import numpy as np
+
+from risc_analyzer import FLUSH_PENALTY
+from risc_assembler import RiscAssembler, load_use_stall, rtl_hazard_sites
+from risc_simulator import (DEFAULT_MAX_STEPS, DEFAULT_MEM_WORDS, HALT_LOOP, RiscSimulator,
+                            fetch_record, load_program)
+
+REPLACEMENT_POLICIES = ('lru', 'fifo', 'random')
+
+# Cycles from reset until the first instruction writes back
+PIPELINE_FILL = 4
+
+DEFAULT_ICACHE = '1K:1:16'
+DEFAULT_DCACHE = '1K:2:16'
+DEFAULT_MISS_LATENCY = 10
+
+class MemoryTrace:
+    """Instruction fetch runs and data accesses of one run, as NumPy arrays
+
+    Fetch run i covers fetch_length[i] instructions from byte address
+    fetch_start[i]; data accesses are byte addresses with a store flag.
+    The program words are kept for the base cycle estimate.
+    """
+
+    def __init__(self, fetch_start, fetch_length, data_address, data_store, words, instret=0, name=None):
+        self.fetch_start = np.asarray(fetch_start, dtype=np.uint32)
+        self.fetch_length = np.asarray(fetch_length, dtype=np.uint32)
+        self.data_address = np.asarray(data_address, dtype=np.uint32)
+        self.data_store = np.asarray(data_store, dtype=bool)
+        self.words = np.asarray(words, dtype=np.uint32)
+        self.instret = instret
+        self.name = name
+
+    @classmethod
+    def from_simulator(cls, simulator, name=None):
+        """Decode the fetch and data traces of a simulator run with trace_memory set"""
+        fetches = np.frombuffer(simulator.fetch_trace, dtype=np.uint64)
+        data = np.frombuffer(simulator.data_trace, dtype=np.uint64)
+        return cls(((fetches >> 7) << 2).astype(np.uint32), (fetches & 0x7F).astype(np.uint32),
+                   ((data >> 1) << 2).astype(np.uint32), (data & 1).astype(bool),
+                   simulator.program, simulator.instret, name)
+
+    @classmethod
+    def load(cls, path):
+        """Read a trace saved with save()"""
+        with np.load(path) as f:
+            return cls(f['fetch_start'], f['fetch_length'], f['data_address'], f['data_store'],
+                       f['words'], int(f['instret']), str(f['name']) or os.path.basename(path))
+
+    def save(self, path):
+        with open(path, 'wb') as f:
+            np.savez_compressed(f, fetch_start=self.fetch_start, fetch_length=self.fetch_length,
+                                data_address=self.data_address, data_store=self.data_store,
+                                words=self.words, instret=self.instret, name=self.name or '')
+
+    @property
+    def fetches(self):
+        return int(self.fetch_length.sum())
+
+def capture_trace(program, data=None, mem_words=DEFAULT_MEM_WORDS, max_steps=DEFAULT_MAX_STEPS, name=None):
+    """Run program on the functional simulator and return its memory trace"""
+    simulator = RiscSimulator(program, mem_words=mem_words, data=data, trace_memory=True)
+    if simulator.run(max_steps) == HALT_LOOP:
+        # The halt loop runs outside the compiled blocks; its one counted fetch is recorded here
+        simulator.fetch_trace.append(fetch_record(simulator.pc, 1))
+    return MemoryTrace.from_simulator(simulator, name)
+
+def load_trace(path, data=None, mem_words=DEFAULT_MEM_WORDS, max_steps=DEFAULT_MAX_STEPS):
+    """Load a saved trace (.npz), or capture one by running a program
+
+    Without data, a source program starts with its own .data image.
+    """
+    if os.path.splitext(path)[1].lower() == '.npz':
+        return MemoryTrace.load(path)
+    assembler = RiscAssembler()
+    program = load_program(path, assembler)[0]
+    if data is None:
+        data = assembler.data or None
+    return capture_trace(program, data, mem_words, max_steps, os.path.basename(path))
+
+def base_cycles(trace):
+    """Cycles of the traced run on cpu.v with single-cycle memories
+
+    Counts the pipeline fill, load-use stalls between consecutive fetches and
+    a full flush for every fetch run that does not continue the previous one.
+    The run is the functional simulator's, so this is cpu.v's count only for
+    a program without rtl_hazard_sites().
+    """
+    if not len(trace.fetch_start):
+        return 0
+    words = trace.words
+    # stalls[k] is 1 when the word at index k + 1 stalls behind the one at k
+    stalls = np.zeros(len(words) + 1, dtype=np.int64)
+    for index in range(len(words) - 1):
+        stalls[index] = load_use_stall(int(words[index]), int(words[index + 1]))
+    prefix = np.concatenate(([0], np.cumsum(stalls)))
+
+    first = (trace.fetch_start >> 2).astype(np.int64)
+    last = first + trace.fetch_length.astype(np.int64) - 1
+    inside = int((prefix[np.minimum(last, len(words))] - prefix[np.minimum(first, len(words))]).sum())
+    follows = first[1:] == last[:-1] + 1
+    across = int(stalls[np.minimum(last[:-1][follows], len(words))].sum())
+    redirects = int((~follows).sum())
+    return trace.fetches + PIPELINE_FILL + inside + across + FLUSH_PENALTY * redirects
+
+def fetch_lines(trace, line_bytes):
+    """Line numbers of the instruction fetch stream with consecutive repeats collapsed
+
+    Returns the lines and the total number of fetches; every collapsed
+    fetch is a hit under any replacement policy.
+    """
+    shift = line_bytes.bit_length() - 1
+    first = trace.fetch_start >> shift
+    last = (trace.fetch_start + 4 * trace.fetch_length - 4) >> shift
+    counts = (last - first + 1).astype(np.int64)
+    run_offsets = np.repeat(np.cumsum(counts) - counts, counts)
+    lines = np.repeat(first.astype(np.int64), counts) + (np.arange(int(counts.sum())) - run_offsets)
+    return _collapse(lines)[0], trace.fetches
+
+def data_lines(trace, line_bytes):
+    """Line numbers and store flags of the data access stream"""
+    return (trace.data_address >> (line_bytes.bit_length() - 1)).astype(np.int64), trace.data_store
+
+def _collapse(lines, stores=None):
+    """Merge consecutive accesses to the same line, a merged access being a store if any was"""
+    if not len(lines):
+        return lines, stores
+    keep = np.ones(len(lines), dtype=bool)
+    keep[1:] = lines[1:] != lines[:-1]
+    if stores is not None:
+        stores = np.logical_or.reduceat(stores, np.nonzero(keep)[0])
+    return lines[keep], stores
+
+def _earlier_greater(values):
+    """For each i, the number of j < i with values[j] > values[i]
+
+    Bottom-up merge sort: at each level the halves of every block are
+    already sorted, and a stable sort of (block, value) keys merges them in
+    linear time. A right-half element's position after the merge tells how
+    many left-half elements are not greater than it.
+    """
+    count = len(values)
+    index_type = np.int32 if count < 1 << 31 else np.int64
+    origin = np.arange(count, dtype=index_type)
+    current = values.astype(np.int64) + 1
+    counts = np.zeros(count, dtype=np.int64)  # kept in the same order as current
+    value_bits = int(current.max()).bit_length() if count else 0
+    slots = np.arange(count, dtype=index_type)
+    level = 0
+    while (1 << level) < count:
+        width = 1 << level
+        block = slots >> (level + 1)
+        offset = slots & (2 * width - 1)
+        merge = np.argsort((block.astype(np.int64) << value_bits) | current, kind='stable')
+        origin = origin[merge]
+        current = current[merge]
+        moved = offset[merge]
+        # Left-half elements not greater than a right-half element precede it
+        # after the merge; a block with a right half has a full left half
+        greater = moved - offset
+        counts = counts[merge] + np.where(moved >= width, greater, 0)
+        level += 1
+    result = np.empty(count, dtype=np.int64)
+    result[origin] = counts
+    return result
+
+class StackDistances:
+    """LRU stack distances of a line stream in a cache with a given number of sets
+
+    distance[i] (in set order) is the number of distinct other lines of the
+    set accessed since the previous access to the same line, or -1 for the
+    first access; the access hits in a W-way LRU cache exactly when
+    0 <= distance < W.
+    """
+
+    def __init__(self, lines, sets):
+        set_index = lines & (sets - 1)
+        self.order = np.argsort(set_index, kind='stable')
+        sequence = lines[self.order]
+        count = len(sequence)
+        # Accesses grouped by line, in time order, and the previous access to each line
+        self.by_line = np.argsort(sequence, kind='stable')
+        self.line_start = np.ones(count, dtype=bool)
+        self.line_start[1:] = sequence[self.by_line[1:]] != sequence[self.by_line[:-1]]
+        previous = np.full(count, -1, dtype=np.int64)
+        previous[self.by_line[1:][~self.line_start[1:]]] = self.by_line[:-1][~self.line_start[1:]]
+
+        positions = np.arange(count)
+        repeats = _earlier_greater(previous)
+        self.distance = np.where(previous >= 0, positions - previous - 1 - repeats, -1)
+
+        # Distinct lines of the same set accessed after each access: one final
+        # access of each such line lies between it and the end of its set
+        final = np.zeros(count, dtype=bool)
+        final[self.by_line[:-1]] = self.line_start[1:]
+        final[self.by_line[-1:]] = True
+        keys = set_index[self.order]
+        set_end = np.searchsorted(keys, keys, side='right')
+        suffix = np.concatenate((np.cumsum(final[::-1])[::-1], [0]))
+        self.after = suffix[positions + 1] - suffix[set_end]
+
+    def misses(self, ways):
+        """Miss flags, in set order"""
+        return (self.distance < 0) | (self.distance >= ways)
+
+    def writebacks(self, ways, stores):
+        """Dirty lines evicted during the run, stores being the store flags in time order"""
+        if not len(self.distance):
+            return 0
+        # Each miss starts a residency of its line, which runs until the next miss
+        miss = self.misses(ways)[self.by_line]
+        dirty = np.bincount(np.cumsum(miss) - 1, weights=stores[self.order][self.by_line]) > 0
+        # A residency ends with an eviction when the same line misses again later,
+        # or when enough other lines of its set follow its final access
+        starts = np.nonzero(miss)[0]
+        evicted = np.zeros(len(starts), dtype=bool)
+        evicted[:-1] = ~self.line_start[starts[1:]]
+        final = np.append(starts[1:], len(miss))[~evicted] - 1
+        evicted[~evicted] = self.after[self.by_line[final]] >= ways
+        return int((dirty & evicted).sum())
+
+class CacheConfig:
+    """Geometry and policies of one cache; write_back is None for a cache that is never written"""
+
+    def __init__(self, size, ways, line, replacement='lru', write_back=True, write_allocate=True):
+        for name, value in (('size', size), ('associativity', ways), ('line size', line)):
+            if value <= 0 or value & (value - 1):
+                raise ValueError(f"Cache {name} must be a power of two, got {value}")
+        if line < 4:
+            raise ValueError(f"Cache line size must be at least one word, got {line}")
+        if size < ways * line:
+            raise ValueError(f"A {size}-byte cache cannot hold {ways} ways of {line}-byte lines")
+        if replacement not in REPLACEMENT_POLICIES:
+            raise ValueError(f"Unknown replacement policy: {replacement}")
+        self.size = size
+        self.ways = ways
+        self.line = line
+        self.replacement = replacement
+        self.write_back = write_back
+        self.write_allocate = write_allocate
+
+    @classmethod
+    def parse(cls, spec, **policies):
+        """Config from SIZE:WAYS:LINE, sizes in bytes with an optional K suffix (e.g. 4K:2:16)"""
+        fields = spec.split(':')
+        if len(fields) != 3:
+            raise ValueError(f"Invalid cache spec {spec!r}, expected SIZE:WAYS:LINE")
+        try:
+            size, ways, line = (int(field[:-1]) << 10 if field[-1:].upper() == 'K' else int(field)
+                                for field in fields)
+        except ValueError:
+            raise ValueError(f"Invalid cache spec {spec!r}, expected SIZE:WAYS:LINE")
+        return cls(size, ways, line, **policies)
+
+    @property
+    def sets(self):
+        return self.size // (self.ways * self.line)
+
+    @property
+    def vectorized(self):
+        """Whether the LRU stack-distance model applies"""
+        return (self.replacement == 'lru' or self.ways == 1) and self.write_allocate
+
+    def miss_penalty(self, latency):
+        """Stall cycles of a line fill: memory latency plus one cycle per word"""
+        return latency + self.line // 4
+
+    def describe(self):
+        size = f"{self.size >> 10} KiB" if self.size >= 1024 else f"{self.size} B"
+        ways = "direct-mapped" if self.ways == 1 else f"{self.ways}-way"
+        description = f"{size} {ways}, {self.line} B lines, {self.replacement.upper()}"
+        if self.write_back is not None:
+            description += ", write-back" if self.write_back else ", write-through"
+            if not self.write_allocate:
+                description += ", no write allocate"
+        return description
+
+class CacheStats:
+    """Outcome of one cache over one access stream"""
+
+    def __init__(self, config, accesses, misses, fills, writebacks=0, memory_writes=0):
+        self.config = config
+        self.accesses = accesses
+        self.misses = misses
+        self.fills = fills
+        self.writebacks = writebacks
+        self.memory_writes = memory_writes
+
+    @property
+    def hits(self):
+        return self.accesses - self.misses
+
+    @property
+    def hit_rate(self):
+        return self.hits / self.accesses if self.accesses else 1.0
+
+    def stall_cycles(self, latency):
+        """Cycles the pipeline waits for fills and dirty writebacks"""
+        return self.fills * self.config.miss_penalty(latency) + self.writebacks * (self.config.line // 4)
+
+    def amat(self, latency):
+        """Average memory access time in cycles, one cycle per hit"""
+        return 1 + self.stall_cycles(latency) / self.accesses if self.accesses else 1.0
+
+    def to_dict(self, latency):
+        return {
+            'config': self.config.describe(),
+            'accesses': self.accesses,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hit_rate, 6),
+            'writebacks': self.writebacks,
+            'memory_writes': self.memory_writes,
+            'amat': round(self.amat(latency), 4),
+            'stall_cycles': self.stall_cycles(latency),
+        }
+
+def simulate(lines, stores, accesses, configs, line_bytes, seed=0):
+    """Replay a line stream through every config; returns a CacheStats per config
+
+    lines are numbered in units of line_bytes, no larger than any config's
+    line size. stores flags the stores among lines (None for a fetch stream)
+    and accesses is the number of accesses before any collapsing. Configs
+    with the same line size and set count share one stack-distance
+    computation.
+    """
+    if stores is None:
+        stores = np.zeros(len(lines), dtype=bool)
+    store_count = int(stores.sum())
+    collapsed, merged = _collapse(lines, stores)
+    distances = {}
+    results = []
+    for config in configs:
+        shift = config.line.bit_length() - line_bytes.bit_length()
+        if config.vectorized:
+            key = (config.line, config.sets)
+            if key not in distances:
+                grouped, grouped_stores = _collapse(collapsed >> shift, merged)
+                distances[key] = (StackDistances(grouped, config.sets), grouped_stores)
+            stack, grouped_stores = distances[key]
+            misses = int(stack.misses(config.ways).sum())
+            writebacks = stack.writebacks(config.ways, grouped_stores) if config.write_back else 0
+            results.append(CacheStats(config, accesses, misses, misses, writebacks,
+                                      0 if config.write_back else store_count))
+        else:
+            results.append(_simulate_sequential(lines >> shift, stores, accesses, config, seed))
+    return results
+
+def _simulate_sequential(lines, stores, accesses, config, seed):
+    """Replay a line stream access by access (FIFO, random, or no write allocation)"""
+    sets = config.sets
+    ways = config.ways
+    lru = config.replacement == 'lru'
+    choose = random.Random(seed).randrange if config.replacement == 'random' else None
+    resident = [{} for _ in range(sets)]  # line -> dirty, oldest first
+    misses = fills = writebacks = memory_writes = 0
+    for line, store in zip(lines.tolist(), stores.tolist()):
+        lines_of_set = resident[line & (sets - 1)]
+        if line in lines_of_set:
+            if lru:
+                lines_of_set[line] = lines_of_set.pop(line)
+            if store:
+                if config.write_back:
+                    lines_of_set[line] = True
+                else:
+                    memory_writes += 1
+            continue
+        misses += 1
+        if store and not config.write_allocate:
+            memory_writes += 1
+            continue
+        fills += 1
+        if len(lines_of_set) >= ways:
+            victim = next(iter(lines_of_set)) if choose is None else list(lines_of_set)[choose(ways)]
+            writebacks += lines_of_set.pop(victim)
+        lines_of_set[line] = store and config.write_back
+        if store and not config.write_back:
+            memory_writes += 1
+    # Collapsed fetches never reach the loop and are all hits
+    return CacheStats(config, accesses, misses, fills, writebacks, memory_writes)
+
+def evaluate(trace, icaches, dcaches, seed=0):
+    """(I-cache stats, D-cache stats) for the configs, from streams at the smallest line size"""
+    smallest = min(config.line for config in icaches + dcaches)
+    lines, fetches = fetch_lines(trace, smallest)
+    istats = simulate(lines, None, fetches, icaches, smallest, seed)
+    lines, stores = data_lines(trace, smallest)
+    dstats = simulate(lines, stores, len(lines), dcaches, smallest, seed)
+    return istats, dstats
+
+def self_check(trace, icaches, dcaches, seed=0, streams=200):
+    """Compare the stack-distance path with access-by-access replay
+
+    Every LRU config that simulate() vectorizes is replayed again by
+    _simulate_sequential on the trace's streams, then on random streams over a
+    range of set counts, associativities, line sizes and write policies.
+    Returns report lines, and raises ValueError on the first mismatch.
+    """
+    checked = 0
+    smallest = min(config.line for config in icaches + dcaches)
+    lines, fetches = fetch_lines(trace, smallest)
+    checked += _compare_replay(lines, None, fetches, icaches, smallest, "fetch stream")
+    lines, stores = data_lines(trace, smallest)
+    checked += _compare_replay(lines, stores, len(lines), dcaches, smallest, "data stream")
+    report = [f"self-check: {checked} configuration{'s' if checked != 1 else ''} match on the trace"]
+
+    rng = np.random.default_rng(seed)
+    for stream in range(streams):
+        line = 4 << int(rng.integers(0, 4))
+        ways = 1 << int(rng.integers(0, 4))
+        sets = 1 << int(rng.integers(0, 5))
+        configs = [CacheConfig(sets * ways * line, ways, line, write_back=write_back)
+                   for write_back in (True, False)]
+        length = int(rng.integers(1, 2000))
+        lines = rng.integers(0, 4 * sets * ways, size=length, dtype=np.int64)
+        stores = rng.random(length) < rng.random()
+        _compare_replay(lines, stores, length, configs, line, f"random stream {stream}")
+    report.append(f"self-check: {2 * streams} random stream replays match")
+    return report
+
+def _compare_replay(lines, stores, accesses, configs, line_bytes, label):
+    """Check simulate() against sequential replay for the vectorized configs; returns how many"""
+    configs = [config for config in configs if config.vectorized]
+    if stores is None:
+        stores = np.zeros(len(lines), dtype=bool)
+    for fast in simulate(lines, stores, accesses, configs, line_bytes):
+        config = fast.config
+        shift = config.line.bit_length() - line_bytes.bit_length()
+        slow = _simulate_sequential(lines >> shift, stores, accesses, config, 0)
+        for field in ('misses', 'fills', 'writebacks', 'memory_writes'):
+            if getattr(fast, field) != getattr(slow, field):
+                raise ValueError(f"{label}, {config.describe()}: stack distances give "
+                                 f"{getattr(fast, field)} {field}, sequential replay "
+                                 f"{getattr(slow, field)}")
+    return len(configs)
+
+def format_report(trace, istats, dstats, latency):
+    """Hit rates, misses and the cycle estimate for every pair of caches"""
+    base = base_cycles(trace)
+    loads = int((~trace.data_store).sum())
+    lines = [f"Trace: {trace.name or 'program'} ({trace.instret} instructions, "
+             f"{loads} loads, {len(trace.data_store) - loads} stores)",
+             f"Single-cycle memory: {base} cycles, CPI {base / trace.instret if trace.instret else 0:.3f}"]
+    width = max(len(stats.config.describe()) for stats in istats + dstats) + 2
+    for label, results in (("I-cache", istats), ("D-cache", dstats)):
+        lines.append("")
+        lines.append(f"  {label + ':':<{width}}{'Hit rate':>9}{'Misses':>10}{'Writebacks':>12}{'AMAT':>8}")
+        for stats in results:
+            lines.append(f"  {stats.config.describe():<{width}}{100 * stats.hit_rate:>8.2f}%{stats.misses:>10}"
+                         f"{stats.writebacks:>12}{stats.amat(latency):>8.3f}")
+    lines.append("")
+    lines.append(f"Estimated cycles (miss latency {latency}):")
+    for istat in istats:
+        for dstat in dstats:
+            cycles = base + istat.stall_cycles(latency) + dstat.stall_cycles(latency)
+            lines.append(f"  I {istat.config.size}:{istat.config.ways}:{istat.config.line}  "
+                         f"D {dstat.config.size}:{dstat.config.ways}:{dstat.config.line}  "
+                         f"{cycles:>12} cycles, CPI {cycles / trace.instret if trace.instret else 0:.3f}")
+    return "\n".join(lines)
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate instruction and data caches on a RISC program trace")
+    parser.add_argument('program', help="assembly source (.s), image (.hex/.bin), or a trace saved with --save-trace (.npz)")
+    parser.add_argument('--data', help="initial data memory image (.hex or .bin)")
+    parser.add_argument('--mem-words', type=int, default=DEFAULT_MEM_WORDS,
+                        help=f"data memory size in words, a power of two (default: {DEFAULT_MEM_WORDS})")
+    parser.add_argument('--max-steps', type=int, default=DEFAULT_MAX_STEPS,
+                        help=f"instruction limit (default: {DEFAULT_MAX_STEPS})")
+    parser.add_argument('--icache', action='append', metavar='SIZE:WAYS:LINE',
+                        help=f"instruction cache, e.g. 4K:2:16; repeatable (default: {DEFAULT_ICACHE})")
+    parser.add_argument('--dcache', action='append', metavar='SIZE:WAYS:LINE',
+                        help=f"data cache; repeatable (default: {DEFAULT_DCACHE})")
+    parser.add_argument('--replacement', choices=REPLACEMENT_POLICIES, default='lru',
+                        help="replacement policy (default: lru)")
+    parser.add_argument('--write-policy', choices=['back', 'through'], default='back',
+                        help="data cache write policy (default: back)")
+    parser.add_argument('--no-write-allocate', action='store_true',
+                        help="store misses write memory without filling a line")
+    parser.add_argument('--miss-latency', type=int, default=DEFAULT_MISS_LATENCY,
+                        help="memory latency in cycles before a line transfer of one word per cycle "
+                             f"(default: {DEFAULT_MISS_LATENCY})")
+    parser.add_argument('--seed', type=int, default=0, help="seed for random replacement (default: 0)")
+    parser.add_argument('--save-trace', metavar='FILE.npz', help="save the captured trace")
+    parser.add_argument('--allow-rtl-hazards', action='store_true',
+                        help="study programs that lose a branch or read a stale jalr base on cpu.v, "
+                             "as if they ran correctly")
+    parser.add_argument('--json', action='store_true', help="print the results as JSON")
+    parser.add_argument('--self-check', action='store_true',
+                        help="replay LRU configurations access by access as well, and on random "
+                             "streams, and fail if the stack-distance results differ")
+    args = parser.parse_args()
+
+    try:
+        policies = {'replacement': args.replacement, 'write_back': args.write_policy == 'back',
+                    'write_allocate': not args.no_write_allocate}
+        icaches = [CacheConfig.parse(spec, replacement=args.replacement, write_back=None)
+                   for spec in args.icache or [DEFAULT_ICACHE]]
+        dcaches = [CacheConfig.parse(spec, **policies) for spec in args.dcache or [DEFAULT_DCACHE]]
+        data = load_program(args.data)[0] if args.data else None
+        trace = load_trace(args.program, data, args.mem_words, args.max_steps)
+        if args.save_trace:
+            trace.save(args.save_trace)
+        sites = sorted(rtl_hazard_sites(trace.words.tolist()))
+        if sites and not args.allow_rtl_hazards:
+            addresses = ", ".join(f"0x{4 * index:x}" for index in sites)
+            raise ValueError(f"{trace.name or args.program}: cpu.v loses a branch or reads a stale jalr base at "
+                             f"{addresses} (see risc_analyzer.py), so the fetch stream and cycle estimate "
+                             f"would not be cpu.v's; pass --allow-rtl-hazards to study it anyway")
+        if sites:
+            print(f"Warning: {len(sites)} lost branch or stale jalr site(s); the streams and cycle estimate "
+                  f"are those of a correct execution, not of cpu.v", file=sys.stderr)
+        istats, dstats = evaluate(trace, icaches, dcaches, args.seed)
+        if args.self_check:
+            for line in self_check(trace, icaches, dcaches, args.seed):
+                print(line, file=sys.stderr)
+    except (OSError, ValueError) as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+
+    if args.json:
+        print(json.dumps({
+            'trace': trace.name, 'instructions': trace.instret, 'base_cycles': base_cycles(trace),
+            'miss_latency': args.miss_latency,
+            'icache': [stats.to_dict(args.miss_latency) for stats in istats],
+            'dcache': [stats.to_dict(args.miss_latency) for stats in dstats],
+        }, indent=2))
+    else:
+        print(format_report(trace, istats, dstats, args.miss_latency))
+
+if __name__ == "__main__":
+    main()
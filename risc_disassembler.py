@@ -0,0 +1,309 @@
+#!/usr/bin/env python3
+"""
+RISC Disassembler - Turns instruction images and PC traces back into assembly
+
+The decode table is built from RiscAssembler.opcodes, so every word the
+assembler can produce disassembles to a line that assembles back to the same
+word, and words it cannot produce come out as .word directives.
+
+Whole images are decoded at once: NumPy extracts the fields of every word, a
+table indexed by opcode, funct3 and funct7 gives the mnemonic, and only the
+distinct words are formatted. A long trace of a small program therefore costs
+little more than the program itself. Branch and jump targets are shown as
+labels when a symbol table is available (from an assembly source), and as
+offsets with the target address in a comment otherwise.
+
+Usage: python risc_disassembler.py <program.s|program.hex|program.bin|program.mem> [options]
+"""
+
+import argparse
+import os
+import sys
+
+import numpy as np
+
+from risc_assembler import (BTypeEncoder, CounterEncoder, ITypeEncoder, JalrEncoder, JTypeEncoder,
+                            LoadEncoder, RiscAssembler, RTypeEncoder, ShiftImmEncoder, STypeEncoder,
+                            UTypeEncoder, encoder_class, open_output)
+from risc_simulator import OP_SYSTEM, load_program
+
+# Instruction formats, as operand layouts; FORMAT_UNKNOWN words become .word
+FORMAT_UNKNOWN = 0
+FORMAT_R = 1
+FORMAT_I = 2
+FORMAT_SHIFT = 3
+FORMAT_LOAD = 4
+FORMAT_JALR = 5
+FORMAT_S = 6
+FORMAT_B = 7
+FORMAT_U = 8
+FORMAT_J = 9
+FORMAT_CSR = 10
+
+ENCODER_FORMATS = {
+    RTypeEncoder: FORMAT_R,
+    ITypeEncoder: FORMAT_I,
+    ShiftImmEncoder: FORMAT_SHIFT,
+    LoadEncoder: FORMAT_LOAD,
+    JalrEncoder: FORMAT_JALR,
+    STypeEncoder: FORMAT_S,
+    BTypeEncoder: FORMAT_B,
+    UTypeEncoder: FORMAT_U,
+    JTypeEncoder: FORMAT_J,
+    CounterEncoder: FORMAT_CSR,
+}
+
+# Operand text of each format from (mnemonic, rd, rs1, rs2, imm); branch and
+# jump targets depend on the address and are appended per occurrence
+OPERAND_TEMPLATES = {
+    FORMAT_R: "{0} x{1}, x{2}, x{3}",
+    FORMAT_I: "{0} x{1}, x{2}, {4}",
+    FORMAT_SHIFT: "{0} x{1}, x{2}, {3}",
+    FORMAT_LOAD: "{0} x{1}, {4}(x{2})",
+    FORMAT_JALR: "{0} x{1}, x{2}, {4}",
+    FORMAT_S: "{0} x{3}, {4}(x{2})",
+    FORMAT_B: "{0} x{2}, x{3}, ",
+    FORMAT_U: "{0} x{1}, 0x{4:x}",
+    FORMAT_J: "{0} x{1}, ",
+    FORMAT_CSR: "{0} x{1}",
+}
+
+PC_RELATIVE_FORMATS = (FORMAT_B, FORMAT_J)
+
+# Formats whose funct3 and funct7 fields are part of the encoding rather than the immediate
+FUNCT3_FORMATS = frozenset([FORMAT_R, FORMAT_I, FORMAT_SHIFT, FORMAT_LOAD, FORMAT_JALR,
+                            FORMAT_S, FORMAT_B, FORMAT_CSR])
+FUNCT7_FORMATS = frozenset([FORMAT_R, FORMAT_SHIFT])
+
+def decode_key(opcode, funct3, funct7):
+    """Index into the decode table: opcode | funct3 << 7 | funct7 << 10"""
+    return opcode | (funct3 << 7) | (funct7 << 10)
+
+class DecodedImage:
+    """Fields of a batch of instruction words, as parallel NumPy arrays
+
+    mnemonic indexes Disassembler.mnemonics (-1 for words it cannot decode);
+    imm is the immediate of each word's own format.
+    """
+
+    def __init__(self, words, mnemonic, fmt, rd, rs1, rs2, imm):
+        self.words = words
+        self.mnemonic = mnemonic
+        self.format = fmt
+        self.rd = rd
+        self.rs1 = rs1
+        self.rs2 = rs2
+        self.imm = imm
+
+    def __len__(self):
+        return len(self.words)
+
+class Disassembler:
+    """Decoder built as the inverse of an assembler's opcode table"""
+
+    def __init__(self, assembler=None):
+        opcodes = (assembler or RiscAssembler()).opcodes
+        self.mnemonics = list(opcodes)
+        self.formats = np.zeros(len(self.mnemonics) + 1, dtype=np.uint8)
+        self.table = np.full(1 << 17, -1, dtype=np.int16)
+        self.counters = {}
+        for index, (mnemonic, info) in enumerate(opcodes.items()):
+            fmt = ENCODER_FORMATS[encoder_class(info)]
+            self.formats[index] = fmt
+            if fmt == FORMAT_CSR:
+                # Counter reads share opcode and funct3; the csr field tells them apart
+                self.counters[info['csr']] = index
+                continue
+            funct3s = [info['funct3']] if fmt in FUNCT3_FORMATS else range(8)
+            funct7s = [info.get('funct7', 0)] if fmt in FUNCT7_FORMATS else range(128)
+            keys = np.array([decode_key(info['opcode'], funct3, funct7)
+                             for funct3 in funct3s for funct7 in funct7s])
+            taken = self.table[keys]
+            if (taken >= 0).any():
+                other = self.mnemonics[int(taken[taken >= 0][0])]
+                raise ValueError(f"Encodings of {mnemonic} and {other} overlap")
+            self.table[keys] = index
+        # The last entry stands for words that do not decode
+        self.formats[-1] = FORMAT_UNKNOWN
+
+    def decode(self, words):
+        """Decode an array of instruction words into a DecodedImage"""
+        words = np.asarray(words, dtype=np.uint32)
+        w = words.astype(np.int64)
+        signed = w - ((w & 0x80000000) << 1)
+        opcode = w & 0x7F
+        funct3 = (w >> 12) & 0x7
+        rd = (w >> 7) & 0x1F
+        rs1 = (w >> 15) & 0x1F
+        rs2 = (w >> 20) & 0x1F
+        mnemonic = self.table[opcode | (funct3 << 7) | ((w >> 25) << 10)].astype(np.int64)
+
+        counters = (opcode == OP_SYSTEM) & (funct3 == 0b010) & (rs1 == 0)
+        if counters.any():
+            csr = w >> 20
+            for code, index in self.counters.items():
+                mnemonic[counters & (csr == code)] = index
+
+        fmt = self.formats[mnemonic]
+        imm = np.select(
+            [fmt == FORMAT_S, fmt == FORMAT_B, fmt == FORMAT_U, fmt == FORMAT_J],
+            [((signed >> 20) & ~0x1F) | ((w >> 7) & 0x1F),
+             ((signed >> 19) & ~0xFFF) | ((w << 4) & 0x800) | ((w >> 20) & 0x7E0) | ((w >> 7) & 0x1E),
+             w & 0xFFFFF000,
+             ((signed >> 11) & ~0xFFFFF) | (w & 0xFF000) | ((w >> 9) & 0x800) | ((w >> 20) & 0x7FE)],
+            signed >> 20)
+        return DecodedImage(words, mnemonic, fmt, rd, rs1, rs2, imm)
+
+    def texts(self, words, addresses, symbols=None):
+        """Assembly text of each word, given the address it sits at
+
+        symbols maps label names to .text addresses; branch and jump targets
+        with a label are written as the label.
+        """
+        words = np.asarray(words, dtype=np.uint32)
+        addresses = np.asarray(addresses, dtype=np.int64)
+        unique, inverse = np.unique(words, return_inverse=True)
+        decoded = self.decode(unique)
+
+        # Format the distinct words, one format at a time
+        names = np.array(self.mnemonics + [None], dtype=object)
+        unique_texts = np.empty(len(unique), dtype=object)
+        unknown = decoded.format == FORMAT_UNKNOWN
+        unique_texts[unknown] = [f".word 0x{word:08x}" for word in unique[unknown].tolist()]
+        for fmt, template in OPERAND_TEMPLATES.items():
+            selected = np.flatnonzero(decoded.format == fmt)
+            if len(selected):
+                unique_texts[selected] = list(map(template.format,
+                                                  names[decoded.mnemonic[selected]],
+                                                  decoded.rd[selected].tolist(),
+                                                  decoded.rs1[selected].tolist(),
+                                                  decoded.rs2[selected].tolist(),
+                                                  decoded.imm[selected].tolist()))
+        texts = unique_texts[inverse.reshape(-1)]
+
+        # Branches and jumps end in their target, which depends on the address
+        fmt = decoded.format[inverse.reshape(-1)]
+        relative = np.flatnonzero(np.isin(fmt, PC_RELATIVE_FORMATS))
+        if len(relative):
+            offsets = decoded.imm[inverse.reshape(-1)[relative]]
+            targets = addresses[relative] + offsets
+            labels = label_names(symbols or {})
+            texts[relative] = [
+                prefix + (labels[target] if target in labels else f"{offset}  # 0x{target & 0xFFFFFFFF:08x}")
+                for prefix, target, offset in zip(texts[relative].tolist(), targets.tolist(), offsets.tolist())]
+        return texts.tolist()
+
+    def listing(self, words, symbols=None, base_address=0):
+        """'address: hex  text' lines for an image, with a line for each label"""
+        addresses = base_address + 4 * np.arange(len(words), dtype=np.int64)
+        return format_lines(addresses, words, self.texts(words, addresses, symbols), symbols)
+
+    def source(self, words, symbols=None):
+        """Assembly source for an image: assembling it gives back the same words"""
+        addresses = 4 * np.arange(len(words), dtype=np.int64)
+        lines = ['    ' + text for text in self.texts(words, addresses, symbols)]
+        # Labels past the end of the image go after the last line
+        lines.append('')
+        for name, address in (symbols or {}).items():
+            index = min(address >> 2, len(words))
+            lines[index] = f"{name}:\n" + lines[index]
+        text = '\n'.join(lines).rstrip('\n')
+        return text + '\n' if text else ''
+
+    def trace_listing(self, pcs, program, symbols=None):
+        """Listing of a PC trace: the instruction executed at each step
+
+        Each line depends only on its PC, so the program is formatted once and
+        the trace picks its lines.
+        """
+        index = np.asarray(pcs, dtype=np.int64) >> 2
+        if len(index) and (index.min() < 0 or index.max() >= len(program)):
+            raise ValueError("Trace PC outside the program image")
+        addresses = 4 * np.arange(len(program), dtype=np.int64)
+        lines = np.array(listing_lines(addresses, program, self.texts(program, addresses, symbols),
+                                       symbols), dtype=object)
+        text = '\n'.join(lines[index].tolist())
+        return text + '\n' if text else ''
+
+def label_names(symbols):
+    """Map each labelled address to its first label"""
+    labels = {}
+    for name, address in symbols.items():
+        labels.setdefault(address, name)
+    return labels
+
+def format_lines(addresses, words, texts, symbols=None):
+    """Join 'address: word  text' lines, preceded by 'label:' lines where a label sits"""
+    lines = listing_lines(addresses, words, texts, symbols)
+    return '\n'.join(lines) + '\n' if lines else ''
+
+def listing_lines(addresses, words, texts, symbols=None):
+    """The lines of format_lines, as a list"""
+    if not len(words):
+        return []
+    addresses = np.asarray(addresses, dtype=np.uint32)
+    # Big-endian bytes grouped four at a time give each word's hex digits, as in format_hex_image
+    address_column = addresses.astype('>u4').tobytes().hex(' ', 4).split(' ')
+    word_column = np.asarray(words, dtype='>u4').tobytes().hex(' ', 4).split(' ')
+    lines = list(map('0x{}: 0x{}  {}'.format, address_column, word_column, texts))
+    if symbols:
+        labels = {}
+        for name, address in symbols.items():
+            labels[address] = labels.get(address, '') + f"{name}:\n"
+        # Only lines whose address carries a label change
+        positions = np.flatnonzero(np.isin(addresses, list(labels)))
+        for position, address in zip(positions.tolist(), addresses[positions].tolist()):
+            lines[position] = labels[address] + lines[position]
+    return lines
+
+def load_trace_pcs(path):
+    """PCs of a trace: a cache-study trace (.npz of fetch runs), or one hex PC per line"""
+    if os.path.splitext(path)[1].lower() == '.npz':
+        with np.load(path) as f:
+            if 'fetch_start' not in f:
+                raise ValueError(f"{path} holds no fetch trace")
+            starts = f['fetch_start'].astype(np.int64)
+            lengths = f['fetch_length'].astype(np.int64)
+        # Expand each run of sequential fetches into its PCs
+        run_offsets = np.arange(int(lengths.sum())) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+        return np.repeat(starts, lengths) + 4 * run_offsets
+    with open(path) as f:
+        return np.array([int(token, 16) for token in f.read().split()], dtype=np.int64)
+
+def main():
+    parser = argparse.ArgumentParser(description="Disassemble RISC machine code")
+    parser.add_argument('program', help="assembly source (.s, for its labels), $readmemh image (.hex), "
+                                        "raw image (.bin) or assembler text output (.mem)")
+    parser.add_argument('output_file', nargs='?', help="output file (default: stdout)")
+    parser.add_argument('-f', '--format', choices=['listing', 'source'], default='listing',
+                        help="listing ('address: hex  instruction' lines, the default) or "
+                             "source (assembly that assembles back to the same image)")
+    parser.add_argument('--trace', metavar='FILE',
+                        help="disassemble the instructions executed in a trace instead: a "
+                             "risc_cachesim.py trace (.npz) or a file of hex PCs")
+    parser.add_argument('--no-labels', action='store_true',
+                        help="ignore the source's labels")
+    args = parser.parse_args()
+    if args.trace and args.format == 'source':
+        parser.error("--trace only produces listings")
+
+    try:
+        assembler = RiscAssembler()
+        words, _ = load_program(args.program, assembler)
+        symbols = None if args.no_labels else assembler.text_symbols()
+        disassembler = Disassembler(assembler)
+        if args.trace:
+            pcs = load_trace_pcs(args.trace)
+            text = disassembler.trace_listing(pcs, words, symbols)
+        elif args.format == 'source':
+            text = disassembler.source(words, symbols)
+        else:
+            text = disassembler.listing(words, symbols)
+        with open_output(args.output_file, 'w') as out:
+            out.write(text)
+    except (OSError, ValueError) as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
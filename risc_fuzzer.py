@@ -0,0 +1,624 @@
+#!/usr/bin/env python3
+"""
+RISC Fuzzer - Constrained-random programs checked differentially
+
+Generates random programs aimed at the pipeline's hazard logic: results read
+back 1, 2 and 3 instructions after they are computed (each forwarding path
+and the register file), loads used by the next instruction, runs of
+back-to-back branches, counted loops, calls and returns, and jalr to
+addresses built with la. Control flow only goes forward apart from loop
+branches and returns, so every program reaches its halt loop. Programs are
+assembled with RiscAssembler and run on the functional simulator, the
+reference, and on each backend:
+
+  pipeline   the cycle-accurate model of cpu.v in risc_pipeline.py: final
+             registers, data memory and the retired count must match
+  rtl        cpu.v under Icarus Verilog, through tb/cpu_fuzz_tb.v compiled
+             once per run: the retire trace and final data memory must match
+
+cpu.v has two documented corner cases: a branch resolving during a load-use
+stall is lost, and jalr reads its base register unforwarded. Programs are
+generated with them, and a mismatch in a run that executed one (a taken
+lost branch, or any stale jalr) is reported as a known failure of that
+class rather than a new finding. With --avoid-rtl-hazards the generator
+inserts a nop wherever an assembled program would hit one instead.
+
+Program i of a run is generated from seed --seed + i, and batches of seeds
+run in a pool of worker processes. A failing program is saved, then
+minimized by deleting instructions for as long as it fails the same way.
+
+Usage: python risc_fuzzer.py [-n 1000] [--seed N] [--length N] [--backend pipeline|rtl] [-j N] [--out DIR] [--avoid-rtl-hazards]
+       python risc_fuzzer.py --replay case.s
+"""
+
+import argparse
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from risc_assembler import RiscAssembler, format_hex_image, lost_branch, rtl_hazard_sites, stale_jalr
+from risc_pipeline import UNTIL_HALT, PipelineModel, Testbench
+from risc_simulator import HALT_LOOP, OP_JAL, OP_JALR, read_hex_image
+from risc_trace import capture_trace, first_difference, format_divergence, open_trace
+
+BACKEND_PIPELINE = 'pipeline'
+BACKEND_RTL = 'rtl'
+BACKENDS = (BACKEND_PIPELINE, BACKEND_RTL)
+
+# Mismatch kinds of the documented cpu.v corner cases
+KNOWN_LOST_BRANCH = 'lost-branch'
+KNOWN_STALE_JALR = 'stale-jalr'
+KNOWN_KINDS = (KNOWN_LOST_BRANCH, KNOWN_STALE_JALR)
+
+DEFAULT_COUNT = 1000
+DEFAULT_LENGTH = 40
+DEFAULT_BATCH = 25
+DEFAULT_MAX_FAILURES = 5
+DEFAULT_OUT_DIR = 'fuzz_failures'
+
+# Data memory of the testbenches, in words; addresses wrap to it
+MEM_WORDS = 64
+# Initial data words given to each program
+DATA_WORDS = 16
+# Instructions after which the functional simulator gives up on a program
+MAX_STEPS = 100_000
+# Cycle limit of pipeline and RTL runs: an instruction takes at most a
+# load-use stall and a three-cycle flush
+MAX_CPI = 5
+FILL_CYCLES = 8
+
+# Instruction memory of tb/cpu_fuzz_tb.v (instr_addr[11:2]), given to the
+# pipeline model too: with a memory just large enough for the program, fetch
+# past its end would wrap around to its first words
+IMEM_INDEX_BITS = 10
+IMEM_WORDS = 1 << IMEM_INDEX_BITS
+
+# Sources compiled with tb/cpu_fuzz_tb.v, relative to this file
+RTL_SOURCES = ('rtl/cpu.v', 'rtl/control_unit.v', 'rtl/register_file.v', 'rtl/immediate_gen.v',
+               'rtl/alu.v', 'rtl/hazard_detection.v', 'rtl/forwarding_unit.v', 'tb/retire_trace.v',
+               'tb/cpu_fuzz_tb.v')
+
+# Registers random instructions write (x0 included, as writes to it are
+# dropped); x1 is the link register, x29 holds jalr targets and x31 counts
+# loop iterations
+REGISTERS = ('x0',) + tuple(f"x{i}" for i in range(2, 10))
+JUMP_BASE = 'x29'
+LOOP_COUNTER = 'x31'
+
+R_OPS = ('add', 'sub', 'and', 'or', 'xor', 'sll', 'srl', 'sra', 'slt', 'sltu')
+I_OPS = ('addi', 'andi', 'ori', 'xori', 'slti', 'sltiu')
+SHIFT_OPS = ('slli', 'srli', 'srai')
+BRANCH_OPS = ('beq', 'bne', 'blt', 'bge', 'bltu', 'bgeu')
+
+# Relative frequency of the items programs are built from
+ITEM_WEIGHTS = {'alu': 30, 'load-use': 12, 'load': 6, 'store': 10, 'branches': 12, 'jump': 4,
+                'jalr': 6, 'call': 4, 'loop': 3}
+LOOP_ITEMS = ('alu', 'load-use', 'load', 'store', 'branches', 'jalr', 'call')
+SUBROUTINE_ITEMS = ('alu', 'load-use', 'load', 'store')
+
+# Passes of nop insertion before a program is given up on
+MAX_REPAIRS = 8
+
+class ProgramGenerator:
+    """Constrained-random assembly programs
+
+    A program is a sequence of labelled items: single instructions, a load
+    and its use, a run of branches, a jump, la and jalr, a call, or a counted
+    loop of further items. Branches and jumps target a label of a later item
+    in the same loop or at top level, so they never enter a loop body from
+    outside; subroutines follow the halt loop. Instructions often read a
+    register written one to three instructions earlier.
+    """
+
+    def __init__(self, seed, length=DEFAULT_LENGTH):
+        self.random = random.Random(seed)
+        self.length = length
+        # Registers written most recently, newest last
+        self.recent = []
+        self.subroutines = []
+        self.loops = 0
+
+    def source(self):
+        """Assembly source of a whole program"""
+        data = ', '.join(f"0x{self.random.getrandbits(32):08x}" for _ in range(DATA_WORDS))
+        lines = self._block('L', self.length, ITEM_WEIGHTS)
+        lines.append('halt: jal x0, halt')
+        for index, body in enumerate(self.subroutines):
+            lines += [f"S{index}:"] + body + ['ret']
+        # Instructions are indented under their labels
+        lines = [line if line.endswith(':') or line.startswith('halt:') else f"    {line}" for line in lines]
+        return "\n".join(['.data', f".word {data}", '.text'] + lines) + "\n"
+
+    def _block(self, prefix, count, weights):
+        """Lines of count items labelled prefix0 onwards, and a label prefix<count> after them"""
+        kinds = self.random.choices(list(weights), list(weights.values()), k=count)
+        lines = []
+        for index, kind in enumerate(kinds):
+            lines.append(f"{prefix}{index}:")
+            lines += self._item(kind, f"{prefix}{min(count, index + self.random.randint(1, 4))}")
+        lines.append(f"{prefix}{count}:")
+        return lines
+
+    def _item(self, kind, target):
+        """Lines of an item; target is a label later in the same scope (None in a subroutine)"""
+        choice = self.random.choice
+        if kind == 'alu':
+            return [self._alu()]
+        if kind == 'load':
+            return [self._load()]
+        if kind == 'load-use':
+            load = self._load()
+            return [load, self._consumer(self.recent[-1])]
+        if kind == 'store':
+            return [f"sw {self._source()}, {self._offset()}({self._source()})"]
+        if kind == 'branches':
+            # Later branches of the run may target earlier ones' fall-through
+            return [f"{choice(BRANCH_OPS)} {self._source()}, {self._source()}, {target}"
+                    for _ in range(self.random.randint(1, 3))]
+        if kind == 'jump':
+            return [f"jal {self._dest()}, {target}"]
+        if kind == 'jalr':
+            # Offset 1 checks that jalr clears bit 0 of the target
+            lines = [f"la {JUMP_BASE}, {target}"]
+            lines += [self._alu() for _ in range(self.random.randint(0, 2))]
+            return lines + [f"jalr {self._dest()}, {JUMP_BASE}, {choice((0, 0, 1))}"]
+        if kind == 'call':
+            weights = {item: ITEM_WEIGHTS[item] for item in SUBROUTINE_ITEMS}
+            body = []
+            for item in self.random.choices(list(weights), list(weights.values()), k=self.random.randint(0, 3)):
+                body += self._item(item, None)
+            self.subroutines.append(body)
+            return [f"call S{len(self.subroutines) - 1}"]
+        if kind == 'loop':
+            prefix = f"W{self.loops}_"
+            self.loops += 1
+            weights = {item: ITEM_WEIGHTS[item] for item in LOOP_ITEMS}
+            body = self._block(prefix, self.random.randint(2, 5), weights)
+            return ([f"li {LOOP_COUNTER}, {self.random.randint(1, 4)}"] + body +
+                    [f"addi {LOOP_COUNTER}, {LOOP_COUNTER}, -1", f"bne {LOOP_COUNTER}, x0, {prefix}0"])
+        raise ValueError(f"Unknown item kind {kind!r}")
+
+    def _source(self):
+        """A register to read: usually one written one to three instructions back"""
+        if self.recent and self.random.random() < 0.7:
+            return self.recent[-min(len(self.recent), self.random.randint(1, 3))]
+        return self.random.choice(REGISTERS)
+
+    def _dest(self):
+        rd = self.random.choice(REGISTERS)
+        self.recent = self.recent[-2:] + [rd]
+        return rd
+
+    def _offset(self):
+        return 4 * self.random.randint(-32, 63)
+
+    def _alu(self):
+        kind = self.random.random()
+        if kind < 0.45:
+            rs1, rs2 = self._source(), self._source()
+            return f"{self.random.choice(R_OPS)} {self._dest()}, {rs1}, {rs2}"
+        if kind < 0.75:
+            rs1 = self._source()
+            return f"{self.random.choice(I_OPS)} {self._dest()}, {rs1}, {self.random.randint(-2048, 2047)}"
+        if kind < 0.9:
+            rs1 = self._source()
+            return f"{self.random.choice(SHIFT_OPS)} {self._dest()}, {rs1}, {self.random.randint(0, 31)}"
+        return f"{self.random.choice(('lui', 'auipc'))} {self._dest()}, {self.random.getrandbits(20)}"
+
+    def _load(self):
+        base = self._source()
+        return f"lw {self._dest()}, {self._offset()}({base})"
+
+    def _consumer(self, register):
+        """An instruction reading register straight away: an ALU operand, a store or a branch"""
+        kind = self.random.random()
+        if kind < 0.5:
+            operands = [register, self._source()]
+            self.random.shuffle(operands)
+            return f"{self.random.choice(R_OPS)} {self._dest()}, {operands[0]}, {operands[1]}"
+        if kind < 0.8:
+            if self.random.random() < 0.5:
+                return f"sw {register}, {self._offset()}({self._source()})"
+            return f"sw {self._source()}, {self._offset()}({register})"
+        # A branch to the next instruction flushes the same path it falls through to
+        return f"{self.random.choice(BRANCH_OPS)} {register}, {self._source()}, 4"
+
+def avoid_rtl_hazards(lines, assembler):
+    """Insert nops until the assembled program has no lost branch or stale jalr
+
+    Returns the source and its words; raises ValueError if the hazards do not
+    go away.
+    """
+    lines = list(lines)
+    for _ in range(MAX_REPAIRS):
+        source = "\n".join(lines) + "\n"
+        words = assembler.assemble_many(source)
+        sites = rtl_hazard_sites(words)
+        if not sites:
+            return source, words
+        records = assembler.source_map(source)
+        positions = set()
+        for index in sites:
+            # Source line numbers count from 1
+            if stale_jalr(words, index):
+                positions.add(records[index].lineno - 1)
+            if lost_branch(words, index):
+                positions.add(records[index + 1].lineno - 1)
+        for position in sorted(positions, reverse=True):
+            lines.insert(position, '    nop')
+    raise ValueError(f"RTL hazards remain after {MAX_REPAIRS} passes of nop insertion")
+
+def generate_program(seed, length=DEFAULT_LENGTH, assembler=None, avoid_hazards=False):
+    """Source, words and data image of the program of seed, with nops over RTL hazards if avoid_hazards"""
+    assembler = assembler or RiscAssembler()
+    source = ProgramGenerator(seed, length).source()
+    if avoid_hazards:
+        source, words = avoid_rtl_hazards(source.splitlines(), assembler)
+    else:
+        words = assembler.assemble_many(source)
+    return source, words, assembler.data
+
+def first_rtl_hazard(words, records):
+    """(kind, pc) of the first lost branch or stale jalr a run executes, or None
+
+    records is the functional simulator's retire trace. A lost branch only
+    changes the outcome when it is taken; a stale jalr counts wherever it runs.
+    """
+    sites = rtl_hazard_sites(words)
+    if not sites:
+        return None
+    pcs = records['pc'].tolist()
+    for position, pc in enumerate(pcs):
+        index = pc >> 2
+        if index not in sites:
+            continue
+        if stale_jalr(words, index):
+            return KNOWN_STALE_JALR, pc
+        # The last record is the halt loop's jump
+        opcode = words[index] & 0x7F
+        if (opcode in (OP_JAL, OP_JALR) or position + 1 == len(pcs) or pcs[position + 1] != pc + 4):
+            return KNOWN_LOST_BRANCH, pc
+    return None
+
+class Mismatch:
+    """How a backend's run of a program differs from the functional simulator's"""
+
+    __slots__ = ('backend', 'kind', 'message')
+
+    def __init__(self, backend, kind, message):
+        self.backend = backend
+        self.kind = kind
+        self.message = message
+
+    @property
+    def known(self):
+        """Whether this is one of the documented cpu.v corner cases"""
+        return self.kind in KNOWN_KINDS
+
+    def same_failure(self, other):
+        return other is not None and (self.backend, self.kind) == (other.backend, other.kind)
+
+    def __str__(self):
+        return f"{self.backend}: {self.message}"
+
+def cycle_limit(instructions):
+    return MAX_CPI * instructions + FILL_CYCLES
+
+class RtlBackend:
+    """cpu.v under Icarus Verilog, with tb/cpu_fuzz_tb.v compiled once into directory"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.executable = os.path.join(directory, 'cpu_fuzz_tb.vvp')
+
+    @staticmethod
+    def available():
+        return shutil.which('iverilog') is not None and shutil.which('vvp') is not None
+
+    def compile(self):
+        root = os.path.dirname(os.path.abspath(__file__))
+        result = subprocess.run(['iverilog', '-o', self.executable] +
+                                [os.path.join(root, path) for path in RTL_SOURCES],
+                                capture_output=True, text=True)
+        if result.returncode:
+            raise ValueError(f"iverilog failed: {result.stderr.strip()}")
+
+    def run(self, words, data, tag, max_cycles):
+        """Run a program; returns whether it halted, its retire trace and its final data memory"""
+        paths = {name: os.path.join(self.directory, f"{tag}.{name}")
+                 for name in ('program', 'data', 'trace', 'dmem')}
+        command = ['vvp', '-n', self.executable, f"+program={paths['program']}",
+                   f"+retire_trace={paths['trace']}", f"+dmem_out={paths['dmem']}", f"+max_cycles={max_cycles}"]
+        try:
+            with open(paths['program'], 'w') as f:
+                f.write(format_hex_image(words))
+            if data:
+                with open(paths['data'], 'w') as f:
+                    f.write(format_hex_image(data))
+                command.append(f"+data={paths['data']}")
+            result = subprocess.run(command, capture_output=True, text=True, cwd=self.directory)
+            if result.returncode:
+                raise ValueError(f"vvp failed: {result.stderr.strip()}")
+            # Copied out of the mapping, as the file is removed
+            trace = np.array(open_trace(paths['trace']))
+            memory = read_hex_image(paths['dmem'])
+        finally:
+            for path in paths.values():
+                if os.path.exists(path):
+                    os.remove(path)
+        return 'HALT' in result.stdout, trace, memory
+
+def check_pipeline(words, data, simulator, stats):
+    """Mismatch of the pipeline model's run against the functional simulator's, or None"""
+    # Stepped: a summarized run would replay the simulator's own stream
+    model = PipelineModel(Testbench.for_program(list(words), data, imem_words=IMEM_WORDS,
+                                                imem_index_bits=IMEM_INDEX_BITS), step=True)
+    model.run(until=UNTIL_HALT, max_cycles=cycle_limit(simulator.instret))
+    stats['cycles'] += model.cycles
+    stats['load-use stalls'] += model.load_use_stalls
+    stats['taken branches'] += model.taken_branches
+    stats['jumps'] += model.jumps
+    if model.stop_reason is None:
+        return Mismatch(BACKEND_PIPELINE, 'timeout', f"no halt within {model.cycles} cycles "
+                                                     f"({simulator.instret} instructions)")
+    if model.lost_branches:
+        return Mismatch(BACKEND_PIPELINE, KNOWN_LOST_BRANCH,
+                        f"{model.lost_branches} branches lost behind a load-use stall")
+    for index, (value, expected) in enumerate(zip(model.regs, simulator.regs)):
+        if value != expected:
+            return Mismatch(BACKEND_PIPELINE, 'registers', f"x{index} = 0x{value:08x}, expected 0x{expected:08x}")
+    for index, (value, expected) in enumerate(zip(model.memory, simulator.memory)):
+        if value != expected:
+            return Mismatch(BACKEND_PIPELINE, 'memory', f"data word {index} = 0x{value:08x}, "
+                                                        f"expected 0x{expected:08x}")
+    if model.retired != simulator.instret:
+        return Mismatch(BACKEND_PIPELINE, 'retired', f"{model.retired} instructions retired, "
+                                                     f"expected {simulator.instret}")
+    return None
+
+def check_rtl(rtl, words, data, records, simulator, tag):
+    """Mismatch of the RTL's run against the functional simulator's, or None"""
+    try:
+        halted, trace, memory = rtl.run(words, data, tag, cycle_limit(simulator.instret))
+    except ValueError as e:
+        return Mismatch(BACKEND_RTL, 'error', str(e))
+    index = first_difference(records, trace)
+    if index is not None:
+        return Mismatch(BACKEND_RTL, 'trace', format_divergence(records, trace, index, ('simulator', 'rtl')))
+    if not halted:
+        return Mismatch(BACKEND_RTL, 'timeout', f"no halt within {cycle_limit(simulator.instret)} cycles")
+    for index, (value, expected) in enumerate(zip(memory, simulator.memory)):
+        if value != expected:
+            return Mismatch(BACKEND_RTL, 'memory', f"data word {index} = 0x{value:08x}, expected 0x{expected:08x}")
+    return None
+
+def new_stats():
+    return dict.fromkeys(('programs', 'instructions', 'cycles', 'load-use stalls', 'taken branches', 'jumps') +
+                         KNOWN_KINDS, 0)
+
+def check_program(words, data, backends, rtl=None, tag='case', stats=None):
+    """The first Mismatch of a backend running words against the functional simulator, or None
+
+    Raises ValueError if the program does not reach its halt loop on the
+    functional simulator. stats, a dict from new_stats(), accumulates counts.
+    A mismatch in a run that executed a lost branch or stale jalr takes the
+    kind of the first one.
+    """
+    stats = stats if stats is not None else new_stats()
+    if len(words) > IMEM_WORDS:
+        raise ValueError(f"Program of {len(words)} words does not fit in {IMEM_WORDS}-word instruction memory")
+    records, simulator = capture_trace(words, data or None, MEM_WORDS, MAX_STEPS)
+    if simulator.halt_reason != HALT_LOOP:
+        raise ValueError(f"Program does not reach a halt loop within {MAX_STEPS} instructions")
+    stats['programs'] += 1
+    stats['instructions'] += simulator.instret
+    mismatch = None
+    if BACKEND_PIPELINE in backends:
+        mismatch = check_pipeline(words, data, simulator, stats)
+    if mismatch is None and BACKEND_RTL in backends:
+        mismatch = check_rtl(rtl, words, data, records, simulator, tag)
+    if mismatch is not None:
+        hazard = first_rtl_hazard(words, records)
+        if hazard is not None:
+            kind, pc = hazard
+            message = mismatch.message if mismatch.kind == kind else f"{mismatch.kind}: {mismatch.message}"
+            mismatch = Mismatch(mismatch.backend, kind, f"{kind} at 0x{pc:08x}; {message}")
+    return mismatch
+
+def fuzz_batch(seeds, length, backends, rtl_directory=None, avoid_hazards=False):
+    """Generate and check the programs of seeds
+
+    Returns the counts of the batch, known failures included, and a (seed,
+    Mismatch) pair per program failing otherwise; a program the functional
+    simulator cannot finish fails on the 'simulator' backend.
+    """
+    assembler = RiscAssembler()
+    rtl = RtlBackend(rtl_directory) if rtl_directory else None
+    stats = new_stats()
+    failures = []
+    for seed in seeds:
+        try:
+            _, words, data = generate_program(seed, length, assembler, avoid_hazards)
+            mismatch = check_program(words, data, backends, rtl, f"{os.getpid()}_{seed}", stats)
+        except ValueError as e:
+            mismatch = Mismatch('simulator', 'error', str(e))
+        if mismatch is not None and mismatch.known:
+            stats[mismatch.kind] += 1
+        elif mismatch is not None:
+            failures.append((seed, mismatch))
+    return stats, failures
+
+def minimize(source, mismatch, backends, rtl=None, assembler=None):
+    """Delete instructions from a failing program for as long as it fails the same way
+
+    Removes runs of instruction lines, halving the run length down to one
+    line. Labels, data and the halt loop stay; a deletion that makes the
+    program fail on a known RTL hazard instead is not kept. Returns the
+    reduced source.
+    """
+    assembler = assembler or RiscAssembler()
+    lines = source.splitlines()
+    # Instructions are indented; labels, directives and the halt loop are not
+    removable = [index for index, line in enumerate(lines) if line.startswith(' ')]
+
+    def fails(kept):
+        kept = set(kept)
+        trial = "\n".join(line for index, line in enumerate(lines)
+                          if index in kept or not line.startswith(' ')) + "\n"
+        try:
+            words = assembler.assemble_many(trial)
+            return mismatch.same_failure(check_program(words, assembler.data, backends, rtl, 'minimize'))
+        except ValueError:
+            return False
+
+    chunk = max(1, len(removable) // 2)
+    while True:
+        start = 0
+        while start < len(removable):
+            candidate = removable[:start] + removable[start + chunk:]
+            if fails(candidate):
+                removable = candidate
+            else:
+                start += chunk
+        if chunk == 1:
+            break
+        chunk //= 2
+    kept = set(removable)
+    lines = [line for index, line in enumerate(lines) if index in kept or not line.startswith(' ')]
+    # Drop the labels nothing refers to any more
+    referenced = {token for line in lines if line.startswith(' ') for token in line.replace(',', ' ').split()}
+    return "\n".join(line for line in lines
+                     if not line.endswith(':') or line.startswith('.') or line[:-1] in referenced) + "\n"
+
+def instruction_count(source):
+    return sum(line.startswith(' ') for line in source.splitlines())
+
+def main():
+    parser = argparse.ArgumentParser(description="Run constrained-random programs on the functional simulator "
+                                                 "and the pipeline backends, and compare")
+    parser.add_argument('-n', '--count', type=int, default=DEFAULT_COUNT,
+                        help=f"programs generated (default: {DEFAULT_COUNT})")
+    parser.add_argument('--seed', type=int, help="seed of the first program (default: random)")
+    parser.add_argument('--length', type=int, default=DEFAULT_LENGTH,
+                        help=f"top-level items per program (default: {DEFAULT_LENGTH})")
+    parser.add_argument('--backend', action='append', choices=BACKENDS,
+                        help="backend checked against the functional simulator, may be repeated "
+                             "(default: pipeline, and rtl when iverilog and vvp are installed)")
+    parser.add_argument('-j', '--jobs', type=int, help="worker processes (default: one per CPU)")
+    parser.add_argument('--batch', type=int, default=DEFAULT_BATCH,
+                        help=f"programs per task given to a worker (default: {DEFAULT_BATCH})")
+    parser.add_argument('--max-failures', type=int, default=DEFAULT_MAX_FAILURES,
+                        help=f"stop after this many failing programs (default: {DEFAULT_MAX_FAILURES})")
+    parser.add_argument('--out', default=DEFAULT_OUT_DIR,
+                        help=f"directory failing programs are saved in (default: {DEFAULT_OUT_DIR})")
+    parser.add_argument('--no-minimize', action='store_true', help="save failing programs as generated only")
+    parser.add_argument('--replay', metavar='FILE', help="check one saved program instead of fuzzing")
+    parser.add_argument('--avoid-rtl-hazards', action='store_true',
+                        help="insert nops so no program loses a branch or reads a stale jalr base on cpu.v")
+    args = parser.parse_args()
+
+    if args.count < 1 or args.length < 1 or args.batch < 1:
+        parser.error("--count, --length and --batch must be positive")
+    backends = args.backend or [BACKEND_PIPELINE] + ([BACKEND_RTL] if RtlBackend.available() else [])
+    rtl_directory = None
+    try:
+        if BACKEND_RTL in backends:
+            if not RtlBackend.available():
+                raise ValueError("the rtl backend needs iverilog and vvp on the PATH")
+            rtl_directory = tempfile.mkdtemp(prefix='risc_fuzz_')
+            RtlBackend(rtl_directory).compile()
+        rtl = RtlBackend(rtl_directory) if rtl_directory else None
+
+        if args.replay:
+            assembler = RiscAssembler()
+            with open(args.replay) as f:
+                words = assembler.assemble_many(f.read())
+            mismatch = check_program(words, assembler.data, backends, rtl)
+            if mismatch is None:
+                print(f"{args.replay}: matches on {', '.join(backends)}")
+            elif mismatch.known:
+                print(f"{args.replay}: known cpu.v failure, {mismatch}")
+            else:
+                print(f"{args.replay}: {mismatch}")
+            sys.exit(1 if mismatch and not mismatch.known else 0)
+
+        seed = args.seed if args.seed is not None else random.randrange(1 << 32)
+        seeds = range(seed, seed + args.count)
+        batches = [seeds[start:start + args.batch] for start in range(0, len(seeds), args.batch)]
+        jobs = min(args.jobs or os.cpu_count() or 1, len(batches))
+        print(f"Fuzzing {args.count} programs (seeds {seed}-{seed + args.count - 1}) on "
+              f"{', '.join(backends)} with {jobs} worker(s)")
+
+        stats = new_stats()
+        failures = []
+        started = time.perf_counter()
+        if jobs <= 1:
+            results = (fuzz_batch(batch, args.length, backends, rtl_directory, args.avoid_rtl_hazards)
+                       for batch in batches)
+            pool = None
+        else:
+            pool = ProcessPoolExecutor(max_workers=jobs)
+            futures = [pool.submit(fuzz_batch, batch, args.length, backends, rtl_directory, args.avoid_rtl_hazards)
+                       for batch in batches]
+            results = (future.result() for future in futures)
+        try:
+            for batch_stats, batch_failures in results:
+                for key, value in batch_stats.items():
+                    stats[key] += value
+                for failure in batch_failures:
+                    print(f"FAIL seed {failure[0]}: {str(failure[1]).splitlines()[0]}")
+                failures += batch_failures
+                if len(failures) >= args.max_failures:
+                    print(f"Stopping after {len(failures)} failures")
+                    break
+        finally:
+            if pool is not None:
+                pool.shutdown(cancel_futures=True)
+        elapsed = time.perf_counter() - started
+
+        rate = stats['programs'] / elapsed if elapsed else float('inf')
+        print(f"{stats['programs']} programs in {elapsed:.2f} s: {rate:.1f} programs/s, "
+              f"{stats['instructions']} instructions")
+        if BACKEND_PIPELINE in backends:
+            print(f"Pipeline: {stats['cycles']} cycles, {stats['load-use stalls']} load-use stalls, "
+                  f"{stats['taken branches']} taken branches, {stats['jumps']} jumps")
+        if any(stats[kind] for kind in KNOWN_KINDS):
+            print(f"Known cpu.v failures: {stats[KNOWN_LOST_BRANCH]} programs lost a taken branch, "
+                  f"{stats[KNOWN_STALE_JALR]} ran a stale jalr (see risc_analyzer.py)")
+        if not failures:
+            print("No other mismatches" if any(stats[kind] for kind in KNOWN_KINDS) else "No mismatches")
+            return
+
+        os.makedirs(args.out, exist_ok=True)
+        assembler = RiscAssembler()
+        for failing_seed, mismatch in failures:
+            print(f"\nSeed {failing_seed}: {mismatch}")
+            source = generate_program(failing_seed, args.length, assembler, args.avoid_rtl_hazards)[0]
+            path = os.path.join(args.out, f"seed_{failing_seed}.s")
+            with open(path, 'w') as f:
+                f.write(source)
+            print(f"Saved {path} ({instruction_count(source)} instructions)")
+            if args.no_minimize or mismatch.backend not in backends:
+                continue
+            reduced = minimize(source, mismatch, backends, rtl, assembler)
+            path = os.path.join(args.out, f"seed_{failing_seed}.min.s")
+            with open(path, 'w') as f:
+                f.write(reduced)
+            print(f"Minimized to {instruction_count(reduced)} instructions: {path}")
+    except (OSError, ValueError) as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+    finally:
+        if rtl_directory:
+            shutil.rmtree(rtl_directory, ignore_errors=True)
+    sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,484 @@
+#!/usr/bin/env python3
+"""
+RISC Linker - Relocatable objects, linking and parallel multi-file builds
+
+Each source file is assembled on its own into a relocatable object: its .text
+and .data words with every field that depends on where a label ends up left
+zero, the labels it exports (.globl), the symbols it imports (names it uses
+but does not define) and a relocation record for each field to fill in.
+Linking places the objects one after another in command-line order (.text
+from instruction address 0, .data from data address 0, each section aligned
+to its largest .align), resolves imports against the exports and patches the
+fields. Labels not named by .globl stay local to their file.
+
+Branches and jumps to .text labels of the same file need no relocation, since
+the file's .text moves as a whole. li/la of a label always take lui+addi in
+an object, as the label's final address is not known when it is assembled.
+
+Objects are a JSON header line followed by the little-endian .text and .data
+words, like the assembler's image cache. The header records a hash of the
+source and the assembler, so a rebuild reuses every object whose source is
+unchanged; the others are assembled in a process pool.
+
+Usage: python risc_linker.py <file.s|file.o> ... [-o program.hex] [-f hex] [-j N]
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import re
+import sys
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+
+from risc_assembler import (DIRECTIVES, NOP, OUTPUT_FORMATS, BTypeEncoder, ITypeEncoder,
+                            JalrEncoder, JTypeEncoder, RiscAssembler, SourceLine,
+                            UndefinedSymbolError, UTypeEncoder, image_bytes, write_image)
+
+OBJECT_FORMAT_VERSION = 1
+
+# Sections; imported symbols have no section
+TEXT = 0
+DATA = 1
+UNDEFINED = -1
+SECTION_NAMES = {TEXT: '.text', DATA: '.data'}
+
+# Relocation kinds: the field patched and how the symbol's address fills it
+RELOC_BRANCH = 'branch'  # B-type offset from the instruction
+RELOC_JAL = 'jal'        # J-type offset from the instruction
+RELOC_U = 'u'            # U-type immediate: address & 0xFFFFF000, as lui of a label
+RELOC_HI20 = 'hi20'      # U-type upper part of a lui/addi pair, rounded for the signed addi
+RELOC_LO12 = 'lo12'      # I-type lower part of a lui/addi pair
+RELOC_I12 = 'i12'        # I-type immediate holding the whole address
+RELOC_ABS32 = 'abs32'    # .word holding the address
+
+# Operands %hi(label) and %lo(label), which li/la of a label expand to
+RELOCATION_OPERAND_RE = re.compile(r'^%(hi|lo)\(([a-zA-Z0-9_]+)\)$')
+
+# (encoder class, operand kind) -> relocation kind for an instruction naming a symbol
+INSTRUCTION_RELOCATIONS = {
+    (BTypeEncoder, None): RELOC_BRANCH,
+    (JTypeEncoder, None): RELOC_JAL,
+    (UTypeEncoder, None): RELOC_U,
+    (UTypeEncoder, 'hi'): RELOC_HI20,
+    (ITypeEncoder, None): RELOC_I12,
+    (ITypeEncoder, 'lo'): RELOC_LO12,
+    (JalrEncoder, None): RELOC_I12,
+    (JalrEncoder, 'lo'): RELOC_LO12,
+}
+
+OBJECT_EXTENSION = '.o'
+
+class ObjectFile:
+    """A relocatable object: one file's sections, symbols and relocations
+
+    symbols holds (name, section, offset, exported) entries, with section
+    UNDEFINED for imports; relocations holds (section, offset, kind, symbol
+    index, line) entries. Offsets are byte offsets into the section.
+    """
+
+    def __init__(self, name, text, data, symbols, relocations, text_align=4, data_align=4, key=None):
+        self.name = name
+        self.text = text
+        self.data = data
+        self.symbols = symbols
+        self.relocations = relocations
+        self.text_align = text_align
+        self.data_align = data_align
+        self.key = key
+
+    def exports(self):
+        """Names of the symbols the object defines for other files"""
+        return [symbol[0] for symbol in self.symbols if symbol[3]]
+
+    def imports(self):
+        """Names of the symbols the object uses without defining them"""
+        return [symbol[0] for symbol in self.symbols if symbol[1] == UNDEFINED]
+
+    def to_bytes(self):
+        header = json.dumps({
+            'format': 'risc-object', 'version': OBJECT_FORMAT_VERSION, 'key': self.key,
+            'name': self.name, 'text_words': len(self.text), 'data_words': len(self.data),
+            'text_align': self.text_align, 'data_align': self.data_align,
+            'symbols': self.symbols, 'relocations': self.relocations,
+        }, separators=(',', ':')).encode()
+        return header + b'\n' + image_bytes(self.text) + image_bytes(self.data)
+
+    @classmethod
+    def from_bytes(cls, content):
+        header_line, _, body = content.partition(b'\n')
+        header = read_header(header_line)
+        words = array('I')
+        words.frombytes(body[:len(body) & ~3])
+        if sys.byteorder != 'little':
+            words.byteswap()
+        text_words = header['text_words']
+        if len(body) != 4 * (text_words + header['data_words']):
+            raise ValueError("Truncated object file")
+        return cls(header['name'], words[:text_words], words[text_words:],
+                   [tuple(symbol) for symbol in header['symbols']],
+                   [tuple(relocation) for relocation in header['relocations']],
+                   header['text_align'], header['data_align'], header['key'])
+
+    def save(self, path):
+        """Write the object to path, replacing any previous version atomically"""
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(self.to_bytes())
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as f:
+            try:
+                return cls.from_bytes(f.read())
+            except ValueError as e:
+                raise ValueError(f"{path}: {e}") from None
+
+def read_header(header_line):
+    """Parse and check the JSON header line of an object file"""
+    try:
+        header = json.loads(header_line)
+    except ValueError:
+        header = None
+    if not isinstance(header, dict) or header.get('format') != 'risc-object':
+        raise ValueError("Not a relocatable object file")
+    if header.get('version') != OBJECT_FORMAT_VERSION:
+        raise ValueError(f"Unsupported object format version: {header.get('version')}")
+    return header
+
+def object_key(fingerprint, assembly_code):
+    """Hash identifying the object built from assembly_code by an assembler with fingerprint"""
+    digest = hashlib.sha256(fingerprint.encode())
+    digest.update(assembly_code.encode())
+    return digest.hexdigest()
+
+class ObjectAssembler(RiscAssembler):
+    """Assembler that turns one source file into an ObjectFile
+
+    Operands naming a label, or %hi/%lo of one, encode as zero and are noted in
+    self.references, which assemble_object turns into relocations.
+    """
+
+    def __init__(self, optimize=False):
+        super().__init__(optimize)
+        self.references = []
+
+    def fingerprint(self):
+        digest = hashlib.sha256(super().fingerprint().encode())
+        digest.update(f"risc-object/{OBJECT_FORMAT_VERSION}".encode())
+        return digest.hexdigest()
+
+    def parse_immediate(self, imm_str):
+        match = RELOCATION_OPERAND_RE.match(imm_str)
+        if match:
+            self.references.append((match.group(1), match.group(2)))
+            return 0
+        if imm_str in self.symbol_table:
+            self.references.append((None, imm_str))
+            return 0
+        try:
+            return super().parse_immediate(imm_str)
+        except UndefinedSymbolError as e:
+            self.references.append((None, e.symbol))
+            return 0
+
+    def expand_pseudo(self, record):
+        expansion = super().expand_pseudo(record)
+        if expansion is None:
+            rd, symbol = record.operands
+            expansion = [SourceLine(record.label, 'lui', (rd, f'%hi({symbol})'), record.lineno),
+                         SourceLine(None, 'addi', (rd, rd, f'%lo({symbol})'), record.lineno)]
+        return expansion
+
+    def assemble_object(self, assembly_code, name):
+        """Assemble one source file into an ObjectFile"""
+        program = self.parse_source(assembly_code)
+        text = self.first_pass(program)
+        self._symbols = []
+        self._symbol_index = {}
+        self._relocations = []
+        words = self._encode_section(text, TEXT, NOP)
+        data = self._encode_section(self.data_records, DATA, 0)
+        if self.optimize:
+            words = self._schedule(words, text)
+            # Relocated fields move with their instructions
+            moved = {old: new for new, old in enumerate(self.placement)}
+            self._relocations = [(section, 4 * moved[offset >> 2] if section == TEXT else offset,
+                                  kind, index, lineno)
+                                 for section, offset, kind, index, lineno in self._relocations]
+
+        for record in program:
+            if record.mnemonic == '.globl' or record.mnemonic == '.global':
+                if not record.operands:
+                    raise ValueError(f"Line {record.lineno}: {record.mnemonic} expects at least 1 operand")
+                for label in record.operands:
+                    if label not in self.symbol_table:
+                        raise ValueError(f"Line {record.lineno}: Exported symbol is not defined: {label}")
+                    index = self._symbol(label)
+                    self._symbols[index] = self._symbols[index][:3] + (True,)
+
+        return ObjectFile(name, words, data, self._symbols, self._relocations,
+                          self._section_alignment(text), self._section_alignment(self.data_records),
+                          object_key(self.fingerprint(), assembly_code))
+
+    def _encode_section(self, records, section, fill):
+        """Encode the records of one section, recording a relocation for each label reference"""
+        encoders = self.encoders
+        data_labels = self.data_labels
+        words = array('I')
+        for record in records:
+            mnemonic = record.mnemonic
+            if mnemonic is None:
+                continue
+            if mnemonic == '.word':
+                # One word per operand, each possibly naming a label
+                self.directive_size(record, 0)
+                for operand in record.operands:
+                    self.references = []
+                    words.extend(self.directive_words(
+                        SourceLine(None, mnemonic, (operand,), record.lineno), 0))
+                    self._relocate(section, 4 * len(words) - 4, None, RELOC_ABS32, record)
+                continue
+            if mnemonic in DIRECTIVES:
+                words.extend(self.directive_words(record, 4 * len(words), fill))
+                continue
+
+            encoder = encoders.get(mnemonic)
+            if encoder is None:
+                raise ValueError(f"Line {record.lineno}: Unknown opcode: {mnemonic}")
+            if encoder.pc_relative and not data_labels.isdisjoint(record.operands):
+                raise ValueError(f"Line {record.lineno}: {mnemonic} to a .data label")
+            self.references = []
+            try:
+                words.append(encoder.encode(record.operands, 4 * len(words)))
+            except ValueError as e:
+                raise ValueError(f"Line {record.lineno}: {e}") from None
+            self._relocate(section, 4 * len(words) - 4, type(encoder), None, record)
+        return words
+
+    def _relocate(self, section, offset, encoder_type, kind, record):
+        """Record relocations for the references noted while encoding record"""
+        for operand_kind, symbol in self.references:
+            if encoder_type is not None:
+                kind = INSTRUCTION_RELOCATIONS.get((encoder_type, operand_kind))
+            elif operand_kind is not None:
+                kind = None
+            if kind is None:
+                operand = symbol if operand_kind is None else f"%{operand_kind}({symbol})"
+                raise ValueError(f"Line {record.lineno}: {operand} cannot be relocated "
+                                 f"in {record.mnemonic}")
+            self._relocations.append((section, offset, kind, self._symbol(symbol), record.lineno))
+
+    def _symbol(self, name):
+        """Index of name in the object's symbol list, adding it on first use"""
+        index = self._symbol_index.get(name)
+        if index is None:
+            address = self.symbol_table.get(name)
+            if address is None:
+                entry = (name, UNDEFINED, 0, False)
+            else:
+                entry = (name, DATA if name in self.data_labels else TEXT, address, False)
+            index = self._symbol_index[name] = len(self._symbols)
+            self._symbols.append(entry)
+        return index
+
+    def _section_alignment(self, records):
+        """Largest .align boundary of a section, which its base must respect"""
+        return max([self.alignment(record) for record in records if record.mnemonic == '.align'],
+                   default=4)
+
+def relocate(word, kind, value, place):
+    """Return word with the field of relocation kind set for a symbol at address value
+
+    place is the address of the word itself, for PC-relative kinds.
+    """
+    if kind == RELOC_ABS32:
+        return value & 0xFFFFFFFF
+    if kind == RELOC_U:
+        return (word & 0xFFF) | (value & 0xFFFFF000)
+    if kind == RELOC_HI20:
+        return (word & 0xFFF) | ((value + 0x800) & 0xFFFFF000)
+    if kind == RELOC_LO12:
+        return (word & 0xFFFFF) | ((value & 0xFFF) << 20)
+    if kind == RELOC_I12:
+        if value > 2047:
+            raise ValueError(f"Address {value} is out of range for I-type instruction")
+        return (word & 0xFFFFF) | (value << 20)
+    offset = value - place
+    if kind == RELOC_BRANCH:
+        if offset < -4096 or offset > 4095:
+            raise ValueError(f"Branch offset {offset} is out of range")
+        return ((word & 0x01FFF07F) | ((offset & 0x1000) << 19) | ((offset & 0x7E0) << 20) |
+                ((offset & 0x1E) << 7) | ((offset & 0x800) >> 4))
+    if kind == RELOC_JAL:
+        if offset < -1048576 or offset > 1048575:
+            raise ValueError(f"Jump offset {offset} is out of range")
+        return ((word & 0xFFF) | ((offset & 0x100000) << 11) | ((offset & 0x7FE) << 20) |
+                ((offset & 0x800) << 9) | (offset & 0xFF000))
+    raise ValueError(f"Unknown relocation kind: {kind}")
+
+class LinkedProgram:
+    """The image produced by link: instruction and data words plus the exported symbols
+
+    bases maps each object's name to the addresses of its .text and .data.
+    """
+
+    def __init__(self, words, data, symbol_table, data_labels, bases):
+        self.words = words
+        self.data = data
+        self.symbol_table = symbol_table
+        self.data_labels = data_labels
+        self.bases = bases
+
+def link(objects):
+    """Link ObjectFiles, in order, into a LinkedProgram"""
+    text = array('I')
+    data = array('I')
+    bases = []
+    for obj in objects:
+        # Pad to the object's alignment so its .align directives still hold
+        text.extend([NOP] * (-len(text) % (obj.text_align // 4)))
+        data.extend([0] * (-len(data) % (obj.data_align // 4)))
+        bases.append((4 * len(text), 4 * len(data)))
+        text.extend(obj.text)
+        data.extend(obj.data)
+
+    symbol_table = {}
+    data_labels = set()
+    defined_in = {}
+    for obj, base in zip(objects, bases):
+        for name, section, offset, exported in obj.symbols:
+            if not exported:
+                continue
+            if name in defined_in:
+                raise ValueError(f"Symbol {name} is defined in both {defined_in[name]} and {obj.name}")
+            defined_in[name] = obj.name
+            symbol_table[name] = base[section] + offset
+            if section == DATA:
+                data_labels.add(name)
+
+    images = (text, data)
+    for obj, base in zip(objects, bases):
+        symbols = obj.symbols
+        for section, offset, kind, index, lineno in obj.relocations:
+            name, symbol_section, symbol_offset, _ = symbols[index]
+            if symbol_section == UNDEFINED:
+                value = symbol_table.get(name)
+                if value is None:
+                    raise ValueError(f"{obj.name}: Line {lineno}: Undefined symbol: {name}")
+            else:
+                value = base[symbol_section] + symbol_offset
+            place = base[section] + offset
+            image = images[section]
+            try:
+                image[place >> 2] = relocate(image[place >> 2], kind, value, place)
+            except ValueError as e:
+                raise ValueError(f"{obj.name}: Line {lineno}: {e}") from None
+
+    return LinkedProgram(text, data, symbol_table, data_labels,
+                         {obj.name: base for obj, base in zip(objects, bases)})
+
+def object_path(source_path, obj_dir=None):
+    """Where the object for source_path is written: beside it, or in obj_dir"""
+    stem = os.path.splitext(source_path)[0]
+    if obj_dir is not None:
+        stem = os.path.join(obj_dir, os.path.basename(stem))
+    return stem + OBJECT_EXTENSION
+
+def stored_key(path):
+    """Source hash recorded in an existing object file, or None"""
+    try:
+        with open(path, 'rb') as f:
+            return read_header(f.readline()).get('key')
+    except (OSError, ValueError):
+        return None
+
+def assemble_file(source_path, output_path, optimize=False):
+    """Assemble one source file and save its object; run in the build's worker processes"""
+    with open(source_path) as f:
+        assembly_code = f.read()
+    try:
+        obj = ObjectAssembler(optimize).assemble_object(assembly_code, os.path.basename(source_path))
+    except ValueError as e:
+        raise ValueError(f"{source_path}: {e}") from None
+    obj.save(output_path)
+    return output_path
+
+def build_objects(sources, obj_dir=None, jobs=None, optimize=False):
+    """Assemble source files into objects, reusing those built from unchanged sources
+
+    Out-of-date objects are assembled concurrently in a pool of jobs processes
+    (default: one per CPU). Returns the object paths, in order, and the list of
+    sources that were assembled.
+    """
+    fingerprint = ObjectAssembler(optimize).fingerprint()
+    paths = []
+    stale = []
+    for source in sources:
+        path = object_path(source, obj_dir)
+        paths.append(path)
+        with open(source) as f:
+            key = object_key(fingerprint, f.read())
+        if stored_key(path) != key:
+            stale.append((source, path))
+
+    if obj_dir is not None:
+        os.makedirs(obj_dir, exist_ok=True)
+    jobs = min(jobs or os.cpu_count() or 1, len(stale))
+    if jobs <= 1:
+        for source, path in stale:
+            assemble_file(source, path, optimize)
+    else:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            futures = [pool.submit(assemble_file, source, path, optimize) for source, path in stale]
+            for future in futures:
+                future.result()
+    return paths, [source for source, _ in stale]
+
+def main():
+    parser = argparse.ArgumentParser(description="Assemble source files into relocatable objects "
+                                                 "and link them into one program image")
+    parser.add_argument('inputs', nargs='+', metavar='FILE',
+                        help=f"assembly sources, or objects ({OBJECT_EXTENSION}) built earlier; "
+                             "linked in the order given, the first holding the entry code")
+    parser.add_argument('-o', '--output', help="output file (default: stdout)")
+    parser.add_argument('-f', '--format', choices=['text'] + list(OUTPUT_FORMATS), default='text',
+                        help="output format, as for risc_assembler.py (default: text)")
+    parser.add_argument('--data-out', metavar='FILE',
+                        help="write the .data image to FILE, in the output format (hex for text)")
+    parser.add_argument('-c', '--compile-only', action='store_true',
+                        help="only assemble the sources into objects, without linking")
+    parser.add_argument('--obj-dir', metavar='DIR',
+                        help="directory for object files (default: beside each source)")
+    parser.add_argument('-j', '--jobs', type=int,
+                        help="number of files assembled in parallel (default: one per CPU)")
+    parser.add_argument('-O', '--optimize', action='store_true',
+                        help="schedule each object's basic blocks to hide load-use stalls")
+    parser.add_argument('--stats', action='store_true',
+                        help="print how many objects were assembled and reused to stderr")
+    args = parser.parse_args()
+    if args.jobs is not None and args.jobs < 1:
+        parser.error("--jobs must be at least 1")
+
+    try:
+        sources = [path for path in args.inputs if not path.endswith(OBJECT_EXTENSION)]
+        paths, assembled = build_objects(sources, args.obj_dir, args.jobs, args.optimize)
+        if args.stats:
+            print(f"build: {len(assembled)} assembled, {len(sources) - len(assembled)} reused",
+                  file=sys.stderr)
+        if args.compile_only:
+            return
+
+        built = iter(paths)
+        objects = [ObjectFile.load(path if path.endswith(OBJECT_EXTENSION) else next(built))
+                   for path in args.inputs]
+        program = link(objects)
+        write_image(program.words, program.data, args.output, args.format, args.data_out)
+    except Exception as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
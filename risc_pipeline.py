@@ -0,0 +1,855 @@
+#!/usr/bin/env python3
+"""
+RISC Pipeline - Cycle-accurate model of the 5-stage pipeline in rtl/cpu.v
+
+Steps the IF/ID, ID/EX, EX/MEM and MEM/WB registers once per clock with the
+same rules as the RTL: load-use stalls from hazard_detection.v (compared
+against the raw rs1/rs2 fields), forwarding from forwarding_unit.v, branches
+and jumps resolved in MEM with a three-slot flush, register file writes on
+the falling edge, and the jalr target taken from the unforwarded ID/EX
+register value. Memories are decoded like the testbenches, and a testbench
+file can be loaded directly so cycle counts are comparable with its $display
+output (the model has not been run side by side with vvp).
+
+Programs the functional simulator runs the same way (no counter reads, lost
+branches or stale jalrs) are not stepped: their instruction stream is taken
+from risc_simulator.py and timed a block at a time, which is more than ten
+times faster on long loops. --step forces the cycle-by-cycle model.
+
+Usage: python risc_pipeline.py [program.s|program.hex|program.bin] [--tb tb/cpu_X_tb.v] [options]
+"""
+
+import argparse
+import os
+import re
+import sys
+import time
+from collections import Counter
+
+import numpy as np
+
+from risc_assembler import RiscAssembler, rtl_hazard_sites
+from risc_simulator import (MASK32, OP_R_TYPE, OP_I_TYPE, OP_LOAD, OP_STORE, OP_BRANCH,
+                            OP_JAL, OP_JALR, OP_LUI, OP_AUIPC, OP_SYSTEM, CSR_CYCLE, HALT_LOOP,
+                            WRITES_RD, RiscSimulator,
+                            CSR_INSTRET, CSR_STALLS, CSR_FLUSHES, decode_i_imm, decode_s_imm,
+                            decode_b_imm, decode_j_imm, load_program, read_hex_image,
+                            format_registers, format_memory, run_checks)
+
+# ALU operation codes (same as in alu.v)
+ALU_ADD = 0b0000
+ALU_SUB = 0b0001
+ALU_AND = 0b0010
+ALU_OR = 0b0011
+ALU_XOR = 0b0100
+ALU_SLL = 0b0101
+ALU_SRL = 0b0110
+ALU_SRA = 0b0111
+ALU_SLT = 0b1000
+ALU_SLTU = 0b1001
+ALU_LUI = 0b1010
+
+def _sra(a, b):
+    return (((a ^ 0x80000000) - 0x80000000) >> (b & 31)) & MASK32
+
+# alu.v results indexed by alu_op; unused codes pass a through
+ALU_FUNCTIONS = [lambda a, b: a] * 16
+ALU_FUNCTIONS[ALU_ADD] = lambda a, b: (a + b) & MASK32
+ALU_FUNCTIONS[ALU_SUB] = lambda a, b: (a - b) & MASK32
+ALU_FUNCTIONS[ALU_AND] = lambda a, b: a & b
+ALU_FUNCTIONS[ALU_OR] = lambda a, b: a | b
+ALU_FUNCTIONS[ALU_XOR] = lambda a, b: a ^ b
+ALU_FUNCTIONS[ALU_SLL] = lambda a, b: (a << (b & 31)) & MASK32
+ALU_FUNCTIONS[ALU_SRL] = lambda a, b: a >> (b & 31)
+ALU_FUNCTIONS[ALU_SRA] = _sra
+ALU_FUNCTIONS[ALU_SLT] = lambda a, b: 1 if (a ^ 0x80000000) < (b ^ 0x80000000) else 0
+ALU_FUNCTIONS[ALU_SLTU] = lambda a, b: 1 if a < b else 0
+ALU_FUNCTIONS[ALU_LUI] = lambda a, b: b
+
+# branch_taken in cpu.v, indexed by funct3 then by the ALU zero flag
+BRANCH_TAKEN = [(False, True), (True, False), (False, False), (False, False),
+                (True, False), (False, True), (True, False), (False, True)]
+
+# Bubble causes, as they reach MEM/WB
+CAUSE_FILL = 'pipeline fill'
+CAUSE_LOAD_USE = 'load-use stall'
+CAUSE_BRANCH = 'branch flush'
+CAUSE_JUMP = 'jump flush'
+BUBBLE_CAUSES = (CAUSE_FILL, CAUSE_LOAD_USE, CAUSE_BRANCH, CAUSE_JUMP)
+
+# Stop conditions
+UNTIL_HALT = 'halt'
+UNTIL_X20 = 'x20'
+
+DEFAULT_MAX_CYCLES = 100_000_000
+# Bubbles ahead of the first instruction, which writes back in cycle 5
+PIPELINE_FILL_BUBBLES = 4
+FIRST_WRITEBACK = PIPELINE_FILL_BUBBLES + 1
+CLOCK_PERIOD = 10
+MAX_INDEX_BITS = 24
+
+def decode_controls(word):
+    """Decode an instruction word into the ID/EX fields set by control_unit.v and immediate_gen.v
+
+    Returns (rs1, rs2, rd, imm, reg_write, mem_to_reg, mem_read, mem_write,
+    alu_op, alu_src, branch, jal, jalr, auipc, funct3); rs1/rs2/rd are the raw
+    instruction fields whatever the format, as in the RTL. Counter reads decode
+    with imm 0; the pipeline supplies the counter value at ID.
+    """
+    opcode = word & 0x7F
+    rd = (word >> 7) & 0x1F
+    funct3 = (word >> 12) & 0x7
+    rs1 = (word >> 15) & 0x1F
+    rs2 = (word >> 20) & 0x1F
+    funct7 = word >> 25
+
+    reg_write = mem_to_reg = mem_read = mem_write = False
+    alu_src = branch = jal = jalr = auipc = False
+    alu_op = ALU_ADD
+    imm = 0
+
+    if opcode == OP_R_TYPE or opcode == OP_I_TYPE:
+        reg_write = True
+        alu_src = opcode == OP_I_TYPE
+        if funct3 == 0b000:
+            if opcode == OP_R_TYPE and funct7 == 0b0100000:
+                alu_op = ALU_SUB
+        elif funct3 == 0b101:
+            if funct7 == 0b0000000:
+                alu_op = ALU_SRL
+            elif funct7 == 0b0100000:
+                alu_op = ALU_SRA
+        else:
+            alu_op = (None, ALU_SLL, ALU_SLT, ALU_SLTU, ALU_XOR, None, ALU_OR, ALU_AND)[funct3]
+        if alu_src:
+            imm = decode_i_imm(word)
+    elif opcode == OP_LOAD:
+        reg_write = mem_to_reg = mem_read = alu_src = True
+        imm = decode_i_imm(word)
+    elif opcode == OP_STORE:
+        mem_write = alu_src = True
+        imm = decode_s_imm(word)
+    elif opcode == OP_BRANCH:
+        branch = True
+        alu_op = ALU_SLT if funct3 in (0b100, 0b101) else ALU_SLTU if funct3 in (0b110, 0b111) else ALU_SUB
+        imm = decode_b_imm(word)
+    elif opcode == OP_LUI:
+        reg_write = alu_src = True
+        alu_op = ALU_LUI
+        imm = word & 0xFFFFF000
+    elif opcode == OP_AUIPC:
+        reg_write = alu_src = auipc = True
+        imm = word & 0xFFFFF000
+    elif opcode == OP_JAL:
+        reg_write = jal = True
+        imm = decode_j_imm(word)
+    elif opcode == OP_JALR:
+        reg_write = alu_src = jalr = True
+        imm = decode_i_imm(word)
+    elif opcode == OP_SYSTEM and funct3 == 0b010:
+        reg_write = alu_src = True
+        alu_op = ALU_LUI
+
+    return (rs1, rs2, rd, imm & MASK32, reg_write, mem_to_reg, mem_read, mem_write,
+            alu_op, alu_src, branch, jal, jalr, auipc, funct3)
+
+class Testbench:
+    """Memory geometry, initial contents and run length of a testbench
+
+    index_bits is the width of the word index taken from the address
+    (instr_addr[7:2] gives 6); words outside the declared array read as zero.
+    Either cycles (a fixed run) or until (a stop condition) is set; timeout
+    bounds a run with a stop condition.
+    """
+
+    def __init__(self, program, data=None, imem_words=64, imem_index_bits=6,
+                 dmem_words=64, dmem_index_bits=6, cycles=None, until=UNTIL_HALT,
+                 timeout=DEFAULT_MAX_CYCLES, name=None, notes=()):
+        self.program = program
+        self.data = data or {}
+        self.imem_words = imem_words
+        self.imem_index_bits = imem_index_bits
+        self.dmem_words = dmem_words
+        self.dmem_index_bits = dmem_index_bits
+        self.cycles = cycles
+        self.until = None if cycles is not None else until
+        self.timeout = timeout
+        self.name = name
+        self.notes = list(notes)
+
+    @classmethod
+    def for_program(cls, program, data=None, **kwargs):
+        """Default testbench for a program: 64-word memories, or larger if the program needs it"""
+        words = 64
+        while words < len(program):
+            words *= 2
+        kwargs.setdefault('imem_words', words)
+        kwargs.setdefault('imem_index_bits', words.bit_length() - 1)
+        if data is not None:
+            data = dict(enumerate(data))
+        return cls(program, data, **kwargs)
+
+# A statement assigning a constant index of a testbench memory
+ASSIGNMENT_RE = r"(?:^|(?<=;))\s*{}\[(\d+)\]\s*=(?!=)\s*([^;]+);"
+
+def _evaluate(expression, params):
+    """Evaluate a constant Verilog integer expression using testbench parameters"""
+    expression = re.sub(r"\d+'[dD](\d+)", r"\1", expression)
+    expression = re.sub(r"\d+'[hH]([0-9a-fA-F_]+)", lambda m: str(int(m.group(1).replace('_', ''), 16)),
+                        expression)
+    expression = re.sub(r"[A-Za-z_]\w*", lambda m: str(params[m.group(0)]) if m.group(0) in params
+                        else m.group(0), expression)
+    if not re.fullmatch(r"[\d\s+\-*/%()]+", expression):
+        raise ValueError(f"Unsupported testbench expression: {expression.strip()}")
+    return eval(expression.replace('/', '//'))
+
+def load_testbench(path, require_program=True):
+    """Read the program, memories and run length from a testbench in tb/
+
+    Raises ValueError if the testbench sets no instr_mem words, unless
+    require_program is false (a program is given separately, as it must be
+    for a testbench reading its image from a +program plusarg).
+    """
+    with open(path) as f:
+        text = f.read()
+    base = os.path.dirname(os.path.dirname(os.path.abspath(path)))
+
+    params = {}
+    for name, expression in re.findall(r"(?:parameter|localparam)\s+(?:integer\s+)?(\w+)\s*=\s*([^;]+);", text):
+        try:
+            params[name] = _evaluate(expression, params)
+        except (ValueError, KeyError, SyntaxError):
+            pass
+
+    def array_words(name, default):
+        match = re.search(rf"reg\s*\[31:0\]\s*{name}\s*\[\s*0\s*:\s*([^\]]+)\]", text)
+        return _evaluate(match.group(1), params) + 1 if match else default
+
+    def index_bits(memory, address, default):
+        match = re.search(rf"{memory}\[{address}\[(\d+):2\]\]", text)
+        return int(match.group(1)) - 1 if match else default
+
+    program = {}
+    for match in re.finditer(r"\$readmemh\(\"([^\"]+)\",\s*instr_mem\)", text):
+        image = match.group(1)
+        if not os.path.exists(image):
+            image = os.path.join(base, image)
+        program.update(enumerate(read_hex_image(image)))
+    for index, value in re.findall(ASSIGNMENT_RE.format('instr_mem'), text, re.M):
+        program[int(index)] = _evaluate(value, params) & MASK32
+    if not program and require_program:
+        if re.search(r"\$readmemh\(\s*[A-Za-z_]\w*\s*,\s*instr_mem\)", text):
+            raise ValueError(f"{path}: the program is loaded at run time (+program=FILE); "
+                             f"pass the program with it, e.g. risc_pipeline.py prog.s --tb {path}")
+        raise ValueError(f"{path}: no program found in instr_mem")
+    words = [0] * (max(program) + 1 if program else 0)
+    for index, value in program.items():
+        words[index] = value
+
+    data = {}
+    notes = []
+    for index, value in re.findall(ASSIGNMENT_RE.format('data_mem'), text, re.M):
+        data[int(index)] = _evaluate(value, params) & MASK32
+    if re.search(r"data_mem\[\w+\]\s*=[^;]*\$u?random", text):
+        notes.append("data memory is initialized with $urandom; pass --data with the same values for exact results")
+
+    cycles = None
+    until = UNTIL_HALT
+    timeout = DEFAULT_MAX_CYCLES
+    if re.search(r"registers\.registers\[20\]\s*==\s*32'd1", text):
+        until = UNTIL_X20
+        match = re.search(r"cycle_count\s*<\s*(\w+)", text)
+        if match:
+            timeout = _evaluate(match.group(1), params)
+    else:
+        match = re.search(r"#10\s+rst\s*=\s*0;(?:\s|//[^\n]*)*#(\d+)\s*;", text)
+        if match:
+            cycles = int(match.group(1)) // CLOCK_PERIOD
+
+    return Testbench(words, data,
+                     imem_words=array_words('instr_mem', 64),
+                     imem_index_bits=index_bits('instr_mem', 'instr_addr', 6),
+                     dmem_words=array_words('data_mem', 64),
+                     dmem_index_bits=index_bits('data_mem', 'data_addr', 6),
+                     cycles=cycles, until=until, timeout=timeout, name=os.path.basename(path),
+                     notes=notes)
+
+class _NotSummarized(Exception):
+    """The run has to be clocked cycle by cycle"""
+
+class PipelineModel:
+    """Cycle-accurate model of cpu.v attached to testbench-style memories
+
+    With profile set, run() also counts retired instructions by PC in
+    pc_retired, and bubbles by the instruction that caused them in
+    pc_bubbles, keyed by (cause, pc, source pc): a load-use bubble is charged
+    to the stalled instruction, with the load as its source, and a flush to
+    the branch or jump. Pipeline fill bubbles are not charged to any PC.
+    Profiled runs, and every run with step set, are clocked cycle by cycle.
+    """
+
+    def __init__(self, testbench, profile=False, step=False):
+        self.testbench = testbench
+        self.profile = profile
+        self.step = step
+        self.summarized = False
+        self.imem = self._memory(testbench.imem_words, testbench.imem_index_bits,
+                                 dict(enumerate(testbench.program)))
+        self.memory = self._memory(testbench.dmem_words, testbench.dmem_index_bits, testbench.data)
+        self.mem_words = len(self.memory)
+        self.regs = [0] * 32
+
+        self.cycles = 0
+        self.retired = 0
+        self.bubbles = dict.fromkeys(BUBBLE_CAUSES, 0)
+        self.load_use_stalls = 0
+        self.taken_branches = 0
+        self.jumps = 0
+        self.lost_branches = 0
+        self.stop_reason = None
+        self.pc_retired = Counter()
+        self.pc_bubbles = Counter()
+
+    @staticmethod
+    def _memory(words, index_bits, contents):
+        # Cover every index the address decoding can produce; the part beyond
+        # the declared array stays zero because stores there are dropped
+        if index_bits > MAX_INDEX_BITS:
+            raise ValueError(f"Address decoding of {index_bits} index bits is wider than supported ({MAX_INDEX_BITS})")
+        memory = [0] * max(words, 1 << index_bits)
+        for index, value in contents.items():
+            if index < words:
+                memory[index] = value
+        return memory
+
+    def run(self, cycles=None, until=None, max_cycles=DEFAULT_MAX_CYCLES):
+        """Clock the pipeline from reset for a fixed number of cycles or until a stop condition
+
+        until is UNTIL_X20 (stop at the cycle the testbenches report, when x20
+        reads 1) or UNTIL_HALT (stop when a jump to itself writes back).
+        Returns the stop reason, or None if max_cycles was reached first.
+
+        Where the outcome is known to be the same, the program runs on the
+        functional simulator instead and its instruction stream is timed
+        (see _summarize); summarized is then set.
+        """
+        if cycles is None and until is None:
+            cycles, until = self.testbench.cycles, self.testbench.until
+        limit = min(cycles, max_cycles) if cycles is not None else max_cycles
+        reason = None
+        self.summarized = False
+        if not (self.step or self.profile) and self._summarizable():
+            try:
+                reason = self._summarize(limit, until)
+                self.summarized = True
+            except _NotSummarized:
+                pass
+        if not self.summarized:
+            reason = self._clock(limit, until)
+        self.stop_reason = reason if reason or cycles is None else 'fixed run'
+        return reason
+
+    def _clock(self, limit, until):
+        """Step every pipeline register once per cycle; returns the stop reason"""
+        until_x20 = until == UNTIL_X20
+        until_halt = until == UNTIL_HALT
+
+        regs = self.regs
+        imem = self.imem
+        imem_index_mask = (1 << self.testbench.imem_index_bits) - 1
+        dmem = self.memory
+        dmem_words = self.testbench.dmem_words
+        dmem_index_mask = (1 << self.testbench.dmem_index_bits) - 1
+        alu = ALU_FUNCTIONS
+        branch_taken_table = BRANCH_TAKEN
+        profile = self.profile
+        # Profiled bubble causes are tuples naming their PCs, folded into self.bubbles
+        # afterwards. Plain dicts: Counter subscripts are several times slower
+        bubbles = {} if profile else self.bubbles
+        pc_retired = {}
+        decoded = {}
+        nop = decode_controls(0)
+
+        # Reset state: every pipeline register is zero
+        pc = 0
+        if_word = if_pc = 0
+        if_cause = CAUSE_FILL
+        ex_d, ex_pc, ex_r1, ex_r2, ex_cause = nop, 0, 0, 0, CAUSE_FILL
+        mem_target = mem_result = mem_r2 = mem_rd = mem_funct3 = mem_pc = 0
+        mem_zero = mem_regwrite = mem_read = mem_write = mem_memtoreg = False
+        mem_branch = mem_jal = mem_jalr = False
+        mem_cause = CAUSE_FILL
+        wb_value = wb_rd = wb_pc = 0
+        wb_regwrite = False
+        wb_cause = CAUSE_FILL
+
+        cycle = 0
+        retired = 0
+        load_use = taken_branches = jumps = lost = 0
+        halt_pending = False
+        reason = None
+
+        while cycle < limit:
+            cycle += 1
+
+            # Falling edge: MEM/WB writes the register file
+            if wb_regwrite and wb_rd:
+                regs[wb_rd] = wb_value
+            if wb_cause is None:
+                retired += 1
+                if profile:
+                    try:
+                        pc_retired[wb_pc] += 1
+                    except KeyError:
+                        pc_retired[wb_pc] = 1
+                if halt_pending:
+                    reason = 'halt loop'
+                    break
+            else:
+                try:
+                    bubbles[wb_cause] += 1
+                except KeyError:
+                    bubbles[wb_cause] = 1
+            if until_x20 and regs[20] == 1:
+                reason = 'x20 = 1'
+                break
+
+            # MEM: resolve branches and access data memory
+            flush = ((mem_branch and branch_taken_table[mem_funct3][mem_zero])
+                     or mem_jal or mem_jalr)
+            read_data = 0
+            if mem_read:
+                read_data = dmem[(mem_result >> 2) & dmem_index_mask]
+            if mem_write:
+                index = (mem_result >> 2) & dmem_index_mask
+                if index < dmem_words:
+                    dmem[index] = mem_r2
+
+            # EX: forwarding, ALU and branch target
+            (rs1, rs2, rd, imm, regwrite, memtoreg, memread, memwrite,
+             aluop, alusrc, branch, jal, jalr, auipc, funct3) = ex_d
+            if mem_regwrite and mem_rd and mem_rd == rs1:
+                fwd_a = mem_result
+            elif wb_regwrite and wb_rd and wb_rd == rs1:
+                fwd_a = wb_value
+            else:
+                fwd_a = ex_r1
+            if mem_regwrite and mem_rd and mem_rd == rs2:
+                fwd_b = mem_result
+            elif wb_regwrite and wb_rd and wb_rd == rs2:
+                fwd_b = wb_value
+            else:
+                fwd_b = ex_r2
+            if jal or jalr:
+                result = alu[aluop](ex_pc, 4)
+            else:
+                result = alu[aluop](ex_pc if auipc else fwd_a, imm if alusrc else fwd_b)
+            target = ((ex_r1 + imm) & 0xFFFFFFFE) if jalr else (ex_pc + imm) & MASK32
+
+            # ID: load-use hazard against the raw rs1/rs2 fields
+            if_rs1 = (if_word >> 15) & 0x1F
+            if_rs2 = (if_word >> 20) & 0x1F
+            stall = memread and rd != 0 and (rd == if_rs1 or rd == if_rs2)
+
+            # Rising edge: update the pipeline registers
+            wb_value = read_data if mem_memtoreg else mem_result
+            wb_rd, wb_regwrite, wb_cause, wb_pc = mem_rd, mem_regwrite, mem_cause, mem_pc
+
+            if flush:
+                cause = CAUSE_BRANCH if mem_branch else CAUSE_JUMP
+                if profile:
+                    cause = (cause, mem_pc, mem_pc)
+                if mem_branch:
+                    taken_branches += 1
+                else:
+                    jumps += 1
+                if mem_cause is None and mem_target == mem_pc and until_halt:
+                    halt_pending = True
+                branch_target = mem_target
+                mem_target = mem_result = mem_r2 = mem_rd = mem_funct3 = mem_pc = 0
+                mem_zero = mem_regwrite = mem_read = mem_write = mem_memtoreg = False
+                mem_branch = mem_jal = mem_jalr = False
+                mem_cause = cause
+            else:
+                mem_target, mem_zero, mem_result, mem_r2, mem_rd = target, result == 0, result, fwd_b, rd
+                mem_funct3, mem_regwrite, mem_read, mem_write, mem_memtoreg = funct3, regwrite, memread, memwrite, memtoreg
+                mem_branch, mem_jal, mem_jalr, mem_cause, mem_pc = branch, jal, jalr, ex_cause, ex_pc
+
+            if flush or stall:
+                ex_d, ex_pc, ex_r1, ex_r2 = nop, 0, 0, 0
+                ex_cause = cause if flush else (CAUSE_LOAD_USE, if_pc, mem_pc) if profile else CAUSE_LOAD_USE
+                if stall:
+                    load_use += 1
+                    if flush:
+                        # PC and IF/ID hold, so the resolved branch is lost
+                        lost += 1
+            else:
+                d = decoded.get(if_word)
+                if d is None:
+                    d = decoded[if_word] = decode_controls(if_word)
+                if (if_word & 0x7F) == OP_SYSTEM and d[4]:
+                    # Counter read: cpu.v latches the counter into ID/EX_Imm. wb and
+                    # mem already hold the older instructions, and retired counts
+                    # the one written back this cycle
+                    csr = if_word >> 20
+                    if csr == CSR_CYCLE:
+                        value = cycle - 1
+                    elif csr == CSR_INSTRET:
+                        value = retired + (wb_cause is None) + (mem_cause is None)
+                    elif csr == CSR_STALLS:
+                        value = load_use
+                    elif csr == CSR_FLUSHES:
+                        # cpu.v does not count the flush of a lost branch
+                        value = taken_branches + jumps - lost
+                    else:
+                        value = 0
+                    d = d[:3] + (value & MASK32,) + d[4:]
+                ex_d, ex_pc, ex_cause = d, if_pc, if_cause
+                ex_r1 = regs[if_rs1] if if_rs1 else 0
+                ex_r2 = regs[if_rs2] if if_rs2 else 0
+
+            if not stall:
+                if flush:
+                    if_word, if_pc, if_cause = 0, 0, cause
+                    pc = branch_target
+                else:
+                    if_word = imem[(pc >> 2) & imem_index_mask]
+                    if_pc, if_cause = pc, None
+                    pc = (pc + 4) & MASK32
+
+        self.cycles = cycle
+        self.retired = retired
+        self.load_use_stalls = load_use
+        self.taken_branches = taken_branches
+        self.jumps = jumps
+        self.lost_branches = lost
+        if profile:
+            self.pc_retired.update(pc_retired)
+            for cause, count in bubbles.items():
+                if isinstance(cause, tuple):
+                    self.pc_bubbles[cause] += count
+                    cause = cause[0]
+                self.bubbles[cause] += count
+        return reason
+
+    def _summarizable(self):
+        """Whether the program is free of what the functional simulator does not model
+
+        That is counter reads, lost branches and stale jalrs (rtl_hazard_sites),
+        data memory smaller than its address decoding, and wrong-path fetches
+        wrapping around instruction memory to the start of the program.
+        """
+        testbench = self.testbench
+        program = testbench.program
+        return (testbench.dmem_words == 1 << testbench.dmem_index_bits and
+                len(program) + 2 <= min(testbench.imem_words, 1 << testbench.imem_index_bits) and
+                not any((word & 0x7F) == OP_SYSTEM for word in program) and
+                not rtl_hazard_sites(program))
+
+    def _summarize(self, limit, until):
+        """Time the functional simulator's instruction stream; returns the stop reason
+
+        Without lost branches or stale jalrs, cpu.v retires the same stream
+        as the simulator, one instruction per cycle after the four-cycle fill,
+        plus a bubble for each load-use pair and three for each taken branch
+        or jump. The stream is taken as the simulator's blocks (fetch trace)
+        and branch outcomes (branch trace), so only the instructions around
+        the stop cycle are looked at one by one. The final state is the
+        simulator's after the instructions the pipeline has written back (and
+        a store in MEM at the end of a fixed run). Raises _NotSummarized if
+        the simulator cannot run the program as far as the pipeline would.
+        """
+        testbench = self.testbench
+        program = [word & MASK32 for word in testbench.program]
+        data = [0] * testbench.dmem_words
+        for index, value in testbench.data.items():
+            if index < testbench.dmem_words:
+                data[index] = value
+
+        def simulator(**tracing):
+            return RiscSimulator(program, mem_words=testbench.dmem_words, data=data, **tracing)
+
+        # Every instruction takes at least a cycle, so limit instructions cover the run
+        reference = simulator(trace_fetch=True, trace_branches=True)
+        try:
+            halted = reference.run(limit) == HALT_LOOP
+        except ValueError:
+            raise _NotSummarized()
+
+        # Runs of sequential instructions, one per executed block, then the halt loop
+        fetches = np.frombuffer(reference.fetch_trace, dtype=np.uint64)
+        first = (fetches >> 7).astype(np.int64)
+        length = (fetches & 0x7F).astype(np.int64)
+        if halted:
+            first = np.append(first, reference.pc >> 2)
+            length = np.append(length, 1)
+        if not len(first):
+            raise _NotSummarized()
+        last = first + length - 1
+        # Two zero words past the program, as in instruction memory
+        words = np.array(program + [0, 0], dtype=np.int64)
+        opcodes = words & 0x7F
+        transfer = np.isin(opcodes[last], (OP_BRANCH, OP_JAL, OP_JALR))
+        # Blocks end at every branch or jump, so the branch trace follows the transfer runs in order
+        outcomes = np.frombuffer(reference.branch_trace, dtype=np.uint64)
+        traced = np.flatnonzero(transfer)
+        if halted:
+            traced = traced[:-1]
+        if len(traced) != len(outcomes):
+            raise _NotSummarized()
+        taken = np.zeros(len(first), dtype=bool)
+        taken[traced] = (outcomes & 1).astype(bool)
+        taken[-1] |= halted
+        branch = opcodes[last] == OP_BRANCH
+
+        # stall_after[i]: a load-use bubble between the words at i and i + 1
+        rd = (words >> 7) & 0x1F
+        stall_after = ((opcodes[:-1] == OP_LOAD) & (rd[:-1] != 0) &
+                       ((rd[:-1] == (words[1:] >> 15) & 0x1F) | (rd[:-1] == (words[1:] >> 20) & 0x1F)))
+        before = np.concatenate(([0], np.cumsum(stall_after)))
+        inner = before[last] - before[first]
+        # A run not ending in a taken transfer falls through to the next one
+        junction = ~taken & stall_after[last]
+        span = length - 1 + inner
+        start = FIRST_WRITEBACK + np.concatenate(([0], np.cumsum(span + 1 + 3 * taken + junction)[:-1]))
+        end = start + span
+        position = np.concatenate(([0], np.cumsum(length)[:-1]))
+
+        def writeback(run, offset):
+            """Cycle the instruction at offset in run writes back"""
+            return int(start[run]) + offset + int(before[first[run] + offset] - before[first[run]])
+
+        stop = None
+        if until == UNTIL_HALT:
+            following = np.append(first[1:], -1)
+            halts = taken & (following == last)
+            halts[-1] |= halted
+            if halts.any():
+                run = int(np.argmax(halts))
+                if end[run] <= limit:
+                    stop, reason = int(end[run]), 'halt loop'
+        elif until == UNTIL_X20:
+            writes = (rd == 20) & np.isin(opcodes, tuple(WRITES_RD))
+            writers = np.concatenate(([0], np.cumsum(writes)))
+            probe = simulator()
+            for run in np.flatnonzero(writers[last + 1] > writers[first]).tolist():
+                if start[run] > limit:
+                    break
+                for offset in range(int(length[run])):
+                    if not writes[first[run] + offset]:
+                        continue
+                    probe.run(int(position[run]) + offset + 1 - probe.instret, exact=True)
+                    if probe.regs[20] == 1:
+                        stop, reason = writeback(run, offset), 'x20 = 1'
+                        break
+                if stop is not None:
+                    break
+            if stop is not None and stop > limit:
+                stop = None
+        if stop is None:
+            stop, reason = limit, None
+        # The stop cycle's falling edge happens; with a stop condition nothing after it does
+        last_event = stop - 1 if reason else stop
+        if not halted and int(end[-1]) < stop + 3:
+            raise _NotSummarized()
+
+        # Runs that end four cycles before the stop have every event and bubble counted
+        settled = int(np.searchsorted(end, stop - 4, side='right'))
+        retired = int(length[:settled].sum())
+        stalls = int(inner[:settled].sum() + junction[:settled].sum())
+        settled_taken = taken[:settled]
+        branches = int((settled_taken & branch[:settled]).sum())
+        jumps = int(settled_taken.sum()) - branches
+        load_use_bubbles = stalls
+        flush_bubbles = {True: 3 * branches, False: 3 * jumps}
+        visible = retired
+
+        def tail():
+            """(first word, length, ends in a taken transfer, is a branch, start, junction stall) of later runs"""
+            for run in range(settled, len(first)):
+                yield (int(first[run]), int(length[run]), bool(taken[run]), bool(branch[run]),
+                       int(start[run]), bool(junction[run]))
+            if halted:
+                # The halt loop retires every four cycles; repeats settled before the stop are counted at once
+                halt_cycle = int(end[-1])
+                repeats = max(0, (stop - 4 - halt_cycle) // 4) if settled == len(first) else 0
+                yield repeats
+                cycle = halt_cycle + 4 * (repeats + 1)
+                while True:
+                    yield (int(first[-1]), 1, True, bool(branch[-1]), cycle, False)
+                    cycle += 4
+
+        pending_store = False
+        for run in tail():
+            if isinstance(run, int):
+                retired += run
+                flush_bubbles[bool(branch[-1])] += 3 * run
+                if branch[-1]:
+                    branches += run
+                else:
+                    jumps += run
+                continue
+            word_index, count, run_taken, run_branch, cycle, run_junction = run
+            if cycle > stop + 2:
+                break
+            for offset in range(count):
+                index = word_index + offset
+                if cycle <= stop:
+                    retired += 1
+                    visible += 1
+                elif cycle == stop + 1 and reason is None and opcodes[index] == OP_STORE:
+                    # A fixed run ends with this store in MEM
+                    pending_store = True
+                stall = bool(stall_after[index]) if offset < count - 1 else run_junction
+                if stall:
+                    stalls += cycle - 2 <= last_event
+                    load_use_bubbles += cycle + 1 <= stop
+                if offset == count - 1 and run_taken:
+                    if cycle - 1 <= last_event:
+                        if run_branch:
+                            branches += 1
+                        else:
+                            jumps += 1
+                    flush_bubbles[run_branch] += min(3, max(0, stop - cycle))
+                cycle += 1 + stall
+
+        # Halt loop repeats after the simulator stopped change nothing
+        executed = min(visible + pending_store, reference.instret)
+        if executed == reference.instret:
+            state = reference
+        else:
+            state = simulator()
+            state.run(executed, exact=True)
+        regs = list(state.regs)
+        if halted and executed == reference.instret:
+            # The simulator parks in the halt loop without writing its link register
+            link = (program[reference.pc >> 2] >> 7) & 0x1F
+            if link and opcodes[reference.pc >> 2] == OP_JAL:
+                regs[link] = (reference.pc + 4) & MASK32
+
+        self.regs[:] = regs
+        self.memory[:len(state.memory)] = state.memory
+        self.cycles = stop
+        self.retired = retired
+        self.bubbles[CAUSE_FILL] = min(PIPELINE_FILL_BUBBLES, stop)
+        self.bubbles[CAUSE_LOAD_USE] = load_use_bubbles
+        self.bubbles[CAUSE_BRANCH] = flush_bubbles[True]
+        self.bubbles[CAUSE_JUMP] = flush_bubbles[False]
+        self.load_use_stalls = stalls
+        self.taken_branches = branches
+        self.jumps = jumps
+        self.lost_branches = 0
+        return reason
+
+    @property
+    def cpi(self):
+        return self.cycles / self.retired if self.retired else float('inf')
+
+    def report(self):
+        """Summary of cycles, CPI and bubbles by cause"""
+        lines = [
+            f"Cycles:            {self.cycles}",
+            f"Retired:           {self.retired}",
+            f"CPI:               {self.cpi:.3f}",
+            f"Bubble cycles:     {sum(self.bubbles.values())}",
+        ]
+        lines.extend(f"  {cause + ':':<17}{count}" for cause, count in self.bubbles.items())
+        lines.append(f"Load-use stalls:   {self.load_use_stalls}")
+        lines.append(f"Taken branches:    {self.taken_branches}")
+        lines.append(f"Jumps:             {self.jumps}")
+        if self.lost_branches:
+            lines.append(f"Lost branches:     {self.lost_branches} (taken while a load-use stall held IF/ID)")
+        return "\n".join(lines)
+
+def prepare_testbench(program=None, tb=None, data=None, assembler=None):
+    """Testbench running a program file, a testbench in tb/, or a program in a testbench's memories
+
+    program, tb and data are paths. An assembled program leaves its symbols in
+    assembler.
+    """
+    assembler = assembler or RiscAssembler()
+    if tb:
+        testbench = load_testbench(tb, require_program=not program)
+        if program:
+            testbench.program = list(load_program(program, assembler)[0])
+    else:
+        testbench = Testbench.for_program(list(load_program(program, assembler)[0]))
+    data = load_program(data)[0] if data else assembler.data
+    if data:
+        testbench.data = dict(enumerate(data))
+        testbench.notes = [n for n in testbench.notes if '$urandom' not in n]
+    if len(testbench.program) > testbench.imem_words:
+        raise ValueError(f"Program of {len(testbench.program)} words does not fit in "
+                         f"{testbench.imem_words}-word instruction memory")
+    if data and len(data) > testbench.dmem_words:
+        raise ValueError(f"Data image of {len(data)} words does not fit in "
+                         f"{testbench.dmem_words}-word data memory")
+    return testbench
+
+def main():
+    parser = argparse.ArgumentParser(description="Cycle-accurate model of the 5-stage pipeline")
+    parser.add_argument('program', nargs='?', help="assembly source (.s), $readmemh image (.hex) or raw image (.bin)")
+    parser.add_argument('--tb', help="take memories, initial data and run length from a testbench in tb/")
+    parser.add_argument('--data', help="initial data memory image (.hex or .bin)")
+    parser.add_argument('--cycles', type=int, help="run a fixed number of cycles")
+    parser.add_argument('--until', choices=[UNTIL_HALT, UNTIL_X20],
+                        help="stop when a jump to itself writes back, or when x20 reads 1 "
+                             "(default: halt, or as the testbench does)")
+    parser.add_argument('--max-cycles', type=int,
+                        help=f"cycle limit (default: the testbench timeout, or {DEFAULT_MAX_CYCLES})")
+    parser.add_argument('--dump-mem', type=int, default=64, metavar='N',
+                        help="show non-zero words among the first N data words (default: 64)")
+    parser.add_argument('--check', action='append', default=[], metavar='TARGET=VALUE',
+                        help="expected final value, e.g. x20=1 or mem[0]=60025; repeatable")
+    parser.add_argument('-q', '--quiet', action='store_true', help="only print the cycle summary")
+    parser.add_argument('--step', action='store_true',
+                        help="step every cycle even where the run could be summarized")
+    parser.add_argument('--profile', metavar='FILE',
+                        help="write cycles by label and source line as collapsed stacks for flame graphs")
+    args = parser.parse_args()
+
+    if not args.program and not args.tb:
+        parser.error("a program or --tb is required")
+
+    try:
+        assembler = RiscAssembler()
+        testbench = prepare_testbench(args.program, args.tb, args.data, assembler)
+        model = PipelineModel(testbench, profile=bool(args.profile), step=args.step)
+        cycles, until = args.cycles, args.until
+        if cycles is None and until is None:
+            cycles, until = testbench.cycles, testbench.until
+
+        start = time.perf_counter()
+        max_cycles = args.max_cycles or testbench.timeout
+        model.run(cycles, until, max_cycles)
+        elapsed = time.perf_counter() - start
+        if args.profile:
+            # Imported here: the profiler imports this module
+            from risc_profiler import Profile
+            Profile.from_program(model, args.program, assembler).write_collapsed(args.profile)
+    except (OSError, ValueError) as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+
+    for note in testbench.notes:
+        print(f"Note: {note}")
+    rate = model.cycles / elapsed / 1e6 if elapsed > 0 else 0.0
+    stopped = model.stop_reason or f"cycle limit ({max_cycles})"
+    mode = "summarized" if model.summarized else "stepped"
+    print(f"Stopped: {stopped} after {model.cycles} cycles ({elapsed:.3f} s {mode}, {rate:.2f} Mcycles/s)")
+    print(model.report())
+    if not args.quiet:
+        print("\nRegisters:")
+        print(format_registers(model.regs))
+        memory = format_memory(model.memory, args.dump_mem)
+        if memory:
+            print("\nData memory:")
+            print(memory)
+
+    if args.check:
+        print()
+        if run_checks(model, args.check):
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,282 @@
+#!/usr/bin/env python3
+"""
+RISC Profiler - Pipeline cycles by instruction, source line and label
+
+Runs a program on the pipeline model with profiling on and charges every
+cycle to an instruction: the cycle it writes back in, each load-use bubble to
+the instruction that waited for the load, and each flush bubble to the branch
+or jump that caused it. Only the pipeline fill is left uncharged. Counts roll
+up to source lines through the assembler's source map, and to the enclosing
+.text label. Reports are a hot-spot table with a summary by label, an
+annotated source listing, JSON, or collapsed stacks (program;label;line) for
+flamegraph.pl and speedscope.
+
+Usage: python risc_profiler.py <program.s|program.hex|program.bin> [--tb tb/cpu_X_tb.v] [--top N] [--annotate] [--collapsed FILE] [--json]
+"""
+
+import argparse
+import bisect
+import json
+import os
+import sys
+from collections import Counter
+
+from risc_assembler import RiscAssembler, split_line
+from risc_disassembler import Disassembler
+from risc_pipeline import (CAUSE_BRANCH, CAUSE_FILL, CAUSE_JUMP, CAUSE_LOAD_USE, UNTIL_HALT, UNTIL_X20,
+                           DEFAULT_MAX_CYCLES, PipelineModel, prepare_testbench)
+
+DEFAULT_TOP = 10
+NO_LABEL = '(no label)'
+
+# Bubble causes charged to instructions, as reports name them
+CHARGED_CAUSES = {CAUSE_LOAD_USE: 'load-use', CAUSE_BRANCH: 'branch flush', CAUSE_JUMP: 'jump flush'}
+
+class LineProfile:
+    """Cycles charged to one source line, a label, or an instruction of an image without a source"""
+
+    __slots__ = ('lineno', 'address', 'label', 'text', 'retired', 'bubbles', 'waits_on')
+
+    def __init__(self, lineno, address, label, text):
+        self.lineno = lineno
+        self.address = address
+        self.label = label
+        self.text = text
+        self.retired = 0
+        self.bubbles = Counter()
+        # Load-use bubbles by the line of the load waited on
+        self.waits_on = Counter()
+
+    @property
+    def cycles(self):
+        return self.retired + sum(self.bubbles.values())
+
+    @property
+    def cpi(self):
+        return self.cycles / self.retired if self.retired else float('inf')
+
+    def where(self):
+        return f"line {self.lineno}" if self.lineno is not None else f"0x{self.address:08x}"
+
+    def notes(self):
+        """Bubbles by cause, naming the loads waited on"""
+        notes = []
+        for cause, name in CHARGED_CAUSES.items():
+            if self.bubbles[cause]:
+                note = f"{self.bubbles[cause]} {name}"
+                if cause == CAUSE_LOAD_USE and self.waits_on:
+                    note += f" (on {', '.join(self.waits_on)})"
+                notes.append(note)
+        return ", ".join(notes)
+
+    def add(self, other):
+        self.retired += other.retired
+        self.bubbles.update(other.bubbles)
+        self.waits_on.update(other.waits_on)
+
+    def to_dict(self):
+        return {'line': self.lineno, 'address': self.address, 'label': self.label, 'text': self.text,
+                'cycles': self.cycles, 'retired': self.retired,
+                'bubbles': {CHARGED_CAUSES[cause]: count for cause, count in self.bubbles.items() if count},
+                'waits_on': dict(self.waits_on)}
+
+class Profile:
+    """Cycles of a profiled pipeline run, charged to source lines and labels
+
+    records is the assembler's source map (a record per word, giving the
+    line number) and source the program text; without them each instruction
+    is profiled on its own and shown disassembled. PCs are decoded like the
+    testbench's instruction memory, so code reached through an alias of its
+    address counts towards the line it executes.
+    """
+
+    def __init__(self, model, symbols=None, records=None, source=None, name=None):
+        self.name = name or '<image>'
+        self.cycles = model.cycles
+        self.retired = model.retired
+        self.fill = model.bubbles[CAUSE_FILL]
+        self.imem = model.imem
+        self.index_mask = (1 << model.testbench.imem_index_bits) - 1
+        self.symbols = symbols or {}
+        self.records = records
+        self.source_lines = source.splitlines() if source is not None else None
+        # Where several labels share an address, the last one defined names it
+        ordered = sorted((address, order, label) for order, (label, address) in enumerate(self.symbols.items()))
+        self._label_addresses = [address for address, _, _ in ordered]
+        self._label_names = [label for _, _, label in ordered]
+        self._disassembler = None
+
+        self.lines = {}
+        for pc, count in model.pc_retired.items():
+            self.line(pc).retired += count
+        for (cause, pc, source_pc), count in model.pc_bubbles.items():
+            line = self.line(pc)
+            line.bubbles[cause] += count
+            if cause == CAUSE_LOAD_USE:
+                line.waits_on[self.line(source_pc).where()] += count
+
+    @classmethod
+    def from_program(cls, model, path, assembler):
+        """Profile of a run of the program at path, assembled by assembler (an image has no source)"""
+        if not path:
+            return cls(model, name=model.testbench.name)
+        name = os.path.basename(path)
+        if os.path.splitext(path)[1].lower() in ('.hex', '.bin', '.mem'):
+            return cls(model, name=name)
+        with open(path) as f:
+            source = f.read()
+        return cls(model, assembler.text_symbols(), assembler.source_map(source), source, name)
+
+    def label(self, address):
+        """The .text label at or before address"""
+        index = bisect.bisect_right(self._label_addresses, address) - 1
+        return self._label_names[index] if index >= 0 else NO_LABEL
+
+    def line(self, pc):
+        """The LineProfile that cycles charged to pc go to"""
+        index = (pc >> 2) & self.index_mask
+        lineno = None
+        if self.records is not None and index < len(self.records):
+            lineno = self.records[index].lineno
+        key = (0, lineno) if lineno is not None else (1, pc)
+        line = self.lines.get(key)
+        if line is None:
+            line = self.lines[key] = LineProfile(lineno, pc, self.label(pc), self._text(pc, index, lineno))
+        elif pc < line.address:
+            line.address = pc
+        return line
+
+    def _text(self, pc, index, lineno):
+        if lineno is not None:
+            if self.source_lines is not None and lineno <= len(self.source_lines):
+                fields = split_line(self.source_lines[lineno - 1])
+                if fields and fields[1]:
+                    return f"{fields[1]} {', '.join(fields[2])}".rstrip()
+            record = self.records[index]
+            return f"{record.mnemonic} {', '.join(record.operands)}".rstrip()
+        if self._disassembler is None:
+            self._disassembler = Disassembler()
+        return self._disassembler.texts([self.imem[index]], [pc], self.symbols)[0]
+
+    def hotspots(self, top=DEFAULT_TOP):
+        """The lines charged the most cycles"""
+        return sorted(self.lines.values(), key=lambda line: (-line.cycles, line.address))[:top]
+
+    def by_label(self):
+        """Cycles rolled up to labels, most first"""
+        labels = {}
+        for line in self.lines.values():
+            total = labels.get(line.label)
+            if total is None:
+                total = labels[line.label] = LineProfile(None, line.address, line.label, line.label)
+            total.address = min(total.address, line.address)
+            total.add(line)
+        return sorted(labels.values(), key=lambda total: (-total.cycles, total.address))
+
+    def _row(self, entry):
+        share = 100 * entry.cycles / self.cycles if self.cycles else 0.0
+        cpi = f"{entry.cpi:6.3f}" if entry.retired else "     -"
+        return f"{entry.cycles:10d} {share:5.1f}% {entry.retired:10d} {cpi}"
+
+    def format_report(self, top=DEFAULT_TOP):
+        """Summary by label and the hot-spot table"""
+        cpi = self.cycles / self.retired if self.retired else float('inf')
+        lines = [f"Profile: {self.name}: {self.cycles} cycles, {self.retired} retired, CPI {cpi:.3f} "
+                 f"({self.fill} pipeline fill)", "",
+                 "By label:", f"{'cycles':>10} {'share':>6} {'retired':>10} {'CPI':>6}  label"]
+        for total in self.by_label():
+            lines.append(f"{self._row(total)}  {total.label:<20} {total.notes()}".rstrip())
+        lines += ["", "Hot spots:", f"{'cycles':>10} {'share':>6} {'retired':>10} {'CPI':>6}  "
+                  f"{'where':<12} {'label':<16} source"]
+        for line in self.hotspots(top):
+            lines.append(f"{self._row(line)}  {line.where():<12} {line.label:<16} {line.text:<28}  "
+                         f"{line.notes()}".rstrip())
+        return "\n".join(lines)
+
+    def format_annotated(self):
+        """The source listing with cycles, retired counts and bubble causes per line"""
+        header = f"{'cycles':>10} {'retired':>10}  "
+        lines = [header + ("line  source" if self.source_lines is not None else "address     instruction")]
+        if self.source_lines is not None:
+            for lineno, text in enumerate(self.source_lines, 1):
+                line = self.lines.get((0, lineno))
+                counts = f"{line.cycles:10d} {line.retired:10d}  " if line else " " * len(header)
+                notes = f"  <- {line.notes()}" if line and line.notes() else ""
+                lines.append(f"{counts}{lineno:4d}  {text.expandtabs()}".rstrip() + notes)
+        for key, line in sorted(self.lines.items()):
+            if key[0] == 1:
+                notes = f"  <- {line.notes()}" if line.notes() else ""
+                lines.append(f"{line.cycles:10d} {line.retired:10d}  0x{line.address:08x}  {line.text}{notes}")
+        return "\n".join(lines)
+
+    def collapsed(self):
+        """Collapsed stacks: 'program;label;line: source[;cause] cycles' lines"""
+        stacks = []
+        if self.fill:
+            stacks.append(f"{self.name};({CAUSE_FILL}) {self.fill}")
+        for _, line in sorted(self.lines.items()):
+            # ';' separates frames
+            frame = f"{self.name};{line.label};{line.where()}: {line.text.replace(';', ',')}"
+            if line.retired:
+                stacks.append(f"{frame} {line.retired}")
+            for cause, name in CHARGED_CAUSES.items():
+                if line.bubbles[cause]:
+                    stacks.append(f"{frame};{name} {line.bubbles[cause]}")
+        return stacks
+
+    def write_collapsed(self, path):
+        with open(path, 'w') as f:
+            f.write("\n".join(self.collapsed()) + "\n")
+
+    def to_dict(self):
+        return {'program': self.name, 'cycles': self.cycles, 'retired': self.retired,
+                'pipeline_fill': self.fill,
+                'labels': [{key: value for key, value in total.to_dict().items() if key not in ('line', 'text')}
+                           for total in self.by_label()],
+                'lines': [line.to_dict() for _, line in sorted(self.lines.items())]}
+
+def main():
+    parser = argparse.ArgumentParser(description="Pipeline cycles by instruction, source line and label")
+    parser.add_argument('program', nargs='?', help="assembly source (.s), $readmemh image (.hex) or raw image (.bin)")
+    parser.add_argument('--tb', help="take memories, initial data and run length from a testbench in tb/")
+    parser.add_argument('--data', help="initial data memory image (.hex or .bin)")
+    parser.add_argument('--cycles', type=int, help="run a fixed number of cycles")
+    parser.add_argument('--until', choices=[UNTIL_HALT, UNTIL_X20],
+                        help="stop when a jump to itself writes back, or when x20 reads 1 "
+                             "(default: halt, or as the testbench does)")
+    parser.add_argument('--max-cycles', type=int,
+                        help=f"cycle limit (default: the testbench timeout, or {DEFAULT_MAX_CYCLES})")
+    parser.add_argument('--top', type=int, default=DEFAULT_TOP,
+                        help=f"hot spots listed (default: {DEFAULT_TOP})")
+    parser.add_argument('--annotate', action='store_true', help="print the annotated source listing")
+    parser.add_argument('--collapsed', metavar='FILE', help="write collapsed stacks for flame graphs")
+    parser.add_argument('--json', action='store_true', help="print the profile as JSON")
+    args = parser.parse_args()
+
+    if not args.program and not args.tb:
+        parser.error("a program or --tb is required")
+
+    try:
+        assembler = RiscAssembler()
+        testbench = prepare_testbench(args.program, args.tb, args.data, assembler)
+        model = PipelineModel(testbench, profile=True)
+        cycles, until = args.cycles, args.until
+        if cycles is None and until is None:
+            cycles, until = testbench.cycles, testbench.until
+        model.run(cycles, until, args.max_cycles or testbench.timeout)
+        profile = Profile.from_program(model, args.program, assembler)
+        if args.collapsed:
+            profile.write_collapsed(args.collapsed)
+    except (OSError, ValueError) as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+
+    if args.json:
+        print(json.dumps(profile.to_dict(), indent=2))
+    elif args.annotate:
+        print(profile.format_annotated())
+    else:
+        print(profile.format_report(args.top))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,617 @@
+#!/usr/bin/env python3
+"""
+RISC Simulator - Functional instruction-set simulator for the 32-bit RISC CPU
+
+Executes machine code produced by RiscAssembler, following the semantics in
+instruction_set.md. Each straight-line run of instructions is decoded once,
+the first time it is reached, into a Python function cached by its entry
+address, so a loop body costs one call per iteration rather than one
+decode per instruction.
+
+Instruction and data memory are separate, as in the testbenches. Data
+addresses are decoded like the testbench data_mem: word index = address
+bits above bit 1, wrapped to the memory size.
+
+Usage: python risc_simulator.py <program.s|program.hex|program.bin|program.mem> [options]
+"""
+
+import argparse
+import os
+import re
+import sys
+import time
+from array import array
+
+from risc_assembler import RiscAssembler, image_bytes
+
+MASK32 = 0xFFFFFFFF
+SIGN32 = 0x80000000
+
+# Opcodes (same as in control_unit.v)
+OP_R_TYPE = 0b0110011
+OP_I_TYPE = 0b0010011
+OP_LOAD = 0b0000011
+OP_STORE = 0b0100011
+OP_BRANCH = 0b1100011
+OP_JAL = 0b1101111
+OP_JALR = 0b1100111
+OP_LUI = 0b0110111
+OP_AUIPC = 0b0010111
+OP_SYSTEM = 0b1110011
+
+# Performance counters read by rdcycle/rdinstret/rdstall/rdflush (CSRRS rd, csr, x0)
+CSR_CYCLE = 0xC00
+CSR_INSTRET = 0xC02
+CSR_STALLS = 0xC03
+CSR_FLUSHES = 0xC04
+
+DEFAULT_MEM_WORDS = 1 << 16
+DEFAULT_MAX_STEPS = 100_000_000
+
+# Longest straight-line run compiled into a single block
+MAX_BLOCK_LENGTH = 64
+
+# Instructions run between writes of the buffered retire trace
+RETIRE_FLUSH_STEPS = 1 << 16
+
+# Opcodes writing rd
+WRITES_RD = frozenset([OP_R_TYPE, OP_I_TYPE, OP_LOAD, OP_LUI, OP_AUIPC, OP_JAL, OP_JALR, OP_SYSTEM])
+
+# Halt reasons reported by RiscSimulator.run
+HALT_LOOP = 'halt loop'
+HALT_END = 'end of program'
+
+# Kinds of control transfer in a branch trace
+TRANSFER_BRANCH = 0
+TRANSFER_JAL = 1
+TRANSFER_JALR = 2
+
+def branch_record(pc, target, kind, taken):
+    """Pack a control transfer into one 64-bit branch trace entry
+
+    Bits 62-33 hold pc >> 2, bits 32-3 target >> 2, bits 2-1 the kind and bit 0
+    whether it was taken; target is the branch target even when not taken.
+    """
+    return ((pc >> 2) << 33) | (((target & MASK32) >> 2) << 3) | (kind << 1) | int(taken)
+
+def fetch_record(pc, length):
+    """Pack a run of length sequential fetches starting at pc into one fetch trace entry"""
+    return ((pc >> 2) << 7) | length
+
+def sign_extend(value, bits):
+    """Sign-extend the low `bits` bits of value"""
+    sign = 1 << (bits - 1)
+    return (value & (sign - 1)) - (value & sign)
+
+def decode_i_imm(word):
+    """Sign-extended I-type immediate"""
+    return sign_extend(word >> 20, 12)
+
+def decode_s_imm(word):
+    """Sign-extended S-type immediate"""
+    return sign_extend(((word >> 20) & 0xFE0) | ((word >> 7) & 0x1F), 12)
+
+def decode_b_imm(word):
+    """Sign-extended B-type branch offset"""
+    return sign_extend(((word >> 19) & 0x1000) | ((word << 4) & 0x800) |
+                       ((word >> 20) & 0x7E0) | ((word >> 7) & 0x1E), 13)
+
+def decode_j_imm(word):
+    """Sign-extended J-type jump offset"""
+    return sign_extend(((word >> 11) & 0x100000) | (word & 0xFF000) |
+                       ((word >> 9) & 0x800) | ((word >> 20) & 0x7FE), 21)
+
+def _reg(index):
+    """Source expression reading register index (x0 reads as the constant 0)"""
+    return f"x[{index}]" if index else "0"
+
+# R-type and I-type ALU expressions, keyed by (funct3, funct7 bit 5); {a} and {b}
+# are the operand expressions, and results are already reduced to 32 bits
+R_TYPE_EXPR = {
+    (0b000, 0): "({a} + {b}) & 4294967295",
+    (0b000, 1): "({a} - {b}) & 4294967295",
+    (0b001, 0): "({a} << ({b} & 31)) & 4294967295",
+    (0b010, 0): "1 if ({a} ^ 2147483648) < ({b} ^ 2147483648) else 0",
+    (0b011, 0): "1 if {a} < {b} else 0",
+    (0b100, 0): "{a} ^ {b}",
+    (0b101, 0): "{a} >> ({b} & 31)",
+    (0b101, 1): "((({a} ^ 2147483648) - 2147483648) >> ({b} & 31)) & 4294967295",
+    (0b110, 0): "{a} | {b}",
+    (0b111, 0): "{a} & {b}",
+}
+
+BRANCH_CONDITION = {
+    0b000: "{a} == {b}",
+    0b001: "{a} != {b}",
+    0b100: "({a} ^ 2147483648) < ({b} ^ 2147483648)",
+    0b101: "({a} ^ 2147483648) >= ({b} ^ 2147483648)",
+    0b110: "{a} < {b}",
+    0b111: "{a} >= {b}",
+}
+
+class RiscSimulator:
+    """Functional simulator executing an assembled program
+
+    program is an array or list of instruction words starting at address 0,
+    or the (address, word) pairs returned by RiscAssembler.assemble.
+    The register file is self.regs (a list of 32 unsigned values) and data
+    memory is self.memory (an array of mem_words unsigned words). With
+    trace_branches set, every executed branch and jump appends a
+    branch_record to self.branch_trace. With trace_memory set, every executed
+    block appends a fetch_record to self.fetch_trace, and every lw and sw
+    appends its data word index << 1 | is_store to self.data_trace;
+    trace_fetch keeps the fetch trace alone. With a
+    binary file as retire_file, every executed instruction writes a record of
+    four little-endian words to it: pc, instruction, rd (0 when no register is
+    written) and the value written (see risc_trace.py).
+
+    Counter reads have no timing to report: cycle and instret both read the
+    number of instructions executed before the read, stalls and flushes read 0.
+    """
+
+    def __init__(self, program, mem_words=DEFAULT_MEM_WORDS, data=None, trace_branches=False,
+                 trace_memory=False, retire_file=None, trace_fetch=False):
+        if mem_words <= 0 or mem_words & (mem_words - 1):
+            raise ValueError(f"Memory size must be a power of two, got {mem_words} words")
+
+        self.program = program_words(program)
+        self.mem_words = mem_words
+        self.memory = array('I', bytes(4 * mem_words))
+        if data is not None:
+            self.load_data(data)
+
+        self.regs = [0] * 32
+        self.pc = 0
+        self.instret = 0
+        self.halt_reason = None
+        self.branch_trace = array('Q') if trace_branches else None
+        self.fetch_trace = array('Q') if trace_memory or trace_fetch else None
+        self.data_trace = array('Q') if trace_memory else None
+        self.retire_file = retire_file
+        self.retire_trace = array('I') if retire_file is not None else None
+
+        # Compiled blocks, indexed by entry word address, and blocks cut short by
+        # exact runs, by (entry word address, length)
+        self._blocks = [None] * len(self.program)
+        self._partial_blocks = {}
+        # instret at entry to the running block, kept only for blocks reading counters
+        self._entry_count = 0
+
+    def load_data(self, words, word_offset=0):
+        """Copy words into data memory starting at word index word_offset"""
+        words = array('I', words)
+        if word_offset + len(words) > self.mem_words:
+            raise ValueError(f"Data image of {len(words)} words does not fit in {self.mem_words} words")
+        self.memory[word_offset:word_offset + len(words)] = words
+
+    def run(self, max_steps=DEFAULT_MAX_STEPS, exact=False):
+        """Run until the program halts or about max_steps instructions have executed
+
+        The step limit is checked between blocks; with exact set, the last block
+        is cut short so that no more than max_steps instructions run. Returns the
+        halt reason, or None if the limit was reached first.
+        """
+        if self.retire_trace is None:
+            return self._run(max_steps, exact)
+        # Run in slices, writing out the retire records buffered by each
+        limit = self.instret + max_steps
+        while True:
+            reason = self._run(min(limit - self.instret, RETIRE_FLUSH_STEPS), exact)
+            self.retire_file.write(image_bytes(self.retire_trace))
+            del self.retire_trace[:]
+            if reason is not None or self.instret >= limit:
+                return reason
+
+    def _run(self, max_steps, exact=False):
+        blocks = self._blocks
+        regs = self.regs
+        memory = self.memory
+        pc = self.pc
+        count = self.instret
+        limit = count + max_steps
+        reason = None
+
+        while count < limit:
+            if pc & 3:
+                raise ValueError(f"Misaligned instruction address 0x{pc:08x}")
+            index = pc >> 2
+            if index >= len(blocks):
+                reason = HALT_END
+                break
+            block = blocks[index]
+            if block is None:
+                block = blocks[index] = self._compile_block(pc)
+            func, length, counted = block
+            if exact and count + length > limit:
+                key = (index, limit - count)
+                block = self._partial_blocks.get(key)
+                if block is None:
+                    block = self._partial_blocks[key] = self._compile_block(pc, limit - count)
+                func, length, counted = block
+            if counted:
+                self._entry_count = count
+            if func is None:
+                # A jump to itself: the program has parked in its halt loop
+                if self.retire_trace is not None:
+                    self.retire_trace.extend(self._transfer_record(pc, self.program[index]))
+                count += length
+                reason = HALT_LOOP
+                break
+            pc = func(regs, memory)
+            count += length
+
+        self.pc = pc
+        self.instret = count
+        self.halt_reason = reason
+        return reason
+
+    def _compile_block(self, pc, max_length=MAX_BLOCK_LENGTH):
+        """Decode the straight-line run starting at pc into a (function, length, counted) triple
+
+        The run stops after a branch or jump, or after max_length instructions.
+        counted is set when the block reads a counter, so run() must record the
+        instruction count at entry.
+        """
+        program = self.program
+        word = program[pc >> 2]
+        if self._is_halt_loop(pc, word):
+            return (None, 1, False)
+
+        body = []
+        address = pc
+        length = 0
+        self._counted = False
+        while True:
+            if (address >> 2) >= len(program) or (
+                    address != pc and self._is_halt_loop(address, program[address >> 2])):
+                # Leave the halt loop to its own block so it is counted once
+                body.append(f"return {address}")
+                break
+            source, terminator = self._instruction_source(address, program[address >> 2],
+                                                          length)
+            if self.retire_trace is not None:
+                source = self._retire_source(address, program[address >> 2], source, terminator)
+            body.extend(source)
+            length += 1
+            address += 4
+            if terminator:
+                break
+            if length >= max_length:
+                body.append(f"return {address}")
+                break
+
+        if self.fetch_trace is not None:
+            body.insert(0, f"fetch({fetch_record(pc, length)})")
+        source = "def block(x, mem):\n" + "".join(f"    {line}\n" for line in body)
+        namespace = {}
+        if self.branch_trace is not None:
+            namespace['trace'] = self.branch_trace.append
+        if self.fetch_trace is not None:
+            namespace['fetch'] = self.fetch_trace.append
+        if self.data_trace is not None:
+            namespace['data'] = self.data_trace.append
+        if self.retire_trace is not None:
+            namespace['retire'] = self.retire_trace.extend
+        if self._counted:
+            namespace['sim'] = self
+        exec(compile(source, f"<block 0x{pc:08x}>", 'exec'), namespace)
+        return (namespace['block'], length, self._counted)
+
+    def _retire_source(self, pc, word, source, terminator):
+        """source with the line appending the instruction's retire record"""
+        if source and source[0].startswith('raise'):
+            return source
+        if terminator:
+            # Branches and jumps write only their link address, known in advance
+            return [f"retire({self._transfer_record(pc, word)})"] + source
+        rd = (word >> 7) & 0x1F
+        if rd and (word & 0x7F) in WRITES_RD:
+            return source + [f"retire(({pc}, {word}, {rd}, x[{rd}]))"]
+        return source + [f"retire(({pc}, {word}, 0, 0))"]
+
+    def _transfer_record(self, pc, word):
+        """Retire record of a branch or jump at pc"""
+        rd = (word >> 7) & 0x1F
+        if rd and (word & 0x7F) in (OP_JAL, OP_JALR):
+            return (pc, word, rd, (pc + 4) & MASK32)
+        return (pc, word, 0, 0)
+
+    def _is_halt_loop(self, pc, word):
+        """Whether word at pc unconditionally jumps to itself"""
+        opcode = word & 0x7F
+        if opcode == OP_JAL:
+            return decode_j_imm(word) == 0
+        if opcode == OP_BRANCH:
+            rs1 = (word >> 15) & 0x1F
+            rs2 = (word >> 20) & 0x1F
+            funct3 = (word >> 12) & 0x7
+            return decode_b_imm(word) == 0 and rs1 == rs2 and funct3 in (0b000, 0b101, 0b111)
+        return False
+
+    def _instruction_source(self, pc, word, offset=0):
+        """Python source lines executing one instruction, and whether it ends the block
+
+        offset is the number of instructions before it in the block.
+        """
+        opcode = word & 0x7F
+        rd = (word >> 7) & 0x1F
+        funct3 = (word >> 12) & 0x7
+        rs1 = (word >> 15) & 0x1F
+        rs2 = (word >> 20) & 0x1F
+        funct7 = word >> 25
+        a = _reg(rs1)
+        b = _reg(rs2)
+        mask = self.mem_words - 1
+
+        if opcode == OP_R_TYPE:
+            expr = R_TYPE_EXPR.get((funct3, funct7 >> 5)) if funct7 & 0x5F == 0 else None
+            if expr is None:
+                return self._illegal(pc, word), True
+            return ([f"x[{rd}] = " + expr.format(a=a, b=b)] if rd else []), False
+
+        if opcode == OP_I_TYPE:
+            imm = decode_i_imm(word)
+            if funct3 == 0b001 or funct3 == 0b101:
+                # Shift immediates: funct7 selects logical or arithmetic
+                expr = R_TYPE_EXPR.get((funct3, funct7 >> 5)) if funct7 & 0x5F == 0 else None
+                if expr is None:
+                    return self._illegal(pc, word), True
+                expr = expr.format(a=a, b=str(imm & 0x1F))
+            elif funct3 == 0b000:
+                expr = f"({a} + {imm}) & 4294967295" if rs1 else str(imm & MASK32)
+            else:
+                expr = R_TYPE_EXPR[(funct3, 0)].format(a=a, b=str(imm & MASK32))
+            return ([f"x[{rd}] = {expr}"] if rd else []), False
+
+        if opcode == OP_LOAD:
+            if funct3 != 0b010:
+                return self._illegal(pc, word), True
+            index = self._word_index(rs1, decode_i_imm(word), mask)
+            if self.data_trace is not None:
+                # The read reaches data memory even when rd is x0
+                return [f"a = {index}", "data(a << 1)"] + ([f"x[{rd}] = mem[a]"] if rd else []), False
+            return ([f"x[{rd}] = mem[{index}]"] if rd else []), False
+
+        if opcode == OP_STORE:
+            if funct3 != 0b010:
+                return self._illegal(pc, word), True
+            index = self._word_index(rs1, decode_s_imm(word), mask)
+            if self.data_trace is not None:
+                return [f"a = {index}", "data(a << 1 | 1)", f"mem[a] = {b}"], False
+            return [f"mem[{index}] = {b}"], False
+
+        if opcode == OP_LUI:
+            return ([f"x[{rd}] = {word & 0xFFFFF000}"] if rd else []), False
+
+        if opcode == OP_AUIPC:
+            return ([f"x[{rd}] = {(pc + (word & 0xFFFFF000)) & MASK32}"] if rd else []), False
+
+        if opcode == OP_BRANCH:
+            condition = BRANCH_CONDITION.get(funct3)
+            if condition is None:
+                return self._illegal(pc, word), True
+            target = (pc + decode_b_imm(word)) & MASK32
+            condition = condition.format(a=a, b=b)
+            if self.branch_trace is not None:
+                return [f"if {condition}:",
+                        f"    trace({branch_record(pc, target, TRANSFER_BRANCH, True)})",
+                        f"    return {target}",
+                        f"trace({branch_record(pc, target, TRANSFER_BRANCH, False)})",
+                        f"return {pc + 4}"], True
+            return [f"return {target} if {condition} else {pc + 4}"], True
+
+        if opcode == OP_JAL:
+            target = (pc + decode_j_imm(word)) & MASK32
+            link = [f"x[{rd}] = {pc + 4}"] if rd else []
+            if self.branch_trace is not None:
+                link.append(f"trace({branch_record(pc, target, TRANSFER_JAL, True)})")
+            return link + [f"return {target}"], True
+
+        if opcode == OP_JALR:
+            if funct3 != 0b000:
+                return self._illegal(pc, word), True
+            # Compute the target before writing rd, which may also be rs1
+            link = [f"x[{rd}] = {pc + 4}"] if rd else []
+            if self.branch_trace is not None:
+                link.append(f"trace({branch_record(pc, 0, TRANSFER_JALR, True)} | target >> 2 << 3)")
+            return ([f"target = ({a} + {decode_i_imm(word)}) & 4294967294"] + link +
+                    ["return target"]), True
+
+        if opcode == OP_SYSTEM:
+            if funct3 != 0b010 or rs1 != 0:
+                return self._illegal(pc, word), True
+            csr = word >> 20
+            if csr == CSR_CYCLE or csr == CSR_INSTRET:
+                self._counted = True
+                expr = f"(sim._entry_count + {offset}) & 4294967295"
+            else:
+                expr = "0"
+            return ([f"x[{rd}] = {expr}"] if rd else []), False
+
+        return self._illegal(pc, word), True
+
+    def _word_index(self, rs1, imm, mask):
+        """Source expression for the data-memory word index of rs1 + imm"""
+        if not rs1:
+            return str((imm >> 2) & mask)
+        return f"(x[{rs1}] + {imm}) >> 2 & {mask}"
+
+    def _illegal(self, pc, word):
+        return [f"raise ValueError('Illegal instruction 0x{word:08x} at 0x{pc:08x}')"]
+
+def program_words(program):
+    """Normalize a program to an array of words starting at address 0"""
+    if isinstance(program, array):
+        return program
+    program = list(program)
+    if program and isinstance(program[0], tuple):
+        words = array('I', bytes(4 * (max(address for address, _ in program) // 4 + 1)))
+        for address, word in program:
+            words[address >> 2] = word
+        return words
+    return array('I', program)
+
+def read_hex_image(path):
+    """Read a $readmemh-style image (hex words, // comments, @address markers)"""
+    words = array('I')
+    with open(path) as f:
+        for line in f:
+            line = line.split('//', 1)[0]
+            for token in line.split():
+                if token.startswith('@'):
+                    address = int(token[1:], 16)
+                    if address > len(words):
+                        words.extend(bytes(4 * (address - len(words))))
+                    del words[address:]
+                else:
+                    words.append(int(token.replace('_', ''), 16))
+    return words
+
+def read_bin_image(path):
+    """Read a raw little-endian word image"""
+    words = array('I')
+    with open(path, 'rb') as f:
+        words.frombytes(f.read())
+    if sys.byteorder != 'little':
+        words.byteswap()
+    return words
+
+# Verilog initializer lines of the assembler's text output (.mem dumps)
+INITIALIZER_RE = re.compile(r"^(instr_mem|data_mem)\[(\d+)\] = 32'h([0-9a-fA-F]+);", re.MULTILINE)
+
+def read_mem_image(path):
+    """Read the assembler's text output (listing plus initializers)
+
+    Returns the instruction and data words given by the instr_mem and data_mem
+    initializers, or by the listing lines when there are no initializers.
+    """
+    with open(path) as f:
+        text = f.read()
+    images = {'instr_mem': {}, 'data_mem': {}}
+    for memory, index, word in INITIALIZER_RE.findall(text):
+        images[memory][int(index)] = int(word, 16)
+    if not images['instr_mem']:
+        for line in text.splitlines():
+            tokens = line.split()
+            if len(tokens) >= 2 and tokens[0].endswith(':') and tokens[0].startswith('0x'):
+                images['instr_mem'][int(tokens[0][:-1], 16) >> 2] = int(tokens[1], 16)
+    result = []
+    for image in images.values():
+        words = array('I', bytes(4 * (max(image) + 1 if image else 0)))
+        for index, word in image.items():
+            words[index] = word
+        result.append(words)
+    return tuple(result)
+
+def load_program(path, assembler=None):
+    """Load a program image from a .hex, .bin or .mem file, or assemble it from source
+
+    Returns the words and the symbol table (empty for images). The .data image
+    of an assembled source or a .mem dump is left in assembler.data.
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.mem':
+        words, data = read_mem_image(path)
+        if assembler is not None:
+            assembler.data = data
+        return words, {}
+    if extension == '.hex':
+        return read_hex_image(path), {}
+    if extension == '.bin':
+        return read_bin_image(path), {}
+    if assembler is None:
+        assembler = RiscAssembler()
+    with open(path) as f:
+        words = assembler.assemble_many(f.read())
+    return words, assembler.symbol_table
+
+def to_signed(value):
+    """Interpret an unsigned 32-bit value as signed"""
+    return value - (1 << 32) if value & SIGN32 else value
+
+def format_registers(regs):
+    """Format the register file, four registers per line"""
+    lines = []
+    for row in range(0, 32, 4):
+        lines.append("  ".join(f"x{i:<2d} = 0x{regs[i]:08x} ({to_signed(regs[i])})".ljust(30)
+                               for i in range(row, row + 4)).rstrip())
+    return "\n".join(lines)
+
+def format_memory(memory, count):
+    """Format the non-zero words among the first count words of memory"""
+    return "\n".join(f"mem[{i}] = 0x{memory[i]:08x} ({to_signed(memory[i])})"
+                     for i in range(min(count, len(memory))) if memory[i])
+
+def parse_check(check):
+    """Parse a check like 'x20=1' or 'mem[0]=60025' into (kind, index, value)"""
+    target, _, value = check.partition('=')
+    target = target.strip().lower()
+    value = int(value.strip(), 0) & MASK32
+    if target.startswith('mem[') and target.endswith(']'):
+        return ('mem', int(target[4:-1], 0), value)
+    if target.startswith('x') and target[1:].isdigit() and int(target[1:]) < 32:
+        return ('reg', int(target[1:]), value)
+    raise ValueError(f"Invalid check: {check}")
+
+def run_checks(simulator, checks):
+    """Evaluate checks against the simulator state, printing PASS/FAIL; returns failures"""
+    failures = 0
+    for check in checks:
+        kind, index, expected = parse_check(check)
+        if kind == 'reg':
+            name, actual = f"x{index}", simulator.regs[index]
+        else:
+            name, actual = f"mem[{index}]", simulator.memory[index % simulator.mem_words]
+        if actual == expected:
+            print(f"PASS: {name} = {to_signed(actual)}")
+        else:
+            print(f"FAIL: {name} = {to_signed(expected)}, got {to_signed(actual)}")
+            failures += 1
+    return failures
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a RISC program on the functional simulator")
+    parser.add_argument('program', help="assembly source (.s), $readmemh image (.hex), raw image (.bin) "
+                             "or assembler text output (.mem)")
+    parser.add_argument('--data', help="initial data memory image (.hex or .bin)")
+    parser.add_argument('--mem-words', type=int, default=DEFAULT_MEM_WORDS,
+                        help=f"data memory size in words, a power of two (default: {DEFAULT_MEM_WORDS})")
+    parser.add_argument('--max-steps', type=int, default=DEFAULT_MAX_STEPS,
+                        help=f"instruction limit (default: {DEFAULT_MAX_STEPS})")
+    parser.add_argument('--dump-mem', type=int, default=64, metavar='N',
+                        help="show non-zero words among the first N data words (default: 64)")
+    parser.add_argument('--check', action='append', default=[], metavar='TARGET=VALUE',
+                        help="expected final value, e.g. x20=1 or mem[0]=60025 (mem index is "
+                             "a word index, as data_mem in the testbenches); repeatable")
+    args = parser.parse_args()
+
+    try:
+        assembler = RiscAssembler()
+        program, _ = load_program(args.program, assembler)
+        data = load_program(args.data)[0] if args.data else assembler.data or None
+        simulator = RiscSimulator(program, mem_words=args.mem_words, data=data)
+
+        start = time.perf_counter()
+        reason = simulator.run(args.max_steps)
+        elapsed = time.perf_counter() - start
+    except (OSError, ValueError) as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+
+    rate = simulator.instret / elapsed / 1e6 if elapsed > 0 else 0.0
+    print(f"Executed {simulator.instret} instructions in {elapsed:.3f} s ({rate:.2f} MIPS), "
+          f"{'halted: ' + reason if reason else 'step limit reached'} at pc 0x{simulator.pc:08x}")
+    print("\nRegisters:")
+    print(format_registers(simulator.regs))
+    memory = format_memory(simulator.memory, args.dump_mem)
+    if memory:
+        print("\nData memory:")
+        print(memory)
+
+    if args.check:
+        print()
+        if run_checks(simulator, args.check):
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
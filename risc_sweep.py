@@ -0,0 +1,421 @@
+#!/usr/bin/env python3
+"""
+RISC Sweep - Design-space exploration of pipeline configurations
+
+Runs each benchmark on the functional simulator and replays its retired
+instructions through an in-order timing model of the 5-stage pipeline with
+three parameters:
+
+  branch stage     where taken branches and jumps redirect fetch: MEM, as in
+                   cpu.v (three flushed slots), EX (two) or ID (one; a branch
+                   or jalr then needs its operands a cycle earlier)
+  MEM forwarding   whether the EX/MEM -> EX path of forwarding_unit.v exists;
+                   without it an ALU result reaches the next instruction from
+                   MEM/WB, after a one-cycle interlock like a load-use stall
+  fetch width      1, or 2: both instructions of an aligned 8-byte fetch
+                   block issue together unless the second depends on the
+                   first or both access memory
+
+Interlocks compare the raw rs1/rs2 fields like hazard_detection.v. With the
+cpu.v configuration the model reproduces the cycle counts of
+risc_pipeline.py, apart from the RTL corner cases a program should not rely
+on (a branch lost behind a load-use stall, a jalr reading its base register
+too early): the stream replayed is the architecturally correct execution.
+Programs with such sites are refused unless --allow-rtl-hazards is given.
+
+Every (program, configuration) point is cached on disk under a hash of the
+program image, its data and the model version, so a sweep only computes the
+points it has not seen. New points run in a pool of processes. Results are
+tabled as cycles, CPI and speedup over cpu.v, summarized per configuration
+as the geometric mean speedup, and the configurations on the Pareto front of
+speedup against a rough hardware cost are listed. CSV and JSON output carry
+the same table.
+
+Usage: python risc_sweep.py [programs...] [--branch-stage mem,ex,id] [--mem-forwarding on,off] [--fetch-width 1,2] [-j N] [--csv FILE] [--json FILE]
+"""
+
+import argparse
+import csv
+import hashlib
+import itertools
+import json
+import math
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from risc_assembler import RiscAssembler, image_bytes, rtl_hazard_sites
+from risc_simulator import (DEFAULT_MAX_STEPS, DEFAULT_MEM_WORDS, OP_BRANCH, OP_JAL, OP_JALR, OP_LOAD,
+                            OP_STORE, TRANSFER_BRANCH, load_program)
+from risc_trace import capture_trace
+
+# Bumped whenever the timing model changes, invalidating cached points
+SWEEP_MODEL_VERSION = 1
+
+STAGE_MEM = 'mem'
+STAGE_EX = 'ex'
+STAGE_ID = 'id'
+BRANCH_STAGES = (STAGE_MEM, STAGE_EX, STAGE_ID)
+# Fetch slots squashed by a taken branch or jump resolved in each stage
+FLUSH_PENALTIES = {STAGE_MEM: 3, STAGE_EX: 2, STAGE_ID: 1}
+FETCH_WIDTHS = (1, 2)
+
+# Rough hardware and RTL effort of each option relative to cpu.v, for the Pareto summary
+BRANCH_STAGE_COSTS = {STAGE_MEM: 0, STAGE_EX: 1, STAGE_ID: 2}
+NO_MEM_FORWARDING_COST = -1
+DUAL_FETCH_COST = 3
+
+DEFAULT_PROGRAMS = ('fibonacci.s', 'ooo_benchmark.s')
+DEFAULT_CACHE_DIR = '.sweep_cache'
+
+class PipelineConfig:
+    """One point of the design space"""
+
+    __slots__ = ('branch_stage', 'mem_forwarding', 'fetch_width')
+
+    def __init__(self, branch_stage=STAGE_MEM, mem_forwarding=True, fetch_width=1):
+        if branch_stage not in BRANCH_STAGES:
+            raise ValueError(f"Unknown branch stage: {branch_stage}")
+        if fetch_width not in FETCH_WIDTHS:
+            raise ValueError(f"Unsupported fetch width: {fetch_width}")
+        self.branch_stage = branch_stage
+        self.mem_forwarding = mem_forwarding
+        self.fetch_width = fetch_width
+
+    def key(self):
+        return (self.branch_stage, self.mem_forwarding, self.fetch_width)
+
+    def __eq__(self, other):
+        return isinstance(other, PipelineConfig) and self.key() == other.key()
+
+    def __hash__(self):
+        return hash(self.key())
+
+    @property
+    def name(self):
+        return f"{self.branch_stage}/{'fwd' if self.mem_forwarding else 'nofwd'}/x{self.fetch_width}"
+
+    @property
+    def cost(self):
+        return (BRANCH_STAGE_COSTS[self.branch_stage] + (0 if self.mem_forwarding else NO_MEM_FORWARDING_COST) +
+                (DUAL_FETCH_COST if self.fetch_width == 2 else 0))
+
+    def to_dict(self):
+        return {'config': self.name, 'branch_stage': self.branch_stage, 'mem_forwarding': self.mem_forwarding,
+                'fetch_width': self.fetch_width, 'cost': self.cost}
+
+# The configuration of rtl/cpu.v, the baseline for speedups
+BASELINE = PipelineConfig()
+
+def config_grid(branch_stages=BRANCH_STAGES, mem_forwarding=(True, False), fetch_widths=FETCH_WIDTHS):
+    """Every combination of the given options"""
+    return [PipelineConfig(*options) for options in itertools.product(branch_stages, mem_forwarding, fetch_widths)]
+
+def _timing_fields(word):
+    """(rs1, rs2, rd written or 0, load, memory access, reads operands in ID when branches resolve there)"""
+    opcode = word & 0x7F
+    rd = (word >> 7) & 0x1F
+    writes = opcode not in (OP_STORE, OP_BRANCH) and rd
+    return ((word >> 15) & 0x1F, (word >> 20) & 0x1F, rd if writes else 0, opcode == OP_LOAD,
+            opcode in (OP_LOAD, OP_STORE), opcode in (OP_BRANCH, OP_JALR))
+
+def capture_stream(program, data=None, mem_words=DEFAULT_MEM_WORDS, max_steps=DEFAULT_MAX_STEPS):
+    """PCs, words and taken flags of the instructions program retires on the functional simulator"""
+    records, simulator = capture_trace(program, data, mem_words, max_steps, trace_branches=True)
+    opcodes = records['word'] & 0x7F
+    taken = (opcodes == OP_JAL) | (opcodes == OP_JALR)
+    # Branch trace entries follow the retired branches in order; a final halt loop is not traced
+    transfers = np.frombuffer(simulator.branch_trace, dtype=np.uint64)
+    branch_taken = (transfers[((transfers >> 1) & 3) == TRANSFER_BRANCH] & 1).astype(bool)
+    branches = np.flatnonzero(opcodes == OP_BRANCH)
+    flags = np.ones(len(branches), dtype=bool)
+    flags[:len(branch_taken)] = branch_taken[:len(branches)]
+    taken[branches] = flags
+    return records['pc'].tolist(), records['word'].tolist(), taken.tolist()
+
+def time_trace(pcs, words, taken, config):
+    """Cycles of a retired instruction stream on config
+
+    Tracks the cycle each instruction reaches EX, in order: one after the
+    previous one, or the same cycle when they pair, plus the flush penalty
+    after a taken branch or jump, and no earlier than its operands can be
+    forwarded. Returns a dict of cycles (up to the last writeback), stall and
+    flush cycles, and dual-issued pairs.
+    """
+    penalty = FLUSH_PENALTIES[config.branch_stage]
+    alu_latency = 1 if config.mem_forwarding else 2
+    early = 1 if config.branch_stage == STAGE_ID else 0
+    dual = config.fetch_width == 2
+    decoded = {}
+    # ready[r] is the first EX cycle in which a reader of r gets its value
+    ready = [0] * 32
+    ex = 2
+    previous_memory = previous_taken = pairable = False
+    stalls = flushes = pairs = 0
+
+    for pc, word, redirects in zip(pcs, words, taken):
+        fields = decoded.get(word)
+        if fields is None:
+            fields = decoded[word] = _timing_fields(word)
+        rs1, rs2, rd, load, memory, in_id = fields
+        need = ready[rs1] if ready[rs1] > ready[rs2] else ready[rs2]
+        if in_id:
+            need += early
+        if not previous_taken:
+            if pairable and need <= ex and not (memory and previous_memory):
+                pairs += 1
+                pairable = False
+                if rd:
+                    ready[rd] = ex + (2 if load else alu_latency)
+                previous_memory, previous_taken = memory, redirects
+                continue
+            issue = ex + 1
+        else:
+            issue = ex + 1 + penalty
+            flushes += penalty
+        if need > issue:
+            stalls += need - issue
+            issue = need
+        ex = issue
+        pairable = dual and not pc & 4
+        if rd:
+            ready[rd] = ex + (2 if load else alu_latency)
+        previous_memory, previous_taken = memory, redirects
+
+    return {'instructions': len(words), 'cycles': ex + 2 if len(words) else 0,
+            'stall_cycles': stalls, 'flush_cycles': flushes, 'pairs': pairs}
+
+def program_key(words, data, mem_words, max_steps):
+    """Hash identifying a benchmark run: its image, data and run limits"""
+    digest = hashlib.sha256(f"risc-sweep/{SWEEP_MODEL_VERSION}/{mem_words}/{max_steps}\n".encode())
+    digest.update(len(words).to_bytes(4, 'little'))
+    digest.update(image_bytes(words))
+    digest.update(image_bytes(data))
+    return digest.hexdigest()
+
+class SweepCache:
+    """Timing results on disk, one JSON file per (program hash, configuration)"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key, config):
+        return os.path.join(self.directory, f"{key[:32]}-{config.name.replace('/', '-')}.json")
+
+    def get(self, key, config):
+        try:
+            with open(self._path(key, config)) as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return entry['result'] if entry.get('key') == key else None
+
+    def put(self, key, config, result):
+        path = self._path(key, config)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({'key': key, 'config': config.name, 'result': result}, f)
+        os.replace(tmp_path, path)
+
+# Retired stream of the benchmark a worker process ran last, by program key; tasks
+# arrive grouped by benchmark
+_streams = {}
+
+def time_program(key, words, data, mem_words, max_steps, config):
+    """Time one benchmark on one configuration; runs in the worker processes"""
+    stream = _streams.get(key)
+    if stream is None:
+        _streams.clear()
+        stream = _streams[key] = capture_stream(words, data or None, mem_words, max_steps)
+    return time_trace(*stream, config)
+
+class Benchmark:
+    """A program image and its initial data, identified by hash"""
+
+    def __init__(self, name, words, data=None, mem_words=DEFAULT_MEM_WORDS, max_steps=DEFAULT_MAX_STEPS):
+        self.name = name
+        self.words = words
+        self.data = data if data is not None else []
+        self.mem_words = mem_words
+        self.max_steps = max_steps
+        self.key = program_key(words, self.data, mem_words, max_steps)
+        # Lost branches and stale jalrs: cpu.v does not run these as written, and the model does
+        self.hazard_sites = sorted(rtl_hazard_sites(words))
+
+    @classmethod
+    def load(cls, path, mem_words=DEFAULT_MEM_WORDS, max_steps=DEFAULT_MAX_STEPS):
+        assembler = RiscAssembler()
+        words = load_program(path, assembler)[0]
+        return cls(os.path.basename(path), words, assembler.data, mem_words, max_steps)
+
+def run_sweep(benchmarks, configs, jobs=None, cache=None, allow_hazards=False):
+    """Time every benchmark on every configuration, plus cpu.v for speedups
+
+    Points missing from cache are computed in a pool of jobs processes
+    (default: one per CPU). Returns (points, computed), points being a dict
+    from (benchmark name, config) to result dicts. Raises ValueError for a
+    benchmark with RTL hazard sites, whose cpu.v baseline the model cannot
+    reproduce, unless allow_hazards is set.
+    """
+    if not allow_hazards:
+        for benchmark in benchmarks:
+            if benchmark.hazard_sites:
+                addresses = ", ".join(f"0x{4 * index:x}" for index in benchmark.hazard_sites)
+                raise ValueError(f"{benchmark.name}: cpu.v loses a branch or reads a stale jalr base at "
+                                 f"{addresses} (see risc_analyzer.py), so its timing would not match "
+                                 f"the baseline; pass --allow-rtl-hazards to sweep it anyway")
+    configs = list(dict.fromkeys([BASELINE] + list(configs)))
+    points = {}
+    missing = []
+    for benchmark in benchmarks:
+        for config in configs:
+            result = cache.get(benchmark.key, config) if cache is not None else None
+            if result is None:
+                missing.append((benchmark, config))
+            else:
+                points[benchmark.name, config] = result
+
+    jobs = min(jobs or os.cpu_count() or 1, len(missing))
+    tasks = [(benchmark.key, benchmark.words, benchmark.data, benchmark.mem_words, benchmark.max_steps, config)
+             for benchmark, config in missing]
+    if jobs <= 1:
+        results = [time_program(*task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            results = list(pool.map(time_program, *zip(*tasks), chunksize=len(configs)))
+    for (benchmark, config), result in zip(missing, results):
+        points[benchmark.name, config] = result
+        if cache is not None:
+            cache.put(benchmark.key, config, result)
+    return points, len(missing)
+
+def sweep_rows(benchmarks, configs, points):
+    """One row per (benchmark, configuration) with cycles, CPI and speedup over cpu.v"""
+    rows = []
+    for benchmark in benchmarks:
+        baseline = points[benchmark.name, BASELINE]['cycles']
+        for config in configs:
+            result = points[benchmark.name, config]
+            row = {'program': benchmark.name}
+            row.update(config.to_dict())
+            row.update(result)
+            row['cpi'] = round(result['cycles'] / result['instructions'], 4) if result['instructions'] else None
+            row['speedup'] = round(baseline / result['cycles'], 4) if result['cycles'] else None
+            rows.append(row)
+    return rows
+
+def summarize(rows, configs):
+    """Per-configuration geometric mean speedup, and whether it is on the Pareto front"""
+    summary = []
+    for config in configs:
+        speedups = [row['speedup'] for row in rows if row['config'] == config.name and row['speedup']]
+        geomean = math.exp(sum(map(math.log, speedups)) / len(speedups)) if speedups else 0.0
+        entry = config.to_dict()
+        entry['geomean_speedup'] = round(geomean, 4)
+        summary.append(entry)
+    for entry in summary:
+        entry['pareto'] = not any(
+            other['cost'] <= entry['cost'] and other['geomean_speedup'] >= entry['geomean_speedup'] and
+            (other['cost'], other['geomean_speedup']) != (entry['cost'], entry['geomean_speedup'])
+            for other in summary)
+    return sorted(summary, key=lambda entry: (-entry['geomean_speedup'], entry['cost']))
+
+def format_report(benchmarks, configs, rows, summary):
+    """Cycles per benchmark and configuration, the per-configuration summary and the Pareto front"""
+    names = [benchmark.name for benchmark in benchmarks]
+    # Each cell is 'cycles speedup'
+    width = max([len(name) for name in names] + [len(str(row['cycles'])) + 9 for row in rows])
+    lines = [f"{'config':<14}{'cost':>5}  " + "  ".join(f"{name:>{width}}" for name in names)]
+    by_point = {(row['program'], row['config']): row for row in rows}
+    for config in configs:
+        cells = []
+        for name in names:
+            row = by_point[name, config.name]
+            cells.append(f"{row['cycles']:>{width - 9}} {row['speedup']:7.3f}x")
+        baseline = " (cpu.v)" if config == BASELINE else ""
+        lines.append(f"{config.name:<14}{config.cost:>5}  " + "  ".join(cells).rstrip() + baseline)
+
+    lines += ["", f"{'config':<14}{'cost':>5} {'speedup':>9}  (geometric mean over {len(benchmarks)} programs)"]
+    for entry in summary:
+        marker = "  pareto" if entry['pareto'] else ""
+        lines.append(f"{entry['config']:<14}{entry['cost']:>5} {entry['geomean_speedup']:8.3f}x{marker}")
+    front = sorted((entry for entry in summary if entry['pareto']), key=lambda entry: entry['cost'])
+    lines += ["", "Pareto front (cost -> speedup): " +
+              ", ".join(f"{entry['config']} ({entry['cost']} -> {entry['geomean_speedup']:.3f}x)" for entry in front)]
+    return "\n".join(lines)
+
+def write_csv(path, rows):
+    with open(path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=list(rows[0]))
+        writer.writeheader()
+        writer.writerows(rows)
+
+def parse_choices(text, choices):
+    """The values of a comma-separated option list; choices maps each accepted name to its value"""
+    values = []
+    for item in text.split(','):
+        if item.strip() not in choices:
+            raise ValueError(f"{item.strip()!r} is not one of {', '.join(choices)}")
+        values.append(choices[item.strip()])
+    return list(dict.fromkeys(values))
+
+def main():
+    parser = argparse.ArgumentParser(description="Sweep pipeline configurations over benchmark programs")
+    parser.add_argument('programs', nargs='*',
+                        help="assembly sources or program images (default: the repository's benchmarks)")
+    parser.add_argument('--branch-stage', default=','.join(BRANCH_STAGES),
+                        help="stages resolving taken branches and jumps (default: mem,ex,id)")
+    parser.add_argument('--mem-forwarding', default='on,off',
+                        help="with and/or without the EX/MEM -> EX forwarding path (default: on,off)")
+    parser.add_argument('--fetch-width', default='1,2', help="instructions fetched per cycle (default: 1,2)")
+    parser.add_argument('-j', '--jobs', type=int, help="worker processes (default: one per CPU)")
+    parser.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR,
+                        help=f"directory caching results per program and configuration (default: {DEFAULT_CACHE_DIR})")
+    parser.add_argument('--no-cache', action='store_true', help="recompute every point and store nothing")
+    parser.add_argument('--mem-words', type=int, default=DEFAULT_MEM_WORDS,
+                        help=f"data memory size in words, a power of two (default: {DEFAULT_MEM_WORDS})")
+    parser.add_argument('--max-steps', type=int, default=DEFAULT_MAX_STEPS,
+                        help=f"stop each program after about this many instructions (default: {DEFAULT_MAX_STEPS})")
+    parser.add_argument('--allow-rtl-hazards', action='store_true',
+                        help="sweep programs that lose a branch or read a stale jalr base on cpu.v, "
+                             "timing them as if they ran correctly")
+    parser.add_argument('--csv', metavar='FILE', help="write the table as CSV")
+    parser.add_argument('--json', metavar='FILE', help="write the table, summary and Pareto front as JSON")
+    args = parser.parse_args()
+
+    try:
+        configs = config_grid(parse_choices(args.branch_stage, {stage: stage for stage in BRANCH_STAGES}),
+                              parse_choices(args.mem_forwarding, {'on': True, 'off': False}),
+                              parse_choices(args.fetch_width, {str(width): width for width in FETCH_WIDTHS}))
+        programs = args.programs or [os.path.join(os.path.dirname(os.path.abspath(__file__)), name)
+                                     for name in DEFAULT_PROGRAMS]
+        benchmarks = [Benchmark.load(path, args.mem_words, args.max_steps) for path in programs]
+        if len({benchmark.name for benchmark in benchmarks}) != len(benchmarks):
+            raise ValueError("Programs must have distinct file names")
+        for benchmark in benchmarks:
+            if benchmark.hazard_sites and args.allow_rtl_hazards:
+                print(f"Warning: {benchmark.name} has {len(benchmark.hazard_sites)} lost branch or stale jalr "
+                      f"site(s); its cpu.v column is the model's, not the RTL's", file=sys.stderr)
+        cache = None if args.no_cache else SweepCache(args.cache_dir)
+        points, computed = run_sweep(benchmarks, configs, args.jobs, cache, args.allow_rtl_hazards)
+        configs = list(dict.fromkeys([BASELINE] + configs))
+        rows = sweep_rows(benchmarks, configs, points)
+        summary = summarize(rows, configs)
+        if args.csv:
+            write_csv(args.csv, rows)
+        if args.json:
+            with open(args.json, 'w') as f:
+                json.dump({'points': rows, 'summary': summary}, f, indent=2)
+    except (OSError, ValueError) as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+
+    print(f"Sweep: {len(benchmarks)} programs x {len(configs)} configurations, "
+          f"{computed} points computed, {len(points) - computed} cached\n")
+    print(format_report(benchmarks, configs, rows, summary))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+"""
+RISC Trace - Retired-instruction traces and lockstep diffing
+
+A retire trace holds one record per instruction leaving writeback: four
+little-endian 32-bit words giving the PC, the instruction, rd and the value
+written to rd. rd and the value are 0 when no register is written (including
+writes to x0). The records follow a four-word header: the magic "RTRC", the
+format version, the words per record and a reserved 0.
+
+The functional simulator writes traces (record), and so do the testbenches
+when run with +retire_trace=FILE (tb/retire_trace.v). Traces are read through
+np.memmap and compared chunk by chunk, so diffing two traces of any length
+needs no more memory than one chunk, and stops at the first record that
+differs, printing the instructions around it disassembled.
+
+The functional simulator counts the final self-jump of a program once, while
+a testbench retires it on every pass until $finish: repeats of the halt loop
+at the end of the longer trace are not a divergence.
+
+Usage:
+  python risc_trace.py record <program.s|program.hex|program.bin> -o iss.trace
+  python risc_trace.py diff iss.trace rtl.trace [--program program.s]
+  python risc_trace.py show trace [--start N] [--count N]
+"""
+
+import argparse
+import io
+import os
+import sys
+
+import numpy as np
+
+from risc_assembler import RiscAssembler
+from risc_disassembler import Disassembler
+from risc_simulator import (DEFAULT_MAX_STEPS, DEFAULT_MEM_WORDS, OP_BRANCH, OP_JAL, RiscSimulator,
+                            decode_b_imm, decode_j_imm, load_program)
+
+TRACE_MAGIC = 0x43525452  # "RTRC" as little-endian bytes
+TRACE_VERSION = 1
+HEADER_WORDS = 4
+RECORD_WORDS = 4
+RECORD_DTYPE = np.dtype([('pc', '<u4'), ('word', '<u4'), ('rd', '<u4'), ('value', '<u4')])
+
+# Records compared per step of a diff
+DIFF_CHUNK = 1 << 20
+
+DEFAULT_CONTEXT = 5
+
+def trace_header():
+    """The header starting every trace file"""
+    return np.array([TRACE_MAGIC, TRACE_VERSION, RECORD_WORDS, 0], dtype='<u4').tobytes()
+
+def open_trace(path):
+    """Map a trace file's records into memory as a read-only structured array"""
+    size = os.path.getsize(path)
+    with open(path, 'rb') as f:
+        header = np.frombuffer(f.read(4 * HEADER_WORDS), dtype='<u4')
+    if len(header) != HEADER_WORDS or header[0] != TRACE_MAGIC:
+        raise ValueError(f"{path} is not a retire trace")
+    if header[1] != TRACE_VERSION or header[2] != RECORD_WORDS:
+        raise ValueError(f"{path}: unsupported trace version {header[1]} with {header[2]}-word records")
+    count = (size - 4 * HEADER_WORDS) // RECORD_DTYPE.itemsize
+    if not count:
+        return np.zeros(0, dtype=RECORD_DTYPE)
+    return np.memmap(path, dtype=RECORD_DTYPE, mode='r', offset=4 * HEADER_WORDS, shape=(count,))
+
+def capture_trace(program, data=None, mem_words=DEFAULT_MEM_WORDS, max_steps=DEFAULT_MAX_STEPS,
+                  trace_branches=False):
+    """Run program on the functional simulator, keeping its retire trace in memory
+
+    Returns the records and the simulator, which also holds a branch trace
+    if trace_branches is set.
+    """
+    buffer = io.BytesIO()
+    buffer.write(trace_header())
+    simulator = RiscSimulator(program, mem_words=mem_words, data=data, trace_branches=trace_branches,
+                              retire_file=buffer)
+    simulator.run(max_steps)
+    return np.frombuffer(buffer.getbuffer(), dtype=RECORD_DTYPE, offset=4 * HEADER_WORDS), simulator
+
+def record_trace(program, path, data=None, mem_words=DEFAULT_MEM_WORDS, max_steps=DEFAULT_MAX_STEPS):
+    """Run program on the functional simulator, writing its retire trace to path"""
+    with open(path, 'wb') as f:
+        f.write(trace_header())
+        simulator = RiscSimulator(program, mem_words=mem_words, data=data, retire_file=f)
+        simulator.run(max_steps)
+    return simulator
+
+def is_halt_loop(record):
+    """Whether a record is a jump or always-taken branch to itself"""
+    word = int(record['word'])
+    opcode = word & 0x7F
+    if opcode == OP_JAL:
+        return decode_j_imm(word) == 0
+    if opcode == OP_BRANCH:
+        return (decode_b_imm(word) == 0 and (word >> 15) & 0x1F == (word >> 20) & 0x1F and
+                (word >> 12) & 0x7 in (0b000, 0b101, 0b111))
+    return False
+
+def records_as_words(records):
+    """View records as an (n, 4) array of words, without copying"""
+    return records.view('<u4').reshape(-1, RECORD_WORDS)
+
+def first_difference(a, b, chunk=DIFF_CHUNK):
+    """Index of the first record where traces a and b differ, or None
+
+    A trace ending early differs at its end, unless the longer one only
+    repeats the shorter one's final halt loop from there.
+    """
+    common = min(len(a), len(b))
+    for start in range(0, common, chunk):
+        end = min(start + chunk, common)
+        differs = (records_as_words(a[start:end]) != records_as_words(b[start:end])).any(axis=1)
+        if differs.any():
+            return start + int(differs.argmax())
+    if len(a) == len(b):
+        return None
+    longer = a if len(a) > len(b) else b
+    if not common or not is_halt_loop(longer[common - 1]):
+        return common
+    last = records_as_words(longer[common - 1:common])
+    for start in range(common, len(longer), chunk):
+        repeats = (records_as_words(longer[start:start + chunk]) == last).all(axis=1)
+        if not repeats.all():
+            return start + int(repeats.argmin())
+    return None
+
+def format_records(records, first_index, disassembler, symbols=None, marker=' '):
+    """Numbered, disassembled lines for consecutive trace records"""
+    if not len(records):
+        return []
+    texts = disassembler.texts(records['word'], records['pc'], symbols)
+    lines = []
+    for offset, (record, text) in enumerate(zip(records.tolist(), texts)):
+        pc, word, rd, value = record
+        write = f"x{rd} = 0x{value:08x}" if rd else ""
+        lines.append(f"{marker} {first_index + offset:>10}  0x{pc:08x}: 0x{word:08x}  {text:<28} {write}".rstrip())
+    return lines
+
+def format_divergence(a, b, index, names=('A', 'B'), context=DEFAULT_CONTEXT, symbols=None,
+                      disassembler=None):
+    """Report where traces a and b first differ, with the records leading up to it"""
+    disassembler = disassembler or Disassembler()
+    lines = [f"Traces diverge at retired instruction {index} (A: {names[0]}, B: {names[1]}):"]
+    lines.extend(format_records(a[max(0, index - context):index], max(0, index - context),
+                                disassembler, symbols))
+    for marker, trace in zip('AB', (a, b)):
+        if index < len(trace):
+            lines.extend(format_records(trace[index:index + 1], index, disassembler, symbols, marker))
+        else:
+            lines.append(f"{marker} {index:>10}  (trace ends after {len(trace)} instructions)")
+    if index < len(a) and index < len(b):
+        fields = [field for field in RECORD_DTYPE.names if a[index][field] != b[index][field]]
+        lines.append(f"Differing fields: {', '.join(fields)}")
+    return "\n".join(lines)
+
+def main():
+    parser = argparse.ArgumentParser(description="Record, show and diff retired-instruction traces")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    record = commands.add_parser('record', help="write the functional simulator's trace of a program")
+    record.add_argument('program', help="assembly source (.s), $readmemh image (.hex), raw image "
+                                        "(.bin) or assembler text output (.mem)")
+    record.add_argument('-o', '--output', required=True, help="trace file to write")
+    record.add_argument('--data', help="initial data memory image (.hex or .bin)")
+    record.add_argument('--mem-words', type=int, default=DEFAULT_MEM_WORDS,
+                        help=f"data memory size in words, a power of two (default: {DEFAULT_MEM_WORDS})")
+    record.add_argument('--max-steps', type=int, default=DEFAULT_MAX_STEPS,
+                        help=f"stop after about this many instructions (default: {DEFAULT_MAX_STEPS})")
+
+    diff = commands.add_parser('diff', help="compare two traces, stopping at the first difference")
+    diff.add_argument('traces', nargs=2, metavar='TRACE')
+    diff.add_argument('--program', help="assembly source whose labels name branch targets")
+    diff.add_argument('--context', type=int, default=DEFAULT_CONTEXT,
+                      help=f"records shown before the difference (default: {DEFAULT_CONTEXT})")
+
+    show = commands.add_parser('show', help="print trace records, disassembled")
+    show.add_argument('trace')
+    show.add_argument('--program', help="assembly source whose labels name branch targets")
+    show.add_argument('--start', type=int, default=0, help="first record shown (default: 0)")
+    show.add_argument('--count', type=int, default=20, help="records shown (default: 20)")
+    args = parser.parse_args()
+
+    try:
+        if args.command == 'record':
+            assembler = RiscAssembler()
+            program = load_program(args.program, assembler)[0]
+            data = load_program(args.data)[0] if args.data else assembler.data or None
+            simulator = record_trace(program, args.output, data, args.mem_words, args.max_steps)
+            print(f"Recorded {simulator.instret} instructions to {args.output}")
+            return
+
+        symbols = None
+        if args.program:
+            assembler = RiscAssembler()
+            load_program(args.program, assembler)
+            symbols = assembler.text_symbols()
+
+        if args.command == 'show':
+            trace = open_trace(args.trace)
+            lines = format_records(trace[args.start:args.start + args.count], args.start,
+                                   Disassembler(), symbols)
+            print("\n".join(lines) if lines else f"{args.trace}: no records from {args.start}")
+            return
+
+        a, b = (open_trace(path) for path in args.traces)
+        index = first_difference(a, b)
+        if index is None:
+            print(f"Traces match: {max(len(a), len(b))} instructions")
+            return
+        print(format_divergence(a, b, index, args.traces, args.context, symbols))
+    except (OSError, ValueError) as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+    sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -9,7 +9,8 @@ module control_unit(
     output reg branch,
     output reg jal,
     output reg jalr,
-    output reg auipc
+    output reg auipc,
+    output reg csr_read
 );
 
     // RISC Instruction format
@@ -31,6 +32,7 @@ module control_unit(
     parameter OP_JALR       = 7'b1100111; // Jump and Link Register
     parameter OP_LUI        = 7'b0110111; // Load Upper Immediate
     parameter OP_AUIPC      = 7'b0010111; // Add Upper Immediate to PC
+    parameter OP_SYSTEM     = 7'b1110011; // Performance counter read (CSRRS rd, csr, x0)
     
     // ALU operation codes (same as in alu.v)
     parameter ALU_ADD  = 4'b0000;
@@ -57,6 +59,7 @@ module control_unit(
         jal = 1'b0;
         jalr = 1'b0;
         auipc = 1'b0;
+        csr_read = 1'b0;
 
         case(opcode)
             OP_R_TYPE: begin
@@ -175,6 +178,16 @@ module control_unit(
                 alu_op = ALU_ADD; // For JALR: rs1 + imm
                 jalr = 1'b1;
             end
+
+            OP_SYSTEM: begin
+                // Counter reads: cpu.v puts the counter value in the immediate
+                if (funct3 == 3'b010) begin
+                    reg_write = 1'b1;
+                    alu_src = 1'b1; // Use immediate
+                    alu_op = ALU_LUI; // Pass counter value through ALU
+                    csr_read = 1'b1;
+                end
+            end
             
             default: begin
                 // Default control values (NOP instruction)
@@ -15,6 +15,7 @@ module cpu(
     // IF/ID
     reg [31:0] IF_ID_PC;
     reg [31:0] IF_ID_Instruction;
+    reg IF_ID_Valid;
     
     // ID/EX
     reg [31:0] ID_EX_PC;
@@ -35,6 +36,7 @@ module cpu(
     reg ID_EX_Jal;
     reg ID_EX_Jalr;
     reg ID_EX_Auipc;
+    reg ID_EX_Valid;
     
     // EX/MEM
     reg [31:0] EX_MEM_BranchTarget;
@@ -50,6 +52,7 @@ module cpu(
     reg EX_MEM_Branch;
     reg EX_MEM_Jal;
     reg EX_MEM_Jalr;
+    reg EX_MEM_Valid;
 
     // MEM/WB
     reg [31:0] MEM_WB_ReadData;
@@ -57,6 +60,16 @@ module cpu(
     reg [4:0] MEM_WB_Rd;
     reg MEM_WB_RegWrite;
     reg MEM_WB_MemtoReg;
+    reg MEM_WB_Valid;
+
+    // Retired-instruction trace only (tb/retire_trace.v): the PC and word of
+    // each instruction, carried to writeback. The datapath never reads them.
+    reg [31:0] ID_EX_Instruction;
+    reg [31:0] EX_MEM_PC;
+    reg [31:0] EX_MEM_Instruction;
+    reg [31:0] MEM_WB_PC;
+    reg [31:0] MEM_WB_Instruction;
+    wire [31:0] wb_data;
     
     // Internal signals
     // IF stage
@@ -82,6 +95,8 @@ module cpu(
     wire jal;
     wire jalr;
     wire auipc;
+    wire csr_read;
+    reg [31:0] csr_data;
     
     // Hazard detection unit signals
     wire stall;
@@ -92,6 +107,12 @@ module cpu(
     
     // Pipeline control signals
     reg pipeline_stall;
+
+    // Performance counters, read with rdcycle/rdinstret/rdstall/rdflush
+    reg [31:0] cycle_count;   // cycles since reset
+    reg [31:0] instret_count; // instructions written back
+    reg [31:0] stall_count;   // load-use stall cycles
+    reg [31:0] flush_count;   // taken branches and jumps
     
     // Fetch stage (IF)
     assign instr_addr = PC;
@@ -122,13 +143,16 @@ module cpu(
         if (rst) begin
             IF_ID_PC <= 32'b0;
             IF_ID_Instruction <= 32'b0;
+            IF_ID_Valid <= 1'b0;
         end else if (!pipeline_stall) begin
             if (flush) begin
                 IF_ID_Instruction <= 32'b0; // NOP on flush
                 IF_ID_PC <= 32'b0;
+                IF_ID_Valid <= 1'b0;
             end else begin
                 IF_ID_PC <= PC;
                 IF_ID_Instruction <= instruction;
+                IF_ID_Valid <= 1'b1;
             end
         end
     end
@@ -145,9 +169,12 @@ module cpu(
         .branch(branch),
         .jal(jal),
         .jalr(jalr),
-        .auipc(auipc)
+        .auipc(auipc),
+        .csr_read(csr_read)
     );
     
+    assign wb_data = MEM_WB_MemtoReg ? MEM_WB_ReadData : MEM_WB_ALUResult;
+
     register_file registers(
         .clk(clk),
         .rst(rst),
@@ -155,7 +182,7 @@ module cpu(
         .read_reg1(IF_ID_Instruction[19:15]), // rs1
         .read_reg2(IF_ID_Instruction[24:20]), // rs2
         .write_reg(MEM_WB_Rd),
-        .write_data(MEM_WB_MemtoReg ? MEM_WB_ReadData : MEM_WB_ALUResult),
+        .write_data(wb_data),
         .read_data1(reg_data1),
         .read_data2(reg_data2)
     );
@@ -174,6 +201,17 @@ module cpu(
         .MEM_WB_Rd(MEM_WB_Rd),
         .stall(stall)
     );
+
+    // Counter read: instret also counts the older instructions still in flight
+    always @(*) begin
+        case(IF_ID_Instruction[31:20])
+            12'hC00: csr_data = cycle_count;
+            12'hC02: csr_data = instret_count + ID_EX_Valid + EX_MEM_Valid + MEM_WB_Valid;
+            12'hC03: csr_data = stall_count;
+            12'hC04: csr_data = flush_count;
+            default: csr_data = 32'b0;
+        endcase
+    end
     
     // ID/EX Pipeline Register
     always @(posedge clk or posedge rst) begin
@@ -196,6 +234,8 @@ module cpu(
             ID_EX_Jalr <= 1'b0;
             ID_EX_Funct3 <= 3'b0;
             ID_EX_Auipc <= 1'b0;
+            ID_EX_Valid <= 1'b0;
+            ID_EX_Instruction <= 32'b0;
         end else if (flush || stall) begin
             ID_EX_PC <= 32'b0;
             ID_EX_Rs1 <= 5'b0;
@@ -215,6 +255,8 @@ module cpu(
             ID_EX_Jalr <= 1'b0;
             ID_EX_Funct3 <= 3'b0;
             ID_EX_Auipc <= 1'b0;
+            ID_EX_Valid <= 1'b0;
+            ID_EX_Instruction <= 32'b0;
         end else if (!pipeline_stall) begin
             ID_EX_PC <= IF_ID_PC;
             ID_EX_Rs1 <= IF_ID_Instruction[19:15];
@@ -222,7 +264,7 @@ module cpu(
             ID_EX_Rd <= IF_ID_Instruction[11:7];
             ID_EX_RegR1 <= reg_data1;
             ID_EX_RegR2 <= reg_data2;
-            ID_EX_Imm <= imm_ext;
+            ID_EX_Imm <= csr_read ? csr_data : imm_ext;
             ID_EX_RegWrite <= reg_write;
             ID_EX_ALUSrc <= alu_src;
             ID_EX_ALUOp <= alu_op;
@@ -234,6 +276,8 @@ module cpu(
             ID_EX_Jalr <= jalr;
             ID_EX_Auipc <= auipc;
             ID_EX_Funct3 <= IF_ID_Instruction[14:12];
+            ID_EX_Valid <= IF_ID_Valid;
+            ID_EX_Instruction <= IF_ID_Instruction;
         end
     end
     
@@ -299,6 +343,9 @@ module cpu(
             EX_MEM_Jal <= 1'b0;
             EX_MEM_Jalr <= 1'b0;
             EX_MEM_Funct3 <= 3'b0;
+            EX_MEM_Valid <= 1'b0;
+            EX_MEM_PC <= 32'b0;
+            EX_MEM_Instruction <= 32'b0;
         end else if (flush) begin
             EX_MEM_BranchTarget <= 32'b0;
             EX_MEM_Zero <= 1'b0;
@@ -313,6 +360,9 @@ module cpu(
             EX_MEM_Jal <= 1'b0;
             EX_MEM_Jalr <= 1'b0;
             EX_MEM_Funct3 <= 3'b0;
+            EX_MEM_Valid <= 1'b0;
+            EX_MEM_PC <= 32'b0;
+            EX_MEM_Instruction <= 32'b0;
         end else begin
             EX_MEM_BranchTarget <= branch_target;
             EX_MEM_Zero <= zero_flag;
@@ -327,6 +377,9 @@ module cpu(
             EX_MEM_Jal <= ID_EX_Jal;
             EX_MEM_Jalr <= ID_EX_Jalr;
             EX_MEM_Funct3 <= ID_EX_Funct3;
+            EX_MEM_Valid <= ID_EX_Valid;
+            EX_MEM_PC <= ID_EX_PC;
+            EX_MEM_Instruction <= ID_EX_Instruction;
         end
     end
     
@@ -344,12 +397,37 @@ module cpu(
             MEM_WB_Rd <= 5'b0;
             MEM_WB_RegWrite <= 1'b0;
             MEM_WB_MemtoReg <= 1'b0;
+            MEM_WB_Valid <= 1'b0;
+            MEM_WB_PC <= 32'b0;
+            MEM_WB_Instruction <= 32'b0;
         end else begin
             MEM_WB_ReadData <= data_in;
             MEM_WB_ALUResult <= EX_MEM_ALUResult;
             MEM_WB_Rd <= EX_MEM_Rd;
             MEM_WB_RegWrite <= EX_MEM_RegWrite;
             MEM_WB_MemtoReg <= EX_MEM_MemtoReg;
+            MEM_WB_Valid <= EX_MEM_Valid;
+            MEM_WB_PC <= EX_MEM_PC;
+            MEM_WB_Instruction <= EX_MEM_Instruction;
+        end
+    end
+
+    // Performance counters
+    always @(posedge clk or posedge rst) begin
+        if (rst) begin
+            cycle_count <= 32'b0;
+            instret_count <= 32'b0;
+            stall_count <= 32'b0;
+            flush_count <= 32'b0;
+        end else begin
+            cycle_count <= cycle_count + 1;
+            if (MEM_WB_Valid)
+                instret_count <= instret_count + 1;
+            if (stall)
+                stall_count <= stall_count + 1;
+            // A flush during a load-use stall loses its branch; it is not counted
+            if (flush && !stall)
+                flush_count <= flush_count + 1;
         end
     end
     
@@ -39,6 +39,19 @@ module cpu_bubble_sort_tb;
         .mem_write(mem_write),
         .mem_read(mem_read)
     );
+
+    // Retired-instruction trace, written when run with +retire_trace=FILE;
+    // tb/retire_trace.v must be compiled in alongside this file
+    retire_trace retire(
+        .clk(clk),
+        .rst(rst),
+        .valid(cpu_inst.MEM_WB_Valid),
+        .pc(cpu_inst.MEM_WB_PC),
+        .instruction(cpu_inst.MEM_WB_Instruction),
+        .reg_write(cpu_inst.MEM_WB_RegWrite),
+        .rd(cpu_inst.MEM_WB_Rd),
+        .value(cpu_inst.wb_data)
+    );
     
     // Clock generation
     always begin
@@ -251,6 +264,7 @@ module cpu_bubble_sort_tb;
         $display("x4 %0d", cpu_inst.registers.registers[4]);
         $display("x5 %0d", cpu_inst.registers.registers[5]);
         $display("x6 %0d", cpu_inst.registers.registers[6]);
+        retire.close;
         $finish;
     end
 endmodule 
@@ -0,0 +1,131 @@
+// Testbench for risc_fuzzer.py: runs a program image named on the command line
+//
+//   iverilog -o fuzz_tb rtl/*.v tb/retire_trace.v tb/cpu_fuzz_tb.v
+//   vvp fuzz_tb +program=prog.hex [+data=data.hex] [+retire_trace=rtl.trace]
+//       [+dmem_out=dmem.hex] [+max_cycles=N]
+//
+// The program runs until its halt loop (a jal to itself) retires, or for
+// max_cycles cycles (default 100000), then data memory is written to dmem_out
+// with $writememh. Memories not loaded from a file start zeroed. Data memory
+// is decoded like the other testbenches (data_addr[7:2]); instruction memory
+// holds 1024 words.
+module cpu_fuzz_tb;
+    // Clock and reset
+    reg clk;
+    reg rst;
+    integer i;
+    integer cycle_count;
+    integer max_cycles;
+    reg halted;
+    reg [8*256-1:0] path;
+
+    // Memory interface
+    wire [31:0] instr_addr;
+    reg [31:0] instruction;
+    wire [31:0] data_addr;
+    wire [31:0] data_out;
+    reg [31:0] data_in;
+    wire mem_write;
+    wire mem_read;
+
+    // Instruction memory (ROM)
+    reg [31:0] instr_mem [0:1023];
+
+    // Data memory (RAM)
+    reg [31:0] data_mem [0:63];
+
+    // Instantiate the CPU
+    cpu cpu_inst(
+        .clk(clk),
+        .rst(rst),
+        .instr_addr(instr_addr),
+        .instruction(instruction),
+        .data_addr(data_addr),
+        .data_out(data_out),
+        .data_in(data_in),
+        .mem_write(mem_write),
+        .mem_read(mem_read)
+    );
+
+    // Retired-instruction trace, written when run with +retire_trace=FILE;
+    // tb/retire_trace.v must be compiled in alongside this file
+    retire_trace retire(
+        .clk(clk),
+        .rst(rst),
+        .valid(cpu_inst.MEM_WB_Valid),
+        .pc(cpu_inst.MEM_WB_PC),
+        .instruction(cpu_inst.MEM_WB_Instruction),
+        .reg_write(cpu_inst.MEM_WB_RegWrite),
+        .rd(cpu_inst.MEM_WB_Rd),
+        .value(cpu_inst.wb_data)
+    );
+
+    // Clock generation
+    always begin
+        #5 clk = ~clk;
+    end
+
+    // Memory read/write
+    always @(*) begin
+        instruction = instr_mem[instr_addr[11:2]];
+
+        if (mem_read)
+            data_in = data_mem[data_addr[7:2]];
+        else
+            data_in = 32'h0;
+    end
+
+    always @(posedge clk) begin
+        if (mem_write)
+            data_mem[data_addr[7:2]] <= data_out;
+    end
+
+    // The halt loop is seen at the edge retire_trace records it on
+    always @(posedge clk) begin
+        if (rst) begin
+            cycle_count <= 0;
+        end else begin
+            cycle_count <= cycle_count + 1;
+            if (cpu_inst.MEM_WB_Valid && cpu_inst.MEM_WB_Instruction[6:0] == 7'b1101111 &&
+                cpu_inst.MEM_WB_Instruction[31:12] == 20'b0)
+                halted <= 1'b1;
+        end
+    end
+
+    // Stop half a cycle later, once the halt loop's record is written
+    always @(negedge clk) begin
+        if (!rst && (halted || cycle_count >= max_cycles)) begin
+            if (halted)
+                $display("HALT %0d", cycle_count);
+            else
+                $display("TIMEOUT %0d", cycle_count);
+            if ($value$plusargs("dmem_out=%s", path))
+                $writememh(path, data_mem);
+            retire.close;
+            $finish;
+        end
+    end
+
+    initial begin
+        clk = 0;
+        rst = 1;
+        halted = 0;
+        cycle_count = 0;
+        if (!$value$plusargs("max_cycles=%d", max_cycles))
+            max_cycles = 100000;
+
+        for (i = 0; i < 1024; i = i + 1)
+            instr_mem[i] = 32'h0;
+        for (i = 0; i < 64; i = i + 1)
+            data_mem[i] = 32'h0;
+        if (!$value$plusargs("program=%s", path)) begin
+            $display("ERROR: no +program=FILE given");
+            $finish;
+        end
+        $readmemh(path, instr_mem);
+        if ($value$plusargs("data=%s", path))
+            $readmemh(path, data_mem);
+
+        #10 rst = 0;
+    end
+endmodule
@@ -30,6 +30,19 @@ module cpu_gcd_tb;
         .mem_write(mem_write),
         .mem_read(mem_read)
     );
+
+    // Retired-instruction trace, written when run with +retire_trace=FILE;
+    // tb/retire_trace.v must be compiled in alongside this file
+    retire_trace retire(
+        .clk(clk),
+        .rst(rst),
+        .valid(cpu_inst.MEM_WB_Valid),
+        .pc(cpu_inst.MEM_WB_PC),
+        .instruction(cpu_inst.MEM_WB_Instruction),
+        .reg_write(cpu_inst.MEM_WB_RegWrite),
+        .rd(cpu_inst.MEM_WB_Rd),
+        .value(cpu_inst.wb_data)
+    );
     
     // Clock generation
     always begin
@@ -160,6 +173,7 @@ module cpu_gcd_tb;
             end
         end
         
+        retire.close;
         $finish;
     end
 
@@ -30,6 +30,19 @@ module cpu_hazard_tb;
         .mem_write(mem_write),
         .mem_read(mem_read)
     );
+
+    // Retired-instruction trace, written when run with +retire_trace=FILE;
+    // tb/retire_trace.v must be compiled in alongside this file
+    retire_trace retire(
+        .clk(clk),
+        .rst(rst),
+        .valid(cpu_inst.MEM_WB_Valid),
+        .pc(cpu_inst.MEM_WB_PC),
+        .instruction(cpu_inst.MEM_WB_Instruction),
+        .reg_write(cpu_inst.MEM_WB_RegWrite),
+        .rd(cpu_inst.MEM_WB_Rd),
+        .value(cpu_inst.wb_data)
+    );
     
     // Clock generation
     always begin
@@ -198,6 +211,7 @@ module cpu_hazard_tb;
         $display("x16 = %0d (Expected: 3)", cpu_inst.registers.registers[16]);
         $display("x17 = %0d (Expected: same as x14)", cpu_inst.registers.registers[17]);
         
+        retire.close;
         $finish;
     end
 
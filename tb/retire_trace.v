@@ -0,0 +1,50 @@
+// Retired-instruction trace writer for the testbenches
+//
+// Run a testbench with +retire_trace=FILE to write one record per instruction
+// leaving writeback: PC, instruction word, destination register (0 when no
+// register is written) and the value written, each a 32-bit word. The file
+// starts with a four-word header. risc_trace.py reads the format and diffs it
+// against the functional simulator. $fwrite %u writes each word in the host's
+// byte order, little-endian on x86.
+module retire_trace(
+    input wire clk,
+    input wire rst,
+    input wire valid,
+    input wire [31:0] pc,
+    input wire [31:0] instruction,
+    input wire reg_write,
+    input wire [4:0] rd,
+    input wire [31:0] value
+);
+    localparam MAGIC = 32'h43525452;   // "RTRC"
+    localparam VERSION = 32'd1;
+    localparam RECORD_WORDS = 32'd4;
+
+    reg [8*256-1:0] path;
+    integer fd;
+    wire writes = reg_write && rd != 5'b0;
+
+    initial begin
+        fd = 0;
+        if ($value$plusargs("retire_trace=%s", path)) begin
+            fd = $fopen(path, "wb");
+            $fwrite(fd, "%u%u%u%u", MAGIC, VERSION, RECORD_WORDS, 32'b0);
+        end
+    end
+
+    // Sampled before the edge updates MEM/WB, as the register file writes it
+    always @(posedge clk) begin
+        if (fd != 0 && !rst && valid)
+            $fwrite(fd, "%u%u%u%u", pc, instruction,
+                    writes ? {27'b0, rd} : 32'b0, writes ? value : 32'b0);
+    end
+
+    // Called by the testbench before $finish
+    task close;
+        begin
+            if (fd != 0)
+                $fclose(fd);
+            fd = 0;
+        end
+    endtask
+endmodule
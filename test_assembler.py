@@ -0,0 +1,57 @@
+"""Behaviour tests for risc_assembler.py; run with python -m unittest"""
+
+import io
+import os
+import unittest
+
+from risc_assembler import (RiscAssembler, OUTPUT_FORMATS, STREAM_CHUNK_WORDS, format_hex_image,
+                            write_stream)
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+PROGRAMS = ('fibonacci.s', 'ooo_benchmark.s', 'full_instruction_test.s')
+
+def read_program(name):
+    with open(os.path.join(ROOT, name)) as f:
+        return f.read()
+
+def long_program(blocks):
+    """Blocks of forward and backward branches, so fixups stay pending across stream chunks"""
+    lines = []
+    for block in range(blocks):
+        lines += [f"block{block}:",
+                  f"    addi x5, x5, {block % 2048 - 1024}",
+                  f"    beq x5, x6, block{block + 1}",
+                  f"    lw x7, {4 * (block % 64)}(x0)",
+                  f"    add x8, x7, x7",
+                  f"    bne x8, x0, block{max(block - 1, 0)}",
+                  f"    jal x1, block{block + 1}"]
+    lines += [f"block{blocks}:", "halt:", "    j halt"]
+    return "\n".join(lines) + "\n"
+
+class StreamTest(unittest.TestCase):
+    """assemble_stream yields the same image as assemble_many"""
+
+    def assert_stream_matches(self, source):
+        batch = list(RiscAssembler().assemble_many(source))
+        stream = list(RiscAssembler().assemble_stream(io.StringIO(source)))
+        self.assertEqual([address for address, _ in stream], list(range(0, 4 * len(batch), 4)))
+        self.assertEqual([word for _, word in stream], batch)
+
+    def test_repository_programs(self):
+        for name in PROGRAMS:
+            with self.subTest(name):
+                self.assert_stream_matches(read_program(name))
+
+    def test_forward_references_across_chunks(self):
+        source = long_program(STREAM_CHUNK_WORDS // 6 + 100)
+        self.assert_stream_matches(source)
+
+    def test_written_output(self):
+        source = long_program(STREAM_CHUNK_WORDS // 6 + 100)
+        out = io.StringIO()
+        mode, formatter = OUTPUT_FORMATS['hex']
+        write_stream(RiscAssembler(), io.StringIO(source), out, formatter)
+        self.assertEqual(out.getvalue(), format_hex_image(RiscAssembler().assemble_many(source)))
+
+if __name__ == "__main__":
+    unittest.main()
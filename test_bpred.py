@@ -0,0 +1,99 @@
+"""Behaviour tests for risc_bpred.py; run with python -m unittest"""
+
+import os
+import unittest
+
+import numpy as np
+
+from risc_bpred import (BranchTrace, btb_lookup, load_trace, predict_bimodal, predict_gshare,
+                        saturating_counters)
+from risc_simulator import TRANSFER_BRANCH, TRANSFER_JAL, TRANSFER_JALR
+from test_assembler import ROOT
+
+def random_trace(seed, count, pcs=40):
+    """Transfers from a few pcs, each with its own bias, so counters both saturate and flip"""
+    rng = np.random.default_rng(seed)
+    sites = rng.integers(0, 1 << 12, pcs) << 2
+    bias = rng.random(pcs)
+    kinds = rng.choice([TRANSFER_BRANCH] * 6 + [TRANSFER_JAL, TRANSFER_JALR], pcs)
+    site = rng.integers(0, pcs, count)
+    taken = (rng.random(count) < bias[site]) | (kinds[site] != TRANSFER_BRANCH)
+    target = np.where(rng.random(count) < 0.9, sites[site] + 64, rng.integers(0, 1 << 12, count) << 2)
+    return BranchTrace(sites[site], target, kinds[site], taken)
+
+def reference_counters(index, taken, initial=1):
+    table = {}
+    values = []
+    for slot, outcome in zip(index, taken):
+        value = table.get(slot, initial)
+        values.append(value)
+        table[slot] = min(value + 1, 3) if outcome else max(value - 1, 0)
+    return values
+
+def reference_gshare(trace, table_bits, history_bits):
+    table = {}
+    history = 0
+    predictions = []
+    for pc, taken in zip(trace.pc[trace.conditional].tolist(), trace.taken[trace.conditional].tolist()):
+        index = ((pc >> 2) ^ history) & ((1 << table_bits) - 1)
+        value = table.get(index, 1)
+        predictions.append(value >= 2)
+        table[index] = min(value + 1, 3) if taken else max(value - 1, 0)
+        history = ((history << 1) | taken) & ((1 << history_bits) - 1)
+    return predictions
+
+def reference_btb(trace, entries):
+    table = {}
+    hits, targets = [], []
+    for pc, target, taken in zip(trace.pc.tolist(), trace.target.tolist(), trace.taken.tolist()):
+        slot = (pc >> 2) & (entries - 1)
+        entry = table.get(slot)
+        hits.append(entry is not None and entry[0] == pc)
+        targets.append(entry[1] if hits[-1] else None)
+        if taken:
+            table[slot] = (pc, target)
+    return hits, targets
+
+class PredictorTest(unittest.TestCase):
+    """The array evaluations match one-branch-at-a-time predictors"""
+
+    def traces(self):
+        yield random_trace(1, 5000)
+        yield random_trace(2, 20000, pcs=5)
+        yield random_trace(3, 3)
+        yield load_trace(os.path.join(ROOT, 'ooo_benchmark.s'))
+
+    def test_saturating_counters(self):
+        rng = np.random.default_rng(4)
+        for count, slots in ((1, 1), (7, 2), (5000, 3), (20000, 300)):
+            index = rng.integers(0, slots, count)
+            taken = rng.random(count) < rng.random()
+            for initial in range(4):
+                with self.subTest(count=count, initial=initial):
+                    self.assertEqual(saturating_counters(index, taken, initial).tolist(),
+                                     reference_counters(index.tolist(), taken.tolist(), initial))
+
+    def test_bimodal(self):
+        for trace in self.traces():
+            conditional = trace.conditional
+            index = ((trace.pc[conditional] >> 2) & 0xF).tolist()
+            expected = [value >= 2 for value in reference_counters(index, trace.taken[conditional].tolist())]
+            self.assertEqual(predict_bimodal(trace, table_bits=4).tolist(), expected)
+
+    def test_gshare(self):
+        for trace in self.traces():
+            for history_bits in (1, 4, 8):
+                self.assertEqual(predict_gshare(trace, 8, history_bits).tolist(),
+                                 reference_gshare(trace, 8, history_bits))
+
+    def test_btb(self):
+        for trace in self.traces():
+            for entries in (1, 4, 16):
+                hit, target = btb_lookup(trace, entries)
+                expected_hit, expected_target = reference_btb(trace, entries)
+                self.assertEqual(hit.tolist(), expected_hit)
+                self.assertEqual([value if found else None for value, found in zip(target.tolist(), expected_hit)],
+                                 expected_target)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,83 @@
+"""Behaviour tests for risc_cachesim.py; run with python -m unittest"""
+
+import os
+import unittest
+
+import numpy as np
+
+from risc_cachesim import CacheConfig, capture_trace, evaluate, load_trace, simulate
+from risc_fuzzer import generate_program
+from test_assembler import ROOT
+
+FIELDS = ('misses', 'fills', 'writebacks', 'memory_writes')
+
+def reference_cache(addresses, stores, config):
+    """(misses, fills, writebacks, memory_writes) of config, one byte address at a time"""
+    sets = [[] for _ in range(config.sets)]  # per set: [line, dirty], least recently used or oldest first
+    misses = fills = writebacks = memory_writes = 0
+    for address, store in zip(addresses, stores):
+        line = address // config.line
+        ways = sets[line % config.sets]
+        entry = next((entry for entry in ways if entry[0] == line), None)
+        if entry is not None:
+            if config.replacement == 'lru':
+                ways.remove(entry)
+                ways.append(entry)
+        else:
+            misses += 1
+            if store and not config.write_allocate:
+                memory_writes += 1
+                continue
+            fills += 1
+            if len(ways) == config.ways:
+                writebacks += ways.pop(0)[1]
+            entry = [line, False]
+            ways.append(entry)
+        if store:
+            if config.write_back:
+                entry[1] = True
+            else:
+                memory_writes += 1
+    return misses, fills, writebacks, memory_writes
+
+def configs(replacement='lru'):
+    """Small caches over every policy combination, so that evictions are frequent"""
+    return [CacheConfig(size, ways, line, replacement, write_back, write_allocate)
+            for size, ways, line in ((64, 1, 16), (128, 2, 16), (256, 4, 8), (256, 8, 32), (512, 2, 4))
+            for write_back in (True, False) for write_allocate in (True, False)]
+
+class CacheTest(unittest.TestCase):
+    """Stack-distance and replayed caches match a plain per-access cache"""
+
+    def assert_matches(self, stats, addresses, stores):
+        for result in stats:
+            with self.subTest(result.config.describe()):
+                self.assertEqual(tuple(getattr(result, field) for field in FIELDS),
+                                 reference_cache(addresses, stores, result.config))
+
+    def test_random_streams(self):
+        rng = np.random.default_rng(1)
+        for replacement in ('lru', 'fifo'):
+            for length, span in ((1, 64), (500, 256), (5000, 2048)):
+                addresses = rng.integers(0, span, length) * 4
+                stores = rng.random(length) < 0.3
+                stats = simulate(addresses >> 2, stores, length, configs(replacement), 4)
+                self.assert_matches(stats, addresses.tolist(), stores.tolist())
+
+    def test_program_traces(self):
+        traces = [load_trace(os.path.join(ROOT, 'ooo_benchmark.s'))]
+        for seed in range(3):
+            _, words, data = generate_program(seed, 60, avoid_hazards=True)
+            traces.append(capture_trace(list(words), data or None, max_steps=100_000))
+        for trace in traces:
+            fetches = [int(start) + 4 * offset
+                       for start, length in zip(trace.fetch_start.tolist(), trace.fetch_length.tolist())
+                       for offset in range(length)]
+            self.assertEqual(len(fetches), trace.fetches)
+            icaches = [config for config in configs() if config.write_allocate and config.write_back]
+            istats, dstats = evaluate(trace, icaches, configs())
+            self.assert_matches(istats, fetches, [False] * len(fetches))
+            self.assert_matches(dstats, trace.data_address.tolist(), trace.data_store.tolist())
+
+if __name__ == "__main__":
+    unittest.main()
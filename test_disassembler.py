@@ -0,0 +1,51 @@
+"""Behaviour tests for risc_disassembler.py; run with python -m unittest"""
+
+import random
+import unittest
+
+from risc_assembler import RiscAssembler
+from risc_disassembler import Disassembler
+from test_assembler import PROGRAMS, read_program
+
+# Opcodes the assembler produces, so random words of these mostly decode
+OPCODES = (0x33, 0x13, 0x03, 0x23, 0x63, 0x6F, 0x67, 0x37, 0x17, 0x73)
+
+def random_words(seed, count):
+    """Random words, half of them with an opcode field the assembler uses"""
+    rng = random.Random(seed)
+    words = [rng.getrandbits(32) for _ in range(count // 2)]
+    words += [(rng.getrandbits(25) << 7) | rng.choice(OPCODES) for _ in range(count - count // 2)]
+    return words
+
+class RoundTripTest(unittest.TestCase):
+    """Disassembled source assembles back to the same words"""
+
+    def assert_round_trip(self, words, symbols=None):
+        source = Disassembler().source(words, symbols)
+        self.assertEqual(list(RiscAssembler().assemble_many(source)), list(words))
+
+    def test_repository_programs(self):
+        for name in PROGRAMS:
+            with self.subTest(name):
+                assembler = RiscAssembler()
+                words = list(assembler.assemble_many(read_program(name)))
+                self.assert_round_trip(words)
+                self.assert_round_trip(words, assembler.text_symbols())
+
+    def test_random_words(self):
+        words = random_words(1, 20000)
+        self.assert_round_trip(words)
+        # Not everything came out as .word
+        source = Disassembler().source(words)
+        decoded = sum(not line.lstrip().startswith('.word') for line in source.splitlines())
+        self.assertGreater(decoded, len(words) // 5)
+
+    def test_bulk_matches_single_words(self):
+        words = random_words(2, 2000)
+        disassembler = Disassembler()
+        addresses = [4 * index for index in range(len(words))]
+        single = [disassembler.texts([word], [address])[0] for word, address in zip(words, addresses)]
+        self.assertEqual(disassembler.texts(words, addresses), single)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,62 @@
+"""Behaviour tests for risc_pipeline.py; run with python -m unittest"""
+
+import glob
+import os
+import random
+import unittest
+
+from risc_assembler import RiscAssembler
+from risc_fuzzer import IMEM_INDEX_BITS, IMEM_WORDS, generate_program
+from risc_pipeline import (PipelineModel, Testbench, UNTIL_HALT, UNTIL_X20, load_testbench,
+                           prepare_testbench)
+from test_assembler import PROGRAMS, ROOT
+
+FIELDS = ('cycles', 'retired', 'bubbles', 'load_use_stalls', 'taken_branches', 'jumps', 'lost_branches',
+          'stop_reason', 'regs', 'memory')
+
+def testbenches():
+    """(name, testbench) for random programs, the repository programs and the testbenches"""
+    for seed in range(30):
+        _, words, data = generate_program(seed, 20, avoid_hazards=seed % 3 != 0)
+        yield f"seed {seed}", Testbench.for_program(list(words), data, imem_words=IMEM_WORDS,
+                                                    imem_index_bits=IMEM_INDEX_BITS)
+    for name in PROGRAMS:
+        yield name, prepare_testbench(os.path.join(ROOT, name))
+    for path in sorted(glob.glob(os.path.join(ROOT, 'tb', 'cpu_*_tb.v'))):
+        if 'fuzz' not in path:
+            yield os.path.basename(path), load_testbench(path)
+
+class SummarizedTest(unittest.TestCase):
+    """A summarized run ends in the same state as a stepped one"""
+
+    def assert_same(self, testbench, **run):
+        stepped = PipelineModel(testbench, step=True)
+        summarized = PipelineModel(testbench)
+        self.assertEqual(summarized.run(**run), stepped.run(**run))
+        for field in FIELDS:
+            self.assertEqual(getattr(summarized, field), getattr(stepped, field), field)
+        return summarized.summarized
+
+    def test_stop_conditions(self):
+        rng = random.Random(1)
+        summarized = 0
+        for name, testbench in testbenches():
+            for run in ({'until': UNTIL_HALT, 'max_cycles': 20000},
+                        {'until': UNTIL_X20, 'max_cycles': 3000},
+                        {'cycles': rng.randint(1, 12)},
+                        {'cycles': rng.randint(5, 400)},
+                        {'until': UNTIL_HALT, 'max_cycles': rng.randint(1, 300)}):
+                with self.subTest(name, **run):
+                    summarized += self.assert_same(testbench, **run)
+        self.assertGreater(summarized, 50)
+
+    def test_long_loop(self):
+        source = "    addi x1, x0, 1000\nloop:\n    lw x2, 0(x0)\n    add x3, x3, x2\n" \
+                 "    sw x3, 4(x0)\n    addi x1, x1, -1\n    bne x1, x0, loop\nhalt:\n    j halt\n"
+        assembler = RiscAssembler()
+        testbench = Testbench.for_program(list(assembler.assemble_many(source)), assembler.data)
+        self.assertTrue(self.assert_same(testbench, until=UNTIL_HALT))
+        self.assertTrue(self.assert_same(testbench, cycles=4321))
+
+if __name__ == "__main__":
+    unittest.main()
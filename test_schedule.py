@@ -0,0 +1,69 @@
+"""Behaviour tests for the assembler's -O scheduling pass and --verify; run with python -m unittest"""
+
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+from risc_assembler import RiscAssembler, verify_schedule
+from risc_fuzzer import generate_program
+from test_assembler import ROOT
+
+# Eight passes of a loop whose load result is used straight away
+SUM_LOOP = """\
+.data
+values: .word 3, 1, 4, 1, 5, 9, 2, 6
+.text
+    la x1, values
+    addi x2, x0, 8
+    addi x3, x0, 0
+loop:
+    lw x4, 0(x1)
+    add x3, x3, x4
+    addi x1, x1, 4
+    addi x2, x2, -1
+    bne x2, x0, loop
+    sw x3, 64(x0)
+halt:
+    j halt
+"""
+
+class VerifyTest(unittest.TestCase):
+    """verify_schedule accepts what the scheduler produces and rejects a wrong schedule"""
+
+    def test_saves_stalls(self):
+        plain = list(RiscAssembler().assemble_many(SUM_LOOP))
+        scheduled = list(RiscAssembler(optimize=True).assemble_many(SUM_LOOP))
+        self.assertNotEqual(plain, scheduled)
+        self.assertEqual(sorted(plain), sorted(scheduled))
+        lines = verify_schedule(SUM_LOOP)
+        self.assertIn("verify: pipeline model matches, 78 -> 70 cycles (8 saved", lines[-1])
+
+    def test_random_programs(self):
+        for seed in range(20):
+            source = generate_program(seed, 60, avoid_hazards=True)[0]
+            with self.subTest(seed=seed):
+                self.assertTrue(verify_schedule(source)[-1].startswith("verify: pipeline model matches"))
+
+    def test_wrong_schedule_is_caught(self):
+        # Reversing each block breaks its dependencies
+        with mock.patch('risc_assembler.schedule_region', lambda words, *_: list(reversed(range(len(words))))):
+            with self.assertRaises(ValueError):
+                verify_schedule(SUM_LOOP)
+
+    def test_command_line(self):
+        with tempfile.TemporaryDirectory() as directory:
+            source = os.path.join(directory, 'sum.s')
+            with open(source, 'w') as f:
+                f.write(SUM_LOOP)
+            result = subprocess.run([sys.executable, os.path.join(ROOT, 'risc_assembler.py'), '-O', '--verify',
+                                     '-f', 'hex', source, os.path.join(directory, 'sum.hex')],
+                                    capture_output=True, text=True)
+        self.assertEqual(result.returncode, 0, result.stdout)
+        self.assertIn("1 load-use stall removed", result.stderr)
+        self.assertIn("verify: functional simulation matches (45 instructions)", result.stderr)
+
+if __name__ == "__main__":
+    unittest.main()
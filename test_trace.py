@@ -0,0 +1,64 @@
+"""Behaviour tests for risc_trace.py; run with python -m unittest"""
+
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from risc_assembler import RiscAssembler
+from risc_trace import (RECORD_DTYPE, capture_trace, first_difference, format_divergence, open_trace,
+                        record_trace)
+from test_assembler import read_program
+
+class DiffTest(unittest.TestCase):
+    """first_difference finds an injected divergence, wherever it is"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.program = list(RiscAssembler().assemble_many(read_program('ooo_benchmark.s')))
+        cls.records = capture_trace(cls.program)[0].copy()
+
+    def test_identical(self):
+        self.assertIsNone(first_difference(self.records, self.records.copy(), chunk=1000))
+
+    def test_injected_field(self):
+        count = len(self.records)
+        for index in (0, 1, 999, 1000, 1001, count // 2, count - 1):
+            for field in RECORD_DTYPE.names:
+                with self.subTest(index=index, field=field):
+                    changed = self.records.copy()
+                    changed[index][field] ^= 1 << 3
+                    self.assertEqual(first_difference(self.records, changed, chunk=1000), index)
+                    self.assertEqual(first_difference(changed, self.records, chunk=1000), index)
+                    report = format_divergence(self.records, changed, index)
+                    self.assertIn(f"at retired instruction {index} ", report)
+                    self.assertIn(f"Differing fields: {field}", report)
+
+    def test_truncated_and_halt_loop(self):
+        count = len(self.records)
+        self.assertEqual(first_difference(self.records, self.records[:count - 10]), count - 10)
+        # A testbench retires the halt loop on every pass; that is not a divergence
+        repeated = np.concatenate((self.records, np.repeat(self.records[-1:], 50)))
+        self.assertIsNone(first_difference(self.records, repeated, chunk=16))
+        repeated[-7]['value'] = 1
+        self.assertEqual(first_difference(self.records, repeated, chunk=16), len(repeated) - 7)
+
+    def test_changed_program(self):
+        # A different immediate in the loop changes the first record of that pc
+        changed = list(self.program)
+        pcs = self.records['pc'].tolist()
+        index = next(position for position, pc in enumerate(pcs)
+                     if pcs.count(pc) > 100 and (changed[pc >> 2] & 0x7F) == 0x13 and changed[pc >> 2] >> 7 & 0x1F)
+        pc = pcs[index]
+        changed[pc >> 2] ^= 1 << 20
+        with tempfile.TemporaryDirectory() as directory:
+            paths = [os.path.join(directory, name) for name in ('a.trace', 'b.trace')]
+            record_trace(self.program, paths[0])
+            record_trace(changed, paths[1])
+            a, b = (open_trace(path) for path in paths)
+            self.assertEqual(first_difference(a, b, chunk=1000), index)
+            del a, b
+
+if __name__ == "__main__":
+    unittest.main()